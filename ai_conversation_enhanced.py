@@ -1,281 +1,64 @@
 """
 Sistema de conversación con IA usando OpenAI - Versión Mejorada
-Integra knowledge base y curriculum del Dr. Xavier Xijemez Xifra
+Integra knowledge base y curriculum de la Dra. Dolores Remedios del Rincón
+
+Adaptador del perfil "enhanced" del motor de conversación compartido
+(ver conversation_engine).
 """
 
-import os
-import json
-from typing import Dict, Any, Optional
-from openai import OpenAI
-from datetime import datetime, timedelta
-import logging
+from typing import Dict, Any
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from conversation_engine import conversation_engine
 
 class EnhancedAIConversationManager:
-    def __init__(self):
-        try:
-            self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            print("✅ Cliente OpenAI inicializado correctamente")
-        except Exception as e:
-            print(f"❌ Error inicializando cliente OpenAI: {e}")
-            self.client = None
-        self.conversation_contexts = {}
-        
-        # Cargar knowledge base y curriculum
-        self.knowledge_base = self._load_knowledge_base()
-        self.doctor_info = self._load_doctor_info()
-        
-        # Prompt base mejorado para el asistente médico
-        self.base_prompt = f"""Eres una asistente virtual del Consultorio Médico de la Dra. Dolores Remedios del Rincón, especialista en Medicina Interna.
-
-INFORMACIÓN DEL DOCTOR:
-{self.doctor_info}
-
-BASE DE CONOCIMIENTO:
-{self.knowledge_base}
-
-TU ROL:
-- Eres la primera línea de contacto para pacientes que llaman al consultorio
-- Debes ser profesional, cálida y empática
-- Habla en español mexicano de manera natural
-- Proporciona información precisa basada en la knowledge base
-- Ayuda a agendar citas recopilando información necesaria
-- Responde preguntas sobre horarios, ubicación, preparación para consultas, etc.
-
-INSTRUCCIONES ESPECÍFICAS:
-1. SALUDO INICIAL: Saluda amablemente y presenta el consultorio
-2. IDENTIFICAR NECESIDAD: Pregunta en qué puede ayudar al paciente
-3. PROPORCIONAR INFORMACIÓN: Usa la knowledge base para responder preguntas
-4. AGENDAR CITA: Si el paciente quiere una cita, recopila:
-   - Nombre completo
-   - Número de teléfono
-   - Motivo de consulta
-   - Fecha/hora preferida (si menciona)
-5. CONFIRMAR: Resumen de la información antes de terminar
-
-CONTEXTO DE LA CONVERSACIÓN:
-- Esta es la llamada número {{step}} del paciente
-- Número de teléfono: {{phone_number}}
-- Información previa: {{previous_info}}
-
-IMPORTANTE:
-- Si es una emergencia, dirige al paciente a servicios de urgencias
-- Sé específica con horarios, ubicación y preparación
-- Mantén un tono profesional pero cálido
-- Confirma la información antes de terminar la conversación
-
-Responde de manera natural y conversacional, como si fuera una conversación real por teléfono."""
+    def __init__(self, engine=conversation_engine):
+        self.engine = engine
+        self.profile = engine.profile("enhanced")
+        self.conversation_contexts = engine.contexts(self.profile.name)
+    
+    @property
+    def client(self):
+        return self.engine.client
     
-    def _load_knowledge_base(self) -> str:
-        """Cargar la base de conocimiento desde el archivo"""
-        try:
-            with open('BaseDeConocimiento.txt', 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error cargando knowledge base: {e}")
-            return "Información del consultorio no disponible."
+    @property
+    def knowledge_base(self) -> str:
+        return self.engine.knowledge_base(self.profile)
     
-    def _load_doctor_info(self) -> str:
-        """Cargar información del doctor desde el archivo"""
-        try:
-            with open('CurriculumDr.XavierXijemezXifra.txt', 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error cargando información del doctor: {e}")
-            return "Información del doctor no disponible."
+    @property
+    def doctor_info(self) -> str:
+        return self.engine.doctor_info(self.profile)
     
     def get_conversation_context(self, phone_number: str) -> Dict[str, Any]:
         """Obtener contexto de conversación para un número de teléfono"""
-        if phone_number not in self.conversation_contexts:
-            self.conversation_contexts[phone_number] = {
-                "step": 0,
-                "data": {},
-                "conversation_history": [],
-                "appointment_info": {}
-            }
-        return self.conversation_contexts[phone_number]
+        return self.engine.get_context(self.profile, phone_number)
     
     def update_conversation_context(self, phone_number: str, step: int, data: Dict[str, Any] = None):
         """Actualizar contexto de conversación"""
-        if phone_number not in self.conversation_contexts:
-            self.conversation_contexts[phone_number] = {
-                "step": 0,
-                "data": {},
-                "conversation_history": [],
-                "appointment_info": {}
-            }
-        
-        self.conversation_contexts[phone_number]["step"] = step
-        if data:
-            self.conversation_contexts[phone_number]["data"].update(data)
+        self.engine.update_context(self.profile, phone_number, step, data)
     
     def add_to_conversation_history(self, phone_number: str, message: str, is_user: bool = False):
         """Agregar mensaje al historial de conversación"""
-        context = self.get_conversation_context(phone_number)
-        context["conversation_history"].append({
-            "message": message,
-            "is_user": is_user,
-            "timestamp": datetime.now().isoformat()
-        })
+        self.engine.add_to_history(self.profile, phone_number, message, is_user)
     
     def update_appointment_info(self, phone_number: str, info: Dict[str, Any]):
         """Actualizar información de cita"""
-        context = self.get_conversation_context(phone_number)
-        context["appointment_info"].update(info)
+        self.engine.update_appointment_info(self.profile, phone_number, info)
     
     async def generate_response(self, phone_number: str, user_input: str = None) -> str:
         """Generar respuesta usando OpenAI con knowledge base"""
-        try:
-            context = self.get_conversation_context(phone_number)
-            step = context["step"]
-            
-            # Si es la primera llamada y no hay input del usuario, generar saludo
-            if step == 0 and not user_input:
-                return await self._generate_greeting(phone_number)
-            
-            # Construir el prompt con contexto
-            prompt = self._build_enhanced_prompt(phone_number, user_input)
-            
-            # Llamar a OpenAI
-            response = await self._call_openai(prompt)
-            
-            # Actualizar contexto
-            if user_input:
-                self.add_to_conversation_history(phone_number, user_input, is_user=True)
-            self.add_to_conversation_history(phone_number, response, is_user=False)
-            
-            # Incrementar paso
-            self.update_conversation_context(phone_number, step + 1)
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"Error generando respuesta con OpenAI: {e}")
-            return self._get_fallback_response(step)
+        return await self.engine.generate_response(self.profile, phone_number, user_input)
     
-    async def _generate_greeting(self, phone_number: str) -> str:
-        """Generar saludo inicial personalizado"""
-        prompt = self.base_prompt.format(
-            step=0,
-            phone_number=phone_number,
-            previous_info="Primera llamada"
-        )
-        
-        try:
-            response = await self._call_openai(prompt + "\n\nGenera un saludo inicial amable y profesional que presente el consultorio de la Dra. Dolores Remedios del Rincón y pregunte en qué puede ayudar al paciente.")
-            self.update_conversation_context(phone_number, 1)
-            return response
-        except Exception as e:
-            logger.error(f"Error generando saludo: {e}")
-            return self._get_fallback_response(0)
+    async def generate_greeting_variant(self) -> str:
+        """Generar una versión del saludo inicial sin asociarla a un paciente"""
+        return await self.engine.generate_greeting_variant(self.profile)
     
-    def _build_enhanced_prompt(self, phone_number: str, user_input: str = None) -> str:
-        """Construir prompt mejorado para OpenAI"""
-        context = self.get_conversation_context(phone_number)
-        step = context["step"]
-        history = context["conversation_history"]
-        appointment_info = context.get("appointment_info", {})
-        
-        # Construir historial de conversación
-        conversation_text = ""
-        for msg in history[-5:]:  # Últimos 5 mensajes
-            role = "Paciente" if msg["is_user"] else "Asistente"
-            conversation_text += f"{role}: {msg['message']}\n"
-        
-        if user_input:
-            conversation_text += f"Paciente: {user_input}\n"
-        
-        # Información de cita si existe
-        appointment_text = ""
-        if appointment_info:
-            appointment_text = f"\nINFORMACIÓN DE CITA RECOPILADA:\n{json.dumps(appointment_info, indent=2, ensure_ascii=False)}"
-        
-        prompt = self.base_prompt.format(
-            step=step,
-            phone_number=phone_number,
-            previous_info=str(context["data"])
-        )
+    def extract_appointment_info(self, conversation_text: str, phone_number: str = None) -> Dict[str, Any]:
+        """Extraer información de cita del texto de conversación
         
-        prompt += f"\n\nHISTORIAL DE CONVERSACIÓN:\n{conversation_text}{appointment_text}\n\nAsistente:"
-        
-        return prompt
-    
-    async def _call_openai(self, prompt: str) -> str:
-        """Llamar a OpenAI API"""
-        try:
-            if not self.client:
-                raise Exception("Cliente OpenAI no inicializado")
-            
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Eres una asistente virtual médica profesional, cálida y empática del consultorio de la Dra. Dolores Remedios del Rincón. Responde en español mexicano de manera natural."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=400,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            logger.error(f"Error llamando a OpenAI: {e}")
-            raise e
-    
-    def _get_fallback_response(self, step: int) -> str:
-        """Respuesta de respaldo si OpenAI falla"""
-        fallback_responses = {
-            0: "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón, especialista en Medicina Interna. ¿En qué puedo ayudarle hoy?",
-            1: "Perfecto, entiendo su consulta. Un miembro de nuestro equipo se pondrá en contacto con usted para brindarle la información que necesita.",
-            2: "Excelente, he tomado nota de su información. Recibirá una confirmación de su cita pronto.",
-            3: "Gracias por su confianza en la Dra. Dolores Remedios del Rincón. Que tenga un excelente día."
-        }
-        
-        return fallback_responses.get(step, "Gracias por llamar al consultorio. Que tenga un excelente día.")
-    
-    def extract_appointment_info(self, conversation_text: str) -> Dict[str, Any]:
-        """Extraer información de cita del texto de conversación"""
-        try:
-            # Usar OpenAI para extraer información estructurada
-            prompt = f"""
-            Extrae la siguiente información de la conversación:
-            - Nombre del paciente
-            - Número de teléfono
-            - Motivo de consulta
-            - Fecha preferida (si se menciona)
-            - Hora preferida (si se menciona)
-            
-            Conversación: {conversation_text}
-            
-            Responde en formato JSON:
-            {{
-                "nombre": "string",
-                "telefono": "string", 
-                "motivo": "string",
-                "fecha_preferida": "string o null",
-                "hora_preferida": "string o null"
-            }}
-            """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Eres un asistente que extrae información estructurada de conversaciones."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=200,
-                temperature=0.1
-            )
-            
-            result = response.choices[0].message.content.strip()
-            return json.loads(result)
-            
-        except Exception as e:
-            logger.error(f"Error extrayendo información de cita: {e}")
-            return {}
+        Si se indica el teléfono se devuelven los datos ya acumulados turno a
+        turno, sin llamar a OpenAI.
+        """
+        return self.engine.extract_appointment_info(self.profile, conversation_text, phone_number)
 
 # Instancia global
-enhanced_ai_manager = EnhancedAIConversationManager() 
\ No newline at end of file
+enhanced_ai_manager = EnhancedAIConversationManager()
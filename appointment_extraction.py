@@ -0,0 +1,124 @@
+"""
+Extracción estructurada de datos de cita con tool calling de OpenAI
+
+En lugar de pedir JSON en texto libre y parsearlo después de la conversación,
+cada turno se responde a través de una herramienta con esquema estricto que
+devuelve, en la misma llamada, el texto para el paciente y los datos de la
+cita detectados en ese turno.
+"""
+
+import json
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+APPOINTMENT_FIELDS = ("nombre", "telefono", "motivo", "fecha_preferida", "hora_preferida")
+
+_NULLABLE_STRING = {"type": ["string", "null"]}
+
+# Esquema de los datos de cita (todos requeridos, null si no se mencionan)
+APPOINTMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nombre": {**_NULLABLE_STRING, "description": "Nombre completo del paciente"},
+        "telefono": {**_NULLABLE_STRING, "description": "Número de teléfono de contacto"},
+        "motivo": {**_NULLABLE_STRING, "description": "Motivo de la consulta"},
+        "fecha_preferida": {**_NULLABLE_STRING, "description": "Fecha preferida tal como la dijo el paciente"},
+        "hora_preferida": {**_NULLABLE_STRING, "description": "Hora preferida tal como la dijo el paciente"},
+    },
+    "required": list(APPOINTMENT_FIELDS),
+    "additionalProperties": False,
+}
+
+RESPOND_TOOL_NAME = "responder_paciente"
+
+# Herramienta para el turno principal: respuesta + datos de cita en una sola llamada
+RESPOND_TOOL = {
+    "type": "function",
+    "function": {
+        "name": RESPOND_TOOL_NAME,
+        "description": (
+            "Responder al paciente y registrar los datos de cita que haya "
+            "mencionado en su último mensaje. Usa null para los datos no mencionados."
+        ),
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "respuesta": {"type": "string", "description": "Respuesta hablada para el paciente"},
+                "datos_cita": APPOINTMENT_SCHEMA,
+            },
+            "required": ["respuesta", "datos_cita"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+RESPOND_TOOL_CHOICE = {"type": "function", "function": {"name": RESPOND_TOOL_NAME}}
+
+EXTRACT_TOOL_NAME = "registrar_datos_cita"
+
+# Herramienta para extraer datos de una conversación completa
+EXTRACT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": EXTRACT_TOOL_NAME,
+        "description": "Registrar los datos de cita mencionados en la conversación.",
+        "strict": True,
+        "parameters": APPOINTMENT_SCHEMA,
+    },
+}
+
+EXTRACT_TOOL_CHOICE = {"type": "function", "function": {"name": EXTRACT_TOOL_NAME}}
+
+
+def empty_appointment_info() -> Dict[str, Any]:
+    """Datos de cita vacíos"""
+    return {field: None for field in APPOINTMENT_FIELDS}
+
+
+def _tool_arguments(message, tool_name: str) -> Optional[Dict[str, Any]]:
+    """Argumentos de la llamada a `tool_name` en un mensaje de OpenAI"""
+    for tool_call in message.tool_calls or []:
+        if tool_call.function.name == tool_name:
+            return json.loads(tool_call.function.arguments)
+    return None
+
+
+def clean_appointment_info(data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Conservar solo los campos conocidos con valor"""
+    if not data:
+        return {}
+    return {
+        field: str(data[field]).strip()
+        for field in APPOINTMENT_FIELDS
+        if data.get(field) not in (None, "")
+    }
+
+
+def parse_turn(message) -> Tuple[str, Dict[str, Any]]:
+    """Obtener (respuesta, datos de cita del turno) de un mensaje con RESPOND_TOOL
+
+    Si el modelo respondió en texto plano se usa ese texto sin datos de cita.
+    """
+    try:
+        arguments = _tool_arguments(message, RESPOND_TOOL_NAME)
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.error(f"Argumentos de herramienta inválidos: {e}")
+        arguments = None
+
+    if arguments is None:
+        return (message.content or "").strip(), {}
+
+    return arguments.get("respuesta", "").strip(), clean_appointment_info(arguments.get("datos_cita"))
+
+
+def parse_extraction(message) -> Dict[str, Any]:
+    """Datos de cita de un mensaje con EXTRACT_TOOL, con todos los campos"""
+    result = empty_appointment_info()
+    result.update(clean_appointment_info(_tool_arguments(message, EXTRACT_TOOL_NAME)))
+    return result
+
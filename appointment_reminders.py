@@ -0,0 +1,406 @@
+"""
+Recordatorios automáticos de citas
+
+El programador escucha el índice local del calendario (CalendarIndex) y
+por cada cita con teléfono mete en un heap un recordatorio por cada
+desfase de REMINDER_SCHEDULE (por defecto 24 h antes por llamada y 2 h
+antes por n8n). Programar o reprogramar cuesta O(log n) y el loop solo
+duerme hasta el siguiente recordatorio, sin recorrer el calendario.
+
+- Citas canceladas o movidas: sus entradas quedan en el heap y se
+  descartan al salir (la cita ya no existe o cambió de hora)
+- Duplicados: cada envío se registra en SQLite (REMINDER_DB) con la clave
+  (evento, recordatorio, hora de la cita); un reinicio o una
+  re-sincronización no repite recordatorios ya enviados
+- Después de un reinicio se envían los recordatorios que vencieron con el
+  servidor apagado (hasta REMINDER_GRACE_MINUTES de atraso y si la cita no
+  ha empezado); una cita agendada a última hora no recibe los que ya pasaron
+- Las llamadas se agrupan en una campaña por día (call_campaigns), que
+  aplica los límites del proveedor y los reintentos; los avisos a n8n van por la
+  bandeja de salida (notification_outbox)
+"""
+
+import asyncio
+import heapq
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import logging
+
+from calendar_index import CalendarIndex, IndexedEvent
+from calendar_time import epoch_to_local
+from call_campaigns import campaign_scheduler
+from notification_outbox import notification_outbox
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Recordatorios como "desfase:canal" separados por comas (canal: call o n8n)
+REMINDER_SCHEDULE = os.getenv("REMINDER_SCHEDULE", "24h:call,2h:n8n")
+
+# Base SQLite con los recordatorios ya enviados
+REMINDER_DB = os.getenv("REMINDER_DB", "reminders.db")
+
+# Minutos de atraso con los que todavía se envía un recordatorio (p. ej. tras un reinicio)
+REMINDER_GRACE_MINUTES = int(os.getenv("REMINDER_GRACE_MINUTES", "180"))
+
+# Proveedor de las llamadas de recordatorio (telnyx o vapi)
+REMINDER_CALL_PROVIDER = os.getenv("REMINDER_CALL_PROVIDER", "vapi")
+
+# Código de país que se antepone a los teléfonos del índice (10 dígitos)
+REMINDER_COUNTRY_CODE = os.getenv("REMINDER_COUNTRY_CODE", "52")
+
+# Segundos máximos que duerme el loop entre revisiones del heap
+REMINDER_MAX_SLEEP = float(os.getenv("REMINDER_MAX_SLEEP", "60"))
+
+# Segundos antes de reintentar un recordatorio que no se pudo encolar
+REMINDER_RETRY_DELAY = float(os.getenv("REMINDER_RETRY_DELAY", "60"))
+
+CHANNELS = ("call", "n8n")
+
+_OFFSET = re.compile(r"^(\d+)\s*([hm])$")
+
+
+class Reminder(NamedTuple):
+    """Recordatorio vencido listo para enviarse"""
+    kind: str
+    channel: str
+    event: IndexedEvent
+
+
+def parse_schedule(spec: str) -> Dict[str, Tuple[int, str]]:
+    """Convertir "24h:call,2h:n8n" en {"24h": (86400, "call"), "2h": (7200, "n8n")}"""
+    schedule = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        offset, _, channel = item.partition(":")
+        match = _OFFSET.match(offset.strip().lower())
+        channel = channel.strip().lower() or "call"
+        if not match or channel not in CHANNELS:
+            raise ValueError(f"Recordatorio inválido en REMINDER_SCHEDULE: '{item}'")
+        amount, unit = int(match.group(1)), match.group(2)
+        schedule[offset.strip().lower()] = (amount * (3600 if unit == "h" else 60), channel)
+    return schedule
+
+
+class ReminderLog:
+    """Recordatorios enviados en SQLite, clave (evento, recordatorio, inicio de la cita)"""
+
+    def __init__(self, db_path: str = REMINDER_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS reminders_sent (
+                event_id TEXT NOT NULL, kind TEXT NOT NULL, start INTEGER NOT NULL,
+                channel TEXT NOT NULL, sent_at REAL NOT NULL,
+                PRIMARY KEY (event_id, kind, start)
+            );
+            CREATE TABLE IF NOT EXISTS reminder_meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+        """)
+        self._db.commit()
+
+    def claim(self, reminder: Reminder) -> bool:
+        """Registrar el envío; False si ya se había enviado"""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO reminders_sent (event_id, kind, start, channel, sent_at) VALUES (?, ?, ?, ?, ?)",
+                (reminder.event.event_id, reminder.kind, reminder.event.start, reminder.channel, time.time()),
+            )
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def release(self, reminders: List[Reminder]):
+        """Deshacer el registro de recordatorios que no se llegaron a encolar"""
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM reminders_sent WHERE event_id = ? AND kind = ? AND start = ?",
+                [(r.event.event_id, r.kind, r.event.start) for r in reminders],
+            )
+            self._db.commit()
+
+    def last_seen(self) -> Optional[float]:
+        """Última vez que el loop estuvo activo"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM reminder_meta WHERE key = 'last_seen'").fetchone()
+        return row[0] if row else None
+
+    def touch(self, now: float):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO reminder_meta (key, value) VALUES ('last_seen', ?)", (now,))
+            self._db.commit()
+
+    def prune(self, before: float):
+        """Olvidar los recordatorios de citas que empezaron antes de `before`"""
+        with self._lock:
+            self._db.execute("DELETE FROM reminders_sent WHERE start < ?", (before,))
+            self._db.commit()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT kind, COUNT(*) FROM reminders_sent GROUP BY kind").fetchall())
+
+
+class ReminderScheduler:
+    def __init__(self, schedule: Optional[Dict[str, Tuple[int, str]]] = None,
+                 log: Optional[ReminderLog] = None):
+        self.schedule = schedule if schedule is not None else parse_schedule(REMINDER_SCHEDULE)
+        self._log = log
+        # Citas vigentes y heap de (vence, evento, recordatorio, inicio de la cita)
+        self._events: Dict[str, IndexedEvent] = {}
+        self._heap: List[Tuple[float, str, str, int]] = []
+        self._queued: set = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # (último latido de la ejecución anterior, arranque): recordatorios perdidos al estar apagado
+        self._downtime: Optional[Tuple[float, float]] = None
+        self._stats = {"sent": 0, "expired": 0, "stale": 0}
+
+    @property
+    def log(self) -> ReminderLog:
+        # La base se abre al usarla, no al importar el módulo
+        if self._log is None:
+            self._log = ReminderLog()
+        return self._log
+
+    def watch(self, index: CalendarIndex):
+        """Programar las citas del índice y seguir sus cambios"""
+        index.add_listener(self.on_index_change)
+
+    def on_index_change(self, event: IndexedEvent, added: bool):
+        """Listener del índice (corre con el índice bloqueado, desde cualquier hilo)"""
+        if not event.phone:
+            return
+        with self._lock:
+            if not added:
+                # Una baja con otra hora es la copia vieja de una cita que se movió
+                current = self._events.get(event.event_id)
+                if current is not None and current.start == event.start:
+                    del self._events[event.event_id]
+                return
+            if self._events.get(event.event_id) == event:
+                return
+            self._events[event.event_id] = event
+            earliest = self._heap[0][0] if self._heap else None
+            now = time.time()
+            for kind, (offset, _) in self.schedule.items():
+                self._push(event.start - offset, event.event_id, kind, event.start, now)
+            self._compact()
+            woke = self._heap and (earliest is None or self._heap[0][0] < earliest)
+        if woke:
+            self._wake()
+
+    def _push(self, due_at: float, event_id: str, kind: str, start: int, now: float):
+        # Ni citas pasadas ni recordatorios atrasados, salvo los que vencieron con el servidor apagado
+        key = (event_id, kind, start)
+        if start <= now or key in self._queued:
+            return
+        if due_at < now and not self._missed(due_at, now):
+            return
+        self._queued.add(key)
+        heapq.heappush(self._heap, (due_at, event_id, kind, start))
+
+    def _missed(self, due_at: float, now: float) -> bool:
+        if self._downtime is None or now - due_at > REMINDER_GRACE_MINUTES * 60:
+            return False
+        last_seen, started_at = self._downtime
+        return last_seen <= due_at <= started_at
+
+    def _compact(self):
+        # Las entradas de citas canceladas o movidas se limpian cuando ya son mayoría
+        if len(self._heap) <= 2 * len(self._events) + 64:
+            return
+        self._heap = [entry for entry in self._heap if self._is_current(entry)]
+        heapq.heapify(self._heap)
+        self._queued = {(event_id, kind, start) for _, event_id, kind, start in self._heap}
+
+    def _is_current(self, entry: Tuple[float, str, str, int]) -> bool:
+        event = self._events.get(entry[1])
+        return event is not None and event.start == entry[3]
+
+    def pop_due(self, now: float) -> List[Reminder]:
+        """Sacar del heap los recordatorios vencidos y vigentes"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                due_at, event_id, kind, start = entry
+                self._queued.discard((event_id, kind, start))
+                if not self._is_current(entry):
+                    self._stats["stale"] += 1
+                    continue
+                if start <= now or now - due_at > REMINDER_GRACE_MINUTES * 60:
+                    self._stats["expired"] += 1
+                    logger.warning(f"⏰ Recordatorio {kind} de {event_id} vencido sin enviarse")
+                    continue
+                due.append(Reminder(kind, self.schedule[kind][1], self._events[event_id]))
+            if not self._events:
+                self._heap.clear()
+                self._queued.clear()
+        return due
+
+    def retry_later(self, reminders: List[Reminder]):
+        """Volver a programar recordatorios que fallaron al encolarse"""
+        now = time.time()
+        with self._lock:
+            for reminder in reminders:
+                event = reminder.event
+                self._push(now + REMINDER_RETRY_DELAY, event.event_id, reminder.kind, event.start, now)
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def start(self, index: Optional[CalendarIndex] = None):
+        """Arrancar el loop (llamar desde el evento startup)"""
+        if self._task:
+            return
+        now = time.time()
+        last_seen = self.log.last_seen()
+        self._downtime = (last_seen, now) if last_seen else None
+        self.log.prune(now - 7 * 24 * 3600)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if index is not None:
+            self.watch(index)
+        self._task = self._loop.create_task(self._run())
+        logger.info(f"⏰ Recordatorios de citas activos: {', '.join(self.schedule)}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _wake(self):
+        # Un recordatorio nuevo vence antes de lo que el loop iba a dormir
+        if self._loop and self._wakeup and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            self.log.touch(now)
+            due = self.pop_due(now)
+            if due:
+                try:
+                    await self.send(due)
+                except Exception as e:
+                    logger.error(f"❌ Error enviando recordatorios: {e}")
+
+            next_due = self.next_due()
+            timeout = REMINDER_MAX_SLEEP if next_due is None else min(REMINDER_MAX_SLEEP, max(0.0, next_due - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send(self, reminders: List[Reminder]):
+        """Enviar los recordatorios que no se hayan enviado antes
+
+        Un recordatorio que no se pudo encolar (campaña u outbox) libera su
+        registro y se reintenta en REMINDER_RETRY_DELAY segundos.
+        """
+        calls = [r for r in reminders if r.channel == "call" and self.log.claim(r)]
+        if calls:
+            # Una sola campaña de recordatorios por día y proveedor, no una por lote
+            campaign_id = f"recordatorios-{REMINDER_CALL_PROVIDER}-{epoch_to_local(int(time.time())).strftime('%Y-%m-%d')}"
+            try:
+                appended = campaign_scheduler.append(campaign_id, REMINDER_CALL_PROVIDER,
+                                                     [self._target(r.event) for r in calls])
+            except Exception as e:
+                self.log.release(calls)
+                self.retry_later(calls)
+                logger.error(f"❌ No se pudieron encolar {len(calls)} llamadas de recordatorio, se reintentan: {e}")
+            else:
+                if appended:
+                    self._stats["sent"] += len(calls)
+                    logger.info(f"📞 {len(calls)} llamadas de recordatorio en la campaña {campaign_id}")
+                else:
+                    logger.warning(f"⚠️ Campaña {campaign_id} cancelada: {len(calls)} llamadas de recordatorio sin hacer")
+
+        notifications = [r for r in reminders if r.channel == "n8n"]
+        if notifications and not notification_outbox.configured:
+            logger.warning(f"⚠️ N8N_WEBHOOK_URL no configurada: {len(notifications)} recordatorios sin enviar")
+            return
+        for reminder in notifications:
+            if not self.log.claim(reminder):
+                continue
+            try:
+                # La bandeja de salida se encarga de los reintentos
+                notification_outbox.enqueue("appointment_reminder", {"reminder": reminder.kind, **self._target(reminder.event)})
+            except Exception as e:
+                self.log.release([reminder])
+                self.retry_later([reminder])
+                logger.error(f"❌ No se pudo encolar el recordatorio {reminder.kind} de {reminder.event.event_id}: {e}")
+                continue
+            self._stats["sent"] += 1
+            logger.info(f"🔔 Recordatorio {reminder.kind} encolado para n8n: {reminder.event.event_id}")
+
+    @staticmethod
+    def _target(event: IndexedEvent) -> Dict[str, str]:
+        start = epoch_to_local(event.start)
+        name = event.summary.split(":", 1)[1].strip() if ":" in event.summary else event.summary
+        return {
+            "phone_number": f"+{REMINDER_COUNTRY_CODE}{event.phone}",
+            "patient_name": name,
+            "appointment_time": start.strftime("%Y-%m-%d %H:%M"),
+            "event_id": event.event_id,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        next_due = self.next_due()
+        with self._lock:
+            scheduled, queued = len(self._events), len(self._heap)
+        return {
+            "appointments": scheduled,
+            "queued": queued,
+            "next_due": epoch_to_local(int(next_due)).isoformat() if next_due else None,
+            "sent_total": self.log.counts(),
+            **self._stats,
+        }
+
+# Instancia global del programador de recordatorios
+reminder_scheduler = ReminderScheduler()
+
+
+def check_moves() -> List[str]:
+    """Mover una cita a un día anterior y a uno posterior, re-sincronizando ambos días en los dos órdenes"""
+    failures = []
+    base = int(time.time()) + 10 * 24 * 3600
+    original = IndexedEvent("ev1", base, base + 1800, "Cita: Ana", "6621234567")
+    for label, offset in (("día anterior", -2), ("día posterior", 2)):
+        moved = original._replace(start=base + offset * 86400, end=base + offset * 86400 + 1800)
+        for order in ("nuevo primero", "viejo primero"):
+            index = CalendarIndex()
+            scheduler = ReminderScheduler(schedule={"24h": (86400, "call")})
+            index.store_day("A", [original])
+            scheduler.watch(index)
+            days = [("B", [moved]), ("A", [])]
+            for date, events in days if order == "nuevo primero" else reversed(days):
+                index.store_day(date, events)
+
+            current = [entry for entry in scheduler._heap if scheduler._is_current(entry)]
+            checks = {
+                "date_of": index.date_of("ev1") == "B",
+                "find_by_phone": index.find_by_phone("6621234567") == [moved],
+                "recordatorios": [entry[3] for entry in current] == [moved.start],
+            }
+            failures += [f"{label}, {order}: falla {name}" for name, ok in checks.items() if not ok]
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_moves()
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Citas movidas de día: recordatorios e índice correctos")
+    raise SystemExit(1 if failures else 0)
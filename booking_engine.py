@@ -0,0 +1,110 @@
+"""
+Motor de reservas con concurrencia optimista
+
+Evita que dos llamadas simultáneas reserven el mismo horario:
+1. Aparta el horario candidato con un lease de corta duración
+2. Re-verifica el horario contra el índice del calendario recién sincronizado
+3. Inserta la cita y libera el lease
+Si el horario está apartado u ocupado, pasa automáticamente al siguiente libre.
+"""
+
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from calendar_time import day_bounds, format_wall_time, free_slots, local_to_epoch
+from calendar_index import RECHECK_MAX_AGE
+from google_calendar_manager import calendar_manager
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Conflictos detectados en la re-verificación antes de rendirse
+MAX_BOOKING_ATTEMPTS = int(os.getenv("BOOKING_MAX_ATTEMPTS", "5"))
+
+
+class BookingEngine:
+    def __init__(self, calendar, duration_minutes: int = 30):
+        self.calendar = calendar
+        # Se comparte la tabla de leases del calendario para respetar los
+        # horarios apartados con hold_slot durante una llamada
+        self.leases = calendar.leases
+        self.duration_minutes = duration_minutes
+
+    def _candidate_times(self, date: str, preferred_time: Optional[str], holder: str) -> List[str]:
+        """Horarios a intentar: el preferido primero y luego los libres posteriores"""
+        day = day_bounds(date)
+        busy = self.calendar.get_unavailable_intervals(date, holder)
+
+        candidates = [format_wall_time(day, start) for start in free_slots(day, busy, self.duration_minutes)]
+
+        if preferred_time:
+            # Respetar la hora pedida y ofrecer las siguientes como respaldo
+            later = [t for t in candidates if t > preferred_time]
+            candidates = [preferred_time] + later
+
+        return candidates
+
+    def book(self, appointment_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Reservar una cita en el primer horario libre desde la hora pedida"""
+        if not self.calendar.service:
+            return {"success": False, "error": "Servicio no disponible"}
+
+        date = appointment_data.get('fecha') or self.calendar.get_next_available_date()
+        preferred_time = appointment_data.get('hora')
+        holder = uuid.uuid4().hex
+        step = self.duration_minutes * 60
+
+        # Validar antes de buscar horarios: un dato mal formado no es un error del servidor
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            return {"success": False, "invalid": True, "error": f"Fecha inválida: {date} (formato YYYY-MM-DD)"}
+        if preferred_time:
+            try:
+                preferred_time = datetime.strptime(preferred_time, "%H:%M").strftime("%H:%M")
+            except (TypeError, ValueError):
+                return {"success": False, "invalid": True, "error": f"Hora inválida: {preferred_time} (formato HH:MM)"}
+
+        try:
+            candidates = self._candidate_times(date, preferred_time, holder)
+        except Exception as e:
+            logger.error(f"Error obteniendo horarios candidatos: {e}")
+            return {"success": False, "error": str(e)}
+
+        conflicts = 0
+        for slot_time in candidates:
+            if conflicts >= MAX_BOOKING_ATTEMPTS:
+                break
+            start = local_to_epoch(date, slot_time)
+            end = start + step
+
+            # 1. Apartar el horario; si otra llamada lo tiene, pasar al siguiente
+            lease = self.leases.acquire(date, start, end, holder)
+            if lease is None:
+                logger.info(f"⏭️  Horario {date} {slot_time} apartado por otra llamada")
+                continue
+
+            try:
+                # 2. Re-verificar contra el índice con una sincronización reciente
+                busy = self.calendar.get_busy_intervals(date, max_age=RECHECK_MAX_AGE)
+                if self.calendar.index.overlaps(busy, start, end):
+                    conflicts += 1
+                    logger.info(f"⏭️  Horario {date} {slot_time} ya ocupado, probando el siguiente")
+                    continue
+
+                # 3. Insertar la cita
+                result = self.calendar.create_appointment({**appointment_data, 'fecha': date, 'hora': slot_time})
+                if result.get("success"):
+                    result.update({"fecha": date, "hora": slot_time})
+                return result
+            finally:
+                self.leases.release(lease.lease_id)
+
+        return {"success": False, "error": f"No hay horarios disponibles para el {date}"}
+
+# Instancia global del motor de reservas
+booking_engine = BookingEngine(calendar_manager)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Compilar la base de conocimiento en el artefacto que carga el servidor
+
+Uso:
+    python build_knowledge.py [--output knowledge.kb] [--strict]
+
+Se ejecuta en el build (railway.toml y Dockerfile); termina con error si
+falta un archivo fuente o no se encontró ninguna pregunta frecuente. Los
+marcadores sin completar ([HORA], [DIRECCIÓN COMPLETA], ...) en los datos
+del consultorio o en los textos solo se advierten, salvo con --strict.
+"""
+
+import argparse
+import sys
+
+from knowledge_base import KNOWLEDGE_ARTIFACT, KNOWLEDGE_SOURCES, compile_knowledge, read_sources, write_artifact
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compilar la base de conocimiento")
+    parser.add_argument("--output", default=KNOWLEDGE_ARTIFACT, help="Ruta del artefacto")
+    parser.add_argument("--strict", action="store_true", help="Fallar si quedan datos sin completar")
+    args = parser.parse_args()
+
+    try:
+        documents = read_sources(KNOWLEDGE_SOURCES)
+    except OSError as e:
+        print(f"❌ Error leyendo las fuentes de conocimiento: {e}")
+        return 1
+
+    try:
+        body = compile_knowledge(documents, KNOWLEDGE_SOURCES)
+    except (ValueError, KeyError) as e:
+        print(f"❌ Datos del consultorio inválidos: {e}")
+        return 1
+    if not body["qa"]:
+        print("❌ No se encontraron preguntas frecuentes en la base de conocimiento")
+        return 1
+    if body["placeholders"]:
+        print(f"{'❌' if args.strict else '⚠️ '} Datos del consultorio sin completar:")
+        for placeholder in body["placeholders"]:
+            print(f"   {placeholder}")
+        if args.strict:
+            return 1
+
+    checksum = write_artifact(body, args.output)
+    print(f"✅ {args.output} ({checksum[:12]}): {len(body['qa'])} preguntas, {len(body['index'])} términos")
+    for name, tokens in body["fragment_tokens"].items():
+        print(f"   {name}: ~{tokens} tokens")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
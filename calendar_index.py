@@ -0,0 +1,214 @@
+"""
+Índice local del calendario
+
+Caché en memoria de los eventos de Google Calendar por día, con los
+intervalos ocupados ya parseados a segundos epoch. Evita consultar a Google
+en cada verificación de disponibilidad y permite re-verificar un slot justo
+antes de insertar una cita.
+
+También mantiene un índice de teléfono normalizado -> citas, para encontrar
+la cita de un paciente sin recorrer el calendario, y avisa a los listeners
+de cada evento que entra o sale (por ejemplo, los recordatorios de citas).
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from calendar_time import merge_intervals
+
+# Segundos que un día sincronizado se considera vigente
+INDEX_TTL_SECONDS = int(os.getenv("CALENDAR_INDEX_TTL", "60"))
+
+# Antigüedad máxima (segundos) aceptada al re-verificar un horario antes de insertar
+RECHECK_MAX_AGE = float(os.getenv("BOOKING_RECHECK_MAX_AGE", "5"))
+
+_NON_DIGITS = re.compile(r"\D+")
+_PHONE_IN_DESCRIPTION = re.compile(r"Tel[eé]fono:\s*([+\d][\d\s().-]*)")
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """Normalizar un teléfono a sus últimos 10 dígitos (número nacional de México)
+
+    "+52 1 662 123 4567", "526621234567" y "662-123-4567" dan la misma clave.
+    """
+    digits = _NON_DIGITS.sub("", phone or "")
+    return digits[-10:]
+
+
+def phone_from_description(description: Optional[str]) -> str:
+    """Extraer el teléfono normalizado de la descripción de una cita"""
+    match = _PHONE_IN_DESCRIPTION.search(description or "")
+    return normalize_phone(match.group(1)) if match else ""
+
+
+class IndexedEvent(NamedTuple):
+    """Evento del calendario ya parseado"""
+    event_id: str
+    start: int
+    end: int
+    summary: str = ""
+    phone: str = ""
+
+
+# listener(evento, True) al entrar o cambiar un evento, listener(evento, False) al salir
+IndexListener = Callable[[IndexedEvent, bool], None]
+
+
+class _DayEntry:
+    """Eventos de un día y su lista de intervalos ocupados fusionados"""
+
+    def __init__(self, events: Dict[str, IndexedEvent], synced_at: float):
+        self.events = events
+        self.synced_at = synced_at
+        self.refresh_busy()
+
+    def refresh_busy(self):
+        self.busy = merge_intervals([(event.start, event.end) for event in self.events.values()])
+
+
+class CalendarIndex:
+    def __init__(self, ttl_seconds: int = INDEX_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._days: Dict[str, _DayEntry] = {}
+        self._event_dates: Dict[str, str] = {}
+        self._by_phone: Dict[str, Set[str]] = {}
+        self._listeners: List[IndexListener] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener: IndexListener):
+        """Avisar de los eventos ya indexados y de cada cambio posterior
+
+        Se llama con el índice bloqueado: el listener debe ser rápido y no
+        consultar el índice.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            for entry in self._days.values():
+                for event in entry.events.values():
+                    listener(event, True)
+
+    def get_busy(self, date: str, max_age: Optional[float] = None) -> Optional[List[Tuple[int, int]]]:
+        """Intervalos ocupados del día, o None si no está sincronizado o expiró"""
+        max_age = self.ttl_seconds if max_age is None else max_age
+        with self._lock:
+            entry = self._days.get(date)
+            if entry is None or time.monotonic() - entry.synced_at > max_age:
+                return None
+            return entry.busy
+
+    def store_day(self, date: str, events: List[IndexedEvent]):
+        """Reemplazar los eventos del día con el resultado de una sincronización"""
+        with self._lock:
+            previous = self._days[date].events if date in self._days else {}
+            entry = _DayEntry({event.event_id: event for event in events}, time.monotonic())
+
+            # Un evento que ya se indexó en otro día (se movió) no sale del índice
+            removed = []
+            for event_id, event in previous.items():
+                if self._event_dates.get(event_id) == date:
+                    self._unlink(event)
+                    if event_id not in entry.events:
+                        removed.append(event)
+
+            self._days[date] = entry
+            for event in entry.events.values():
+                self._link(date, event)
+
+            # Solo se avisa lo que cambió respecto a la sincronización anterior
+            for event in removed:
+                self._notify(event, False)
+            for event_id, event in entry.events.items():
+                if previous.get(event_id) != event:
+                    self._notify(event, True)
+
+    def add_event(self, date: str, event: IndexedEvent):
+        """Registrar un evento recién creado sin volver a consultar a Google"""
+        with self._lock:
+            entry = self._days.get(date)
+            if entry is None:
+                # Sin sincronizar: solo se conoce este evento, forzar recarga al leer
+                entry = _DayEntry({}, float("-inf"))
+                self._days[date] = entry
+
+            entry.events[event.event_id] = event
+            entry.refresh_busy()
+            self._link(date, event)
+            self._notify(event, True)
+
+    def remove_event(self, event_id: str):
+        """Quitar un evento cancelado del índice"""
+        with self._lock:
+            date = self._event_dates.get(event_id)
+            entry = self._days.get(date) if date else None
+            event = entry.events.pop(event_id, None) if entry else None
+            if event:
+                self._unlink(event)
+                entry.refresh_busy()
+                self._notify(event, False)
+
+    def date_of(self, event_id: str) -> Optional[str]:
+        """Día en el que está indexado un evento, o None"""
+        with self._lock:
+            return self._event_dates.get(event_id)
+
+    def find_by_phone(self, phone: str, after: int = 0) -> List[IndexedEvent]:
+        """Citas indexadas para un teléfono que terminan después de `after` (epoch)"""
+        key = normalize_phone(phone)
+        if not key:
+            return []
+
+        with self._lock:
+            found = []
+            for event_id in self._by_phone.get(key, ()):
+                entry = self._days.get(self._event_dates.get(event_id, ""))
+                event = entry.events.get(event_id) if entry else None
+                if event and event.end > after:
+                    found.append(event)
+        found.sort(key=lambda event: event.start)
+        return found
+
+    def invalidate(self, date: str):
+        """Marcar un día como no sincronizado"""
+        with self._lock:
+            entry = self._days.get(date)
+            if entry:
+                entry.synced_at = float("-inf")
+
+    def _notify(self, event: IndexedEvent, added: bool):
+        for listener in self._listeners:
+            listener(event, added)
+
+    def _link(self, date: str, event: IndexedEvent):
+        moved_from = self._event_dates.get(event.event_id)
+        if moved_from is not None and moved_from != date:
+            # El evento cambió de día: sale del día anterior aunque ese día aún no se re-sincronice
+            old_entry = self._days.get(moved_from)
+            old_event = old_entry.events.pop(event.event_id, None) if old_entry else None
+            if old_event:
+                self._unlink(old_event)
+                old_entry.refresh_busy()
+        self._event_dates[event.event_id] = date
+        if event.phone:
+            self._by_phone.setdefault(event.phone, set()).add(event.event_id)
+
+    def _unlink(self, event: IndexedEvent):
+        self._event_dates.pop(event.event_id, None)
+        if event.phone:
+            ids = self._by_phone.get(event.phone)
+            if ids is not None:
+                ids.discard(event.event_id)
+                if not ids:
+                    del self._by_phone[event.phone]
+
+    @staticmethod
+    def overlaps(busy: List[Tuple[int, int]], start: int, end: int) -> bool:
+        """Verificar si [start, end) se cruza con algún intervalo ocupado"""
+        for busy_start, busy_end in busy:
+            if busy_start >= end:
+                break
+            if busy_end > start:
+                return True
+        return False
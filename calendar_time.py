@@ -0,0 +1,145 @@
+"""
+Manejo de tiempo para el calendario del consultorio
+
+Todas las comparaciones del calendario se hacen con enteros (segundos epoch).
+Los límites de cada día se calculan una sola vez en la zona horaria de la
+clínica (America/Mexico_City) y se guardan en caché.
+"""
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Any, List, NamedTuple, Tuple
+from zoneinfo import ZoneInfo
+
+# Zona horaria del consultorio
+CLINIC_TZ_NAME = "America/Mexico_City"
+CLINIC_TZ = ZoneInfo(CLINIC_TZ_NAME)
+
+# Horario de trabajo (hora local del consultorio)
+WORK_START_HOUR = 8   # 8:00 AM
+WORK_END_HOUR = 18    # 6:00 PM
+
+
+class DayBounds(NamedTuple):
+    """Límites de un día en segundos epoch"""
+    day_start: int
+    day_end: int
+    work_start: int
+    work_end: int
+
+
+@lru_cache(maxsize=512)
+def day_bounds(date: str) -> DayBounds:
+    """Calcular los límites del día (YYYY-MM-DD) en la zona horaria de la clínica"""
+    local_day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=CLINIC_TZ)
+    next_day = (local_day + timedelta(days=1)).replace(tzinfo=CLINIC_TZ)
+
+    return DayBounds(
+        day_start=int(local_day.timestamp()),
+        day_end=int(next_day.timestamp()),
+        work_start=int(local_day.replace(hour=WORK_START_HOUR).timestamp()),
+        work_end=int(local_day.replace(hour=WORK_END_HOUR).timestamp()),
+    )
+
+
+@lru_cache(maxsize=4096)
+def _parse_iso(value: str) -> int:
+    """Convertir una fecha ISO 8601 (RFC 3339) a segundos epoch"""
+    if len(value) == 10:
+        # Eventos de todo el día: solo fecha, medianoche local
+        return day_bounds(value).day_start
+
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=CLINIC_TZ)
+    return int(parsed.timestamp())
+
+
+def event_time_to_epoch(event_time: Dict[str, Any]) -> int:
+    """Convertir el campo start/end de un evento de Google Calendar a epoch"""
+    return _parse_iso(event_time.get("dateTime") or event_time["date"])
+
+
+def event_interval(event: Dict[str, Any]) -> Tuple[int, int]:
+    """Obtener el intervalo (inicio, fin) de un evento en segundos epoch"""
+    return event_time_to_epoch(event["start"]), event_time_to_epoch(event["end"])
+
+
+def busy_intervals(events: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+    """Parsear los eventos una sola vez a intervalos ocupados, ordenados y fusionados"""
+    intervals = []
+    for event in events:
+        try:
+            intervals.append(event_interval(event))
+        except (KeyError, ValueError):
+            continue
+    return merge_intervals(intervals)
+
+
+def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Ordenar y fusionar intervalos solapados en una lista disjunta"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_slots(day: DayBounds, busy: List[Tuple[int, int]], duration_minutes: int = 30) -> List[int]:
+    """Inicios (epoch) de los slots libres del horario laboral
+
+    `busy` debe estar ordenado y fusionado; se recorre con un solo puntero.
+    """
+    step = duration_minutes * 60
+    slots = []
+    index = 0
+    total = len(busy)
+    current = day.work_start
+
+    while current + step <= day.work_end:
+        slot_end = current + step
+        # Descartar intervalos que terminan antes del slot
+        while index < total and busy[index][1] <= current:
+            index += 1
+        if index >= total or busy[index][0] >= slot_end:
+            slots.append(current)
+        current = slot_end
+
+    return slots
+
+
+def epoch_to_rfc3339(epoch: int) -> str:
+    """Formatear un epoch como RFC 3339 en UTC (para timeMin/timeMax)"""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def epoch_to_local(epoch: int) -> datetime:
+    """Convertir un epoch a datetime en la zona horaria de la clínica"""
+    return datetime.fromtimestamp(epoch, tz=CLINIC_TZ)
+
+
+def local_to_epoch(date: str, time: str) -> int:
+    """Convertir fecha (YYYY-MM-DD) y hora (HH:MM) locales a epoch"""
+    local = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M").replace(tzinfo=CLINIC_TZ)
+    return int(local.timestamp())
+
+
+def format_wall_time(day: DayBounds, epoch: int) -> str:
+    """Formatear un epoch del horario laboral como HH:MM sin crear datetimes
+
+    Las transiciones de horario de verano ocurren de madrugada, nunca dentro
+    del horario laboral, así que el desfase respecto a work_start es exacto.
+    """
+    minutes = WORK_START_HOUR * 60 + (epoch - day.work_start) // 60
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def today_local() -> str:
+    """Fecha actual (YYYY-MM-DD) en la zona horaria de la clínica"""
+    return datetime.now(CLINIC_TZ).strftime("%Y-%m-%d")
@@ -0,0 +1,726 @@
+"""
+Campañas de llamadas salientes (recordatorios de citas)
+
+POST /campaigns recibe una lista JSON o un CSV de pacientes y el
+programador hace las llamadas en segundo plano:
+- Por proveedor (Telnyx o Vapi) un token bucket limita las llamadas por
+  segundo (CPS) y un semáforo las llamadas activas a la vez. El lugar se
+  libera con el evento de colgado del webhook o tras CAMPAIGN_CALL_TIMEOUT
+- Ocupado, sin respuesta o error del proveedor se reintenta con backoff
+  exponencial y jitter hasta CAMPAIGN_MAX_ATTEMPTS intentos
+- Telnyx: al contestar (call.answered) se lee el recordatorio con speak y
+  se cuelga al terminar (call.speak.ended). Vapi: el recordatorio va como
+  firstMessage y los datos de la cita en variableValues
+- Cada cambio de estado se guarda en SQLite (CAMPAIGN_DB); al reiniciar se
+  retoman las campañas en curso sin volver a marcar las llamadas que
+  estaban saliendo (pudieron llegar al proveedor)
+- `report()` da el avance y el ritmo (llamadas por minuto y tiempo restante)
+
+Estados de cada llamada: pending -> dialing -> active -> completed, o de
+vuelta a pending para reintentar, o failed / cancelled.
+"""
+
+import asyncio
+import base64
+import csv
+import io
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import logging
+
+from resilience import TokenBucket, UpstreamUnavailable, upstream
+from vapi_client import VapiError, async_vapi_client
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Base SQLite con el avance de las campañas
+CAMPAIGN_DB = os.getenv("CAMPAIGN_DB", "campaigns.db")
+
+# Intentos por paciente y espera base entre intentos (segundos, se duplica en cada intento)
+CAMPAIGN_MAX_ATTEMPTS = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "3"))
+CAMPAIGN_RETRY_DELAY = float(os.getenv("CAMPAIGN_RETRY_DELAY", "600"))
+
+# Segundos que una llamada ocupa su lugar si no llega el evento de colgado
+CAMPAIGN_CALL_TIMEOUT = float(os.getenv("CAMPAIGN_CALL_TIMEOUT", "300"))
+
+# Segundos máximos entre revisiones de llamadas pendientes
+CAMPAIGN_POLL_INTERVAL = float(os.getenv("CAMPAIGN_POLL_INTERVAL", "5"))
+
+# Límites de cada proveedor: (llamadas por segundo, llamadas activas a la vez)
+PROVIDER_LIMITS = {
+    "telnyx": (float(os.getenv("CAMPAIGN_TELNYX_CPS", "1")), int(os.getenv("CAMPAIGN_TELNYX_MAX_CONCURRENT", "10"))),
+    "vapi": (float(os.getenv("CAMPAIGN_VAPI_CPS", "2")), int(os.getenv("CAMPAIGN_VAPI_MAX_CONCURRENT", "10"))),
+}
+
+# Configuración de Telnyx para llamadas salientes
+TELNYX_API_KEY = os.getenv("TELNYX_API_KEY")
+TELNYX_CONNECTION_ID = os.getenv("TELNYX_CONNECTION_ID")
+TELNYX_PHONE_NUMBER = os.getenv("TELNYX_PHONE_NUMBER", "+526624920537")
+TELNYX_WEBHOOK_URL = os.getenv("TELNYX_WEBHOOK_URL", "https://web-production-a2b02.up.railway.app/telnyx-webhook")
+TELNYX_TIMEOUT = aiohttp.ClientTimeout(total=float(os.getenv("TELNYX_TIMEOUT", "10")))
+
+# Voz e idioma con los que Telnyx lee el recordatorio al contestar
+TELNYX_SPEAK_VOICE = os.getenv("TELNYX_SPEAK_VOICE", "female")
+TELNYX_SPEAK_LANGUAGE = os.getenv("TELNYX_SPEAK_LANGUAGE", "es-MX")
+
+# Asistente de Vapi para las llamadas de recordatorio (vacío: el asistente por defecto)
+VAPI_REMINDER_ASSISTANT_ID = os.getenv("VAPI_REMINDER_ASSISTANT_ID") or None
+
+# Mensaje del recordatorio ({patient_name}, {appointment_time}, {reason})
+CAMPAIGN_REMINDER_MESSAGE = os.getenv(
+    "CAMPAIGN_REMINDER_MESSAGE",
+    "Hola {patient_name}, le llamamos del consultorio para recordarle su cita del {appointment_time}. "
+    "Si no puede asistir, por favor llámenos para reprogramarla. Gracias.",
+)
+
+PENDING = "pending"
+DIALING = "dialing"
+ACTIVE = "active"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Causas de colgado que se reintentan
+BUSY_CAUSES = {"user_busy", "call_rejected", "customer-busy"}
+NO_ANSWER_CAUSES = {"timeout", "no_answer", "originator_cancel", "customer-did-not-answer"}
+
+_PHONE = re.compile(r"^\+?\d{8,15}$")
+
+# Nombres de columna aceptados en el CSV o el JSON
+FIELD_ALIASES = {
+    "phone_number": ("phone_number", "phone", "telefono", "teléfono"),
+    "patient_name": ("patient_name", "name", "nombre"),
+    "appointment_time": ("appointment_time", "appointment", "cita", "fecha"),
+    "reason": ("reason", "motivo"),
+}
+
+
+class DialError(Exception):
+    """No se pudo hacer la llamada; `retryable` si vale la pena otro intento"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def parse_targets(content: str, content_type: str = "") -> Tuple[List[Dict[str, str]], List[str]]:
+    """Pacientes de un CSV o de una lista JSON; devuelve (válidos, errores)
+
+    Se descartan los teléfonos inválidos y los repetidos.
+    """
+    if "csv" in content_type or not content.lstrip().startswith(("[", "{")):
+        rows = list(csv.DictReader(io.StringIO(content)))
+    else:
+        data = json.loads(content)
+        rows = data.get("calls", []) if isinstance(data, dict) else data
+
+    targets, errors, seen = [], [], set()
+    for line, row in enumerate(rows, start=1):
+        row = {str(key).strip().lower(): value for key, value in row.items() if key}
+        target = {}
+        for field, aliases in FIELD_ALIASES.items():
+            value = next((row[alias] for alias in aliases if row.get(alias)), "")
+            target[field] = str(value).strip()
+        phone = re.sub(r"[\s().-]", "", target["phone_number"])
+        if not _PHONE.match(phone):
+            errors.append(f"Fila {line}: teléfono inválido '{target['phone_number']}'")
+            continue
+        if phone in seen:
+            errors.append(f"Fila {line}: teléfono repetido {phone}")
+            continue
+        seen.add(phone)
+        target["phone_number"] = phone if phone.startswith("+") else f"+{phone}"
+        targets.append(target)
+    return targets, errors
+
+
+def reminder_message(target: Dict[str, str]) -> str:
+    """Texto del recordatorio para un paciente"""
+    text = CAMPAIGN_REMINDER_MESSAGE.format(
+        patient_name=target.get("patient_name") or "",
+        appointment_time=target.get("appointment_time") or "día acordado",
+        reason=target.get("reason") or "",
+    )
+    # Sin nombre o motivo quedan espacios sueltos ("Hola , le llamamos")
+    return re.sub(r"\s+([,.])", r"\1", " ".join(text.split()))
+
+
+def encode_client_state(state: Dict[str, Any]) -> str:
+    return base64.b64encode(json.dumps(state, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def decode_client_state(client_state: Optional[str]) -> Dict[str, Any]:
+    """client_state de un webhook de Telnyx, o {} si falta o no es nuestro"""
+    if not client_state:
+        return {}
+    try:
+        state = json.loads(base64.b64decode(client_state).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def hangup_outcome(cause: Optional[str]) -> str:
+    """Resultado según la causa de colgado de Telnyx o el endedReason de Vapi: busy, no_answer o completed"""
+    cause = (cause or "").lower()
+    if cause in BUSY_CAUSES:
+        return "busy"
+    if cause in NO_ANSWER_CAUSES:
+        return "no_answer"
+    return "completed"
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff exponencial con jitter: entre la mitad y el total de la espera"""
+    delay = CAMPAIGN_RETRY_DELAY * 2 ** max(0, attempts - 1)
+    return random.uniform(delay / 2, delay)
+
+
+class CampaignStore:
+    """Campañas y llamadas en SQLite"""
+
+    def __init__(self, db_path: str = CAMPAIGN_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS campaigns (
+                id TEXT PRIMARY KEY, provider TEXT NOT NULL, status TEXT NOT NULL,
+                created_at REAL NOT NULL, started_at REAL, finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS campaign_calls (
+                campaign_id TEXT NOT NULL, idx INTEGER NOT NULL, target TEXT NOT NULL,
+                status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0, call_id TEXT, answered INTEGER NOT NULL DEFAULT 0,
+                last_outcome TEXT, last_error TEXT, updated_at REAL,
+                PRIMARY KEY (campaign_id, idx)
+            );
+            CREATE INDEX IF NOT EXISTS campaign_calls_due ON campaign_calls (campaign_id, status, next_attempt_at);
+        """)
+        self._db.commit()
+
+    def create(self, provider: str, targets: List[Dict[str, str]]) -> str:
+        campaign_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO campaigns (id, provider, status, created_at, started_at) VALUES (?, ?, 'running', ?, ?)",
+                (campaign_id, provider, now, now),
+            )
+            self._db.executemany(
+                "INSERT INTO campaign_calls (campaign_id, idx, target, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(campaign_id, idx, json.dumps(target, ensure_ascii=False), PENDING, now)
+                 for idx, target in enumerate(targets)],
+            )
+            self._db.commit()
+        return campaign_id
+
+    def append(self, campaign_id: str, provider: str, targets: List[Dict[str, str]]) -> bool:
+        """Agregar llamadas a una campaña con id fijo (la crea si no existe); False si está cancelada"""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT status FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+            if row is None:
+                self._db.execute(
+                    "INSERT INTO campaigns (id, provider, status, created_at, started_at) VALUES (?, ?, 'running', ?, ?)",
+                    (campaign_id, provider, now, now),
+                )
+            elif row["status"] == CANCELLED:
+                return False
+            else:
+                self._db.execute("UPDATE campaigns SET status = 'running', finished_at = NULL WHERE id = ?", (campaign_id,))
+            start = self._db.execute(
+                "SELECT COALESCE(MAX(idx) + 1, 0) FROM campaign_calls WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone()[0]
+            self._db.executemany(
+                "INSERT INTO campaign_calls (campaign_id, idx, target, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(campaign_id, start + offset, json.dumps(target, ensure_ascii=False), PENDING, now)
+                 for offset, target in enumerate(targets)],
+            )
+        return True
+
+    def campaign(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+        return dict(row) if row else None
+
+    def campaigns(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM campaigns" + (" WHERE status = ?" if status else "") + " ORDER BY created_at DESC"
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, (status,) if status else ())]
+
+    def set_campaign(self, campaign_id: str, **fields: Any):
+        self._update("campaigns", "id = ?", (campaign_id,), fields)
+
+    def call(self, campaign_id: str, idx: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM campaign_calls WHERE campaign_id = ? AND idx = ?", (campaign_id, idx)
+            ).fetchone()
+        return self._call_row(row)
+
+    def due_calls(self, campaign_id: str, now: float, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM campaign_calls WHERE campaign_id = ? AND status = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at, idx LIMIT ?",
+                (campaign_id, PENDING, now, limit),
+            ).fetchall()
+        return [self._call_row(row) for row in rows]
+
+    def next_attempt_at(self, campaign_id: str) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM campaign_calls WHERE campaign_id = ? AND status = ?",
+                (campaign_id, PENDING),
+            ).fetchone()
+        return row[0]
+
+    def update_call(self, campaign_id: str, idx: int, **fields: Any):
+        fields["updated_at"] = time.time()
+        self._update("campaign_calls", "campaign_id = ? AND idx = ?", (campaign_id, idx), fields)
+
+    def cancel_pending(self, campaign_id: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE campaign_calls SET status = ?, updated_at = ? WHERE campaign_id = ? AND status = ?",
+                (CANCELLED, time.time(), campaign_id, PENDING),
+            )
+            self._db.commit()
+
+    def counts(self, campaign_id: str) -> Dict[str, Any]:
+        """Llamadas por estado, intentos, contestadas y resultados (ocupado, sin respuesta, error)"""
+        with self._lock:
+            statuses = self._db.execute(
+                "SELECT status, COUNT(*), SUM(attempts), SUM(answered) FROM campaign_calls "
+                "WHERE campaign_id = ? GROUP BY status",
+                (campaign_id,),
+            ).fetchall()
+            outcomes = self._db.execute(
+                "SELECT last_outcome, COUNT(*) FROM campaign_calls "
+                "WHERE campaign_id = ? AND last_outcome IS NOT NULL GROUP BY last_outcome",
+                (campaign_id,),
+            ).fetchall()
+        return {
+            "status": {status: count for status, count, _, _ in statuses},
+            "attempts": sum(attempts or 0 for _, _, attempts, _ in statuses),
+            "answered": sum(answered or 0 for _, _, _, answered in statuses),
+            "last_outcome": {outcome: count for outcome, count in outcomes},
+        }
+
+    def recover(self) -> List[str]:
+        """Después de un reinicio: cerrar con resultado desconocido lo que estaba marcando o activo
+
+        Una llamada en dialing pudo llegar al proveedor antes de que stop()
+        cancelara la petición; volver a marcarla repetiría el recordatorio.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE campaign_calls SET status = ?, last_outcome = 'unknown', "
+                "last_error = 'interrumpida por un reinicio al marcar', updated_at = ? "
+                "WHERE status = ? AND attempts > 0",
+                (COMPLETED, now, DIALING),
+            )
+            self._db.execute(
+                "UPDATE campaign_calls SET status = ?, updated_at = ? WHERE status = ?", (PENDING, now, DIALING)
+            )
+            # El evento de colgado pudo perderse con el reinicio
+            self._db.execute(
+                "UPDATE campaign_calls SET status = ?, last_outcome = 'unknown', updated_at = ? WHERE status = ?",
+                (COMPLETED, now, ACTIVE),
+            )
+            self._db.commit()
+            rows = self._db.execute("SELECT id FROM campaigns WHERE status = 'running'").fetchall()
+        return [row[0] for row in rows]
+
+    def _update(self, table: str, where: str, params: tuple, fields: Dict[str, Any]):
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE {table} SET {assignments} WHERE {where}", (*fields.values(), *params))
+            self._db.commit()
+
+    @staticmethod
+    def _call_row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        call = dict(row)
+        call["target"] = json.loads(call["target"])
+        return call
+
+
+class ProviderLimiter:
+    """Llamadas por segundo (token bucket) y llamadas activas a la vez (semáforo) de un proveedor"""
+
+    def __init__(self, cps: float, max_concurrent: int):
+        # Ráfaga de 1: las llamadas salen espaciadas en lugar de todas juntas
+        self.bucket = TokenBucket(cps, burst=1)
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        await self._slots.acquire()
+        try:
+            while not self.bucket.try_take(time.monotonic()):
+                await asyncio.sleep((1 - self.bucket.tokens) / self.bucket.rate)
+        except asyncio.CancelledError:
+            self._slots.release()
+            raise
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+
+class TelnyxDialer:
+    """Llamadas salientes por Telnyx Call Control con una sesión compartida"""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=TELNYX_TIMEOUT,
+                headers={"Authorization": f"Bearer {TELNYX_API_KEY}"},
+            )
+        return self._session
+
+    async def dial(self, target: Dict[str, str], client_state: Dict[str, Any]) -> str:
+        # El webhook de call.answered solo recibe el client_state: lleva lo necesario para leer el recordatorio
+        state = {
+            **client_state,
+            "patient_name": target.get("patient_name", ""),
+            "appointment_time": target.get("appointment_time", ""),
+        }
+        payload = {
+            "to": target["phone_number"],
+            "from": TELNYX_PHONE_NUMBER,
+            "webhook_url": TELNYX_WEBHOOK_URL,
+            "webhook_url_method": "POST",
+            "client_state": encode_client_state(state),
+        }
+        if TELNYX_CONNECTION_ID:
+            payload["connection_id"] = TELNYX_CONNECTION_ID
+
+        try:
+            with upstream("telnyx").guard():
+                async with self._get_session().post("https://api.telnyx.com/v2/calls", json=payload) as response:
+                    # Los 5xx cuentan como fallo del servicio para el circuit breaker
+                    if response.status >= 500:
+                        response.raise_for_status()
+                    data = await response.json(content_type=None)
+        except UpstreamUnavailable as e:
+            raise DialError(str(e)) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DialError(f"Telnyx: {type(e).__name__} {e}") from e
+        except ValueError as e:
+            # Cuerpo que no es JSON (p. ej. una página de error de un proxy)
+            raise DialError(f"Telnyx {response.status}: respuesta inválida", retryable=response.status == 429) from e
+
+        if response.status >= 400:
+            raise DialError(f"Telnyx {response.status}: {data}", retryable=response.status == 429)
+        try:
+            return data["data"]["call_control_id"]
+        except (KeyError, TypeError) as e:
+            raise DialError(f"Telnyx: respuesta sin call_control_id: {data}", retryable=False) from e
+
+    async def action(self, call_control_id: str, action: str, payload: Dict[str, Any]):
+        """Comando de Call Control sobre una llamada en curso (speak, hangup)"""
+        url = f"https://api.telnyx.com/v2/calls/{call_control_id}/actions/{action}"
+        try:
+            with upstream("telnyx").guard():
+                async with self._get_session().post(url, json=payload) as response:
+                    if response.status >= 500:
+                        response.raise_for_status()
+                    if response.status >= 400:
+                        raise DialError(f"Telnyx {action} {response.status}: {await response.text()}", retryable=False)
+        except UpstreamUnavailable as e:
+            raise DialError(str(e)) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DialError(f"Telnyx {action}: {type(e).__name__} {e}") from e
+
+    async def speak(self, call_control_id: str, text: str, client_state: Optional[str] = None):
+        payload = {"payload": text, "voice": TELNYX_SPEAK_VOICE, "language": TELNYX_SPEAK_LANGUAGE}
+        if client_state:
+            payload["client_state"] = client_state
+        await self.action(call_control_id, "speak", payload)
+
+    async def hangup(self, call_control_id: str):
+        await self.action(call_control_id, "hangup", {})
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+class VapiDialer:
+    """Llamadas salientes por Vapi
+
+    Los datos de la cita van en metadata (para los webhooks) y en
+    assistantOverrides: variableValues para las {{variables}} del prompt
+    y firstMessage con el recordatorio, porque el asistente no ve metadata.
+    """
+
+    async def dial(self, target: Dict[str, str], client_state: Dict[str, Any]) -> str:
+        metadata = {"type": "appointment_reminder", **client_state, **target}
+        overrides = {
+            "firstMessage": reminder_message(target),
+            "variableValues": {key: value for key, value in target.items() if value},
+        }
+        try:
+            call = await async_vapi_client.create_call(target["phone_number"], metadata,
+                                                       assistant_id=VAPI_REMINDER_ASSISTANT_ID,
+                                                       assistant_overrides=overrides)
+        except VapiError as e:
+            retryable = e.status_code is None or e.status_code == 429 or e.status_code >= 500
+            raise DialError(str(e), retryable=retryable) from e
+        return call.id
+
+    async def close(self):
+        pass
+
+
+class CampaignScheduler:
+    def __init__(self, store: Optional[CampaignStore] = None, dialers: Optional[Dict[str, Any]] = None,
+                 limits: Dict[str, Tuple[float, int]] = PROVIDER_LIMITS):
+        self._store = store
+        self.dialers = dialers or {"telnyx": TelnyxDialer(), "vapi": VapiDialer()}
+        self.limiters = {provider: ProviderLimiter(*limits[provider]) for provider in self.dialers}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # call_id -> (campaña, índice, proveedor, temporizador del lugar ocupado)
+        self._active: Dict[str, Tuple[str, int, str, asyncio.TimerHandle]] = {}
+        self._dials: set = set()
+
+    @property
+    def store(self) -> CampaignStore:
+        # La base se abre al usarla, no al importar el módulo
+        if self._store is None:
+            self._store = CampaignStore()
+        return self._store
+
+    def create(self, provider: str, targets: List[Dict[str, str]]) -> str:
+        """Guardar la campaña y empezar a llamar"""
+        campaign_id = self.store.create(provider, targets)
+        logger.info(f"📣 Campaña {campaign_id}: {len(targets)} llamadas por {provider}")
+        self._start(campaign_id)
+        return campaign_id
+
+    def append(self, campaign_id: str, provider: str, targets: List[Dict[str, str]]) -> bool:
+        """Agregar llamadas a una campaña que se reutiliza (p. ej. la de recordatorios del día)
+
+        False si la campaña fue cancelada: sus llamadas nuevas no se hacen.
+        """
+        if not self.store.append(campaign_id, provider, targets):
+            return False
+        task = self._tasks.get(campaign_id)
+        if task is None or task.done():
+            self._start(campaign_id)
+        return True
+
+    def start(self):
+        """Retomar las campañas en curso (llamar desde el evento startup)"""
+        for campaign_id in self.store.recover():
+            logger.info(f"📣 Retomando campaña {campaign_id}")
+            self._start(campaign_id)
+
+    async def stop(self):
+        """Detener las campañas; el avance queda guardado para retomarlas"""
+        for task in list(self._tasks.values()) + list(self._dials):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), *self._dials, return_exceptions=True)
+        for dialer in self.dialers.values():
+            await dialer.close()
+
+    async def cancel(self, campaign_id: str) -> bool:
+        if self.store.campaign(campaign_id) is None:
+            return False
+        task = self._tasks.pop(campaign_id, None)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.store.cancel_pending(campaign_id)
+        self.store.set_campaign(campaign_id, status=CANCELLED, finished_at=time.time())
+        return True
+
+    def _start(self, campaign_id: str):
+        task = asyncio.get_running_loop().create_task(self._run(campaign_id))
+        self._tasks[campaign_id] = task
+        # Solo se quita si sigue siendo la tarea registrada (append() puede reemplazarla)
+        task.add_done_callback(lambda done: self._tasks.pop(campaign_id) if self._tasks.get(campaign_id) is done else None)
+
+    async def _run(self, campaign_id: str):
+        provider = self.store.campaign(campaign_id)["provider"]
+        limiter = self.limiters[provider]
+        while True:
+            now = time.time()
+            due = self.store.due_calls(campaign_id, now, limiter.max_concurrent)
+            for call in due:
+                await limiter.acquire()
+                attempts = call["attempts"] + 1
+                self.store.update_call(campaign_id, call["idx"], status=DIALING, attempts=attempts)
+                task = asyncio.create_task(self._dial(campaign_id, provider, call["idx"], call["target"], attempts))
+                self._dials.add(task)
+                task.add_done_callback(self._dials.discard)
+            if due:
+                continue
+
+            status = self.store.counts(campaign_id)["status"]
+            if not any(status.get(state) for state in (PENDING, DIALING, ACTIVE)):
+                break
+            next_at = self.store.next_attempt_at(campaign_id)
+            wait = CAMPAIGN_POLL_INTERVAL if next_at is None else min(CAMPAIGN_POLL_INTERVAL, max(0.05, next_at - now))
+            await asyncio.sleep(wait)
+
+        self.store.set_campaign(campaign_id, status=COMPLETED, finished_at=time.time())
+        logger.info(f"✅ Campaña {campaign_id} terminada: {self.report(campaign_id)['calls']}")
+
+    async def _dial(self, campaign_id: str, provider: str, idx: int, target: Dict[str, str], attempts: int):
+        limiter = self.limiters[provider]
+        try:
+            call_id = await self.dialers[provider].dial(target, {"campaign": campaign_id, "call": idx})
+        except DialError as e:
+            limiter.release()
+            logger.warning(f"📵 Campaña {campaign_id} #{idx}: {e}")
+            self._retry_or_fail(campaign_id, idx, attempts, "error", str(e), e.retryable)
+            return
+        except asyncio.CancelledError:
+            limiter.release()
+            raise
+        except Exception as e:
+            # Un error inesperado del dialer no debe dejar el lugar ocupado ni la llamada en dialing
+            limiter.release()
+            logger.error(f"❌ Campaña {campaign_id} #{idx}: error inesperado {type(e).__name__}: {e}")
+            self._retry_or_fail(campaign_id, idx, attempts, "error", f"{type(e).__name__}: {e}")
+            return
+
+        self.store.update_call(campaign_id, idx, status=ACTIVE, call_id=call_id)
+        timer = asyncio.get_running_loop().call_later(CAMPAIGN_CALL_TIMEOUT, self._expire, call_id)
+        self._active[call_id] = (campaign_id, idx, provider, timer)
+
+    def _retry_or_fail(self, campaign_id: str, idx: int, attempts: int, outcome: str,
+                       error: Optional[str] = None, retryable: bool = True):
+        campaign = self.store.campaign(campaign_id)
+        if campaign and campaign["status"] == CANCELLED:
+            # Llamada en curso al cancelar la campaña: no vuelve a pending
+            self.store.update_call(campaign_id, idx, status=CANCELLED, last_outcome=outcome, last_error=error)
+        elif retryable and attempts < CAMPAIGN_MAX_ATTEMPTS:
+            self.store.update_call(campaign_id, idx, status=PENDING, last_outcome=outcome, last_error=error,
+                                   call_id=None, answered=0, next_attempt_at=time.time() + retry_delay(attempts))
+        else:
+            self.store.update_call(campaign_id, idx, status=FAILED, last_outcome=outcome, last_error=error)
+
+    def _finish(self, call_id: str) -> Optional[Tuple[str, int]]:
+        """Liberar el lugar de una llamada activa; (campaña, índice) o None si no es de una campaña"""
+        entry = self._active.pop(call_id, None)
+        if entry is None:
+            return None
+        campaign_id, idx, provider, timer = entry
+        timer.cancel()
+        self.limiters[provider].release()
+        return campaign_id, idx
+
+    def _expire(self, call_id: str):
+        finished = self._finish(call_id)
+        if finished:
+            self.store.update_call(*finished, status=COMPLETED, last_outcome="unknown")
+
+    def record_answered(self, call_id: str):
+        """Evento de llamada contestada (call.answered de Telnyx)"""
+        if call_id in self._active:
+            campaign_id, idx, _, _ = self._active[call_id]
+            self.store.update_call(campaign_id, idx, answered=1)
+
+    async def speak_reminder(self, call_id: Optional[str], client_state: Optional[str]) -> bool:
+        """call.answered de Telnyx: leer el recordatorio si la llamada es de una campaña"""
+        if not call_id:
+            return False
+        self.record_answered(call_id)
+        state = decode_client_state(client_state)
+        if "campaign" not in state:
+            return False
+        try:
+            # El mismo client_state vuelve en call.speak.ended para colgar al terminar
+            await self.dialers["telnyx"].speak(call_id, reminder_message(state), client_state)
+        except DialError as e:
+            logger.error(f"❌ Campaña {state['campaign']} #{state.get('call')}: no se pudo leer el recordatorio: {e}")
+            return False
+        return True
+
+    async def end_reminder(self, call_id: Optional[str], client_state: Optional[str]) -> bool:
+        """call.speak.ended de Telnyx: colgar la llamada de recordatorio"""
+        if not call_id or "campaign" not in decode_client_state(client_state):
+            return False
+        try:
+            await self.dialers["telnyx"].hangup(call_id)
+        except DialError as e:
+            logger.warning(f"📵 No se pudo colgar {call_id}: {e}")
+            return False
+        return True
+
+    def record_hangup(self, call_id: Optional[str], cause: Optional[str] = None):
+        """Evento de colgado: libera el lugar y decide si se reintenta"""
+        if not call_id:
+            return
+        finished = self._finish(call_id)
+        if finished is None:
+            return
+        call = self.store.call(*finished)
+        outcome = hangup_outcome(cause)
+        if outcome == "completed":
+            self.store.update_call(*finished, status=COMPLETED, last_outcome=outcome)
+        else:
+            self._retry_or_fail(*finished, call["attempts"], outcome, cause)
+
+    def report(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """Avance y ritmo de la campaña"""
+        campaign = self.store.campaign(campaign_id)
+        if campaign is None:
+            return None
+        counts = self.store.counts(campaign_id)
+        total = sum(counts["status"].values())
+        done = sum(counts["status"].get(state, 0) for state in (COMPLETED, FAILED, CANCELLED))
+        elapsed = max(1e-6, (campaign["finished_at"] or time.time()) - campaign["started_at"])
+        remaining = total - done
+        # Tiempo restante al ritmo de cierre de llamadas que lleva la campaña
+        eta = None
+        if not remaining:
+            eta = 0
+        elif done:
+            eta = round(remaining * elapsed / done, 1)
+        return {
+            "campaign_id": campaign_id,
+            "provider": campaign["provider"],
+            "status": campaign["status"],
+            "total": total,
+            "calls": counts["status"],
+            "outcomes": counts["last_outcome"],
+            "attempts": counts["attempts"],
+            "answered": counts["answered"],
+            "active": self.limiters[campaign["provider"]].active,
+            "elapsed_seconds": round(elapsed, 1),
+            "calls_per_minute": round(counts["attempts"] / elapsed * 60, 2),
+            "eta_seconds": eta,
+        }
+
+    def reports(self) -> List[Dict[str, Any]]:
+        return [self.report(campaign["id"]) for campaign in self.store.campaigns()]
+
+# Instancia global del programador de campañas
+campaign_scheduler = CampaignScheduler()
@@ -0,0 +1,508 @@
+"""
+Motor de conversación compartido
+
+Los gestores de conversación (básico, mejorado y Karla) son adaptadores
+delgados sobre este motor. Los perfiles de persona y prompt son datos
+(PROFILES); el cliente de LLM, el almacén de contextos, la base de
+conocimiento precompilada (ver knowledge_base) y la caché de respuestas
+existen una sola vez por proceso.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import logging
+
+from appointment_extraction import (
+    RESPOND_TOOL, RESPOND_TOOL_CHOICE, EXTRACT_TOOL, EXTRACT_TOOL_CHOICE,
+    empty_appointment_info, parse_extraction, parse_turn
+)
+from llm_backends import create_llm_client
+from llm_cache import llm_cache, prompt_fingerprint
+from llm_executor import llm_executor
+from model_router import RouteDecision, model_router
+from conversation_records import ConversationContext, ConversationSummary, HistoryRing
+from knowledge_base import knowledge_store, spoken_list
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Mensajes recientes que se conservan textuales en el historial
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "6"))
+
+# Con más mensajes que esto, los anteriores se compactan en el resumen
+HISTORY_COMPACT_AFTER = int(os.getenv("HISTORY_COMPACT_AFTER", "12"))
+
+# Caracteres máximos del resumen de la conversación anterior
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "600"))
+
+SUMMARY_INSTRUCTION = (
+    "Resume la conversación en español en un párrafo breve: datos que dio el paciente, "
+    "lo que pidió y lo que quedó pendiente. No inventes datos."
+)
+
+
+class ConversationProfile(NamedTuple):
+    """Persona y prompts de un asistente"""
+    name: str
+    # Plantilla con {step}, {phone_number}, {previous_info}, {knowledge_base} y {doctor_info}
+    base_prompt: str
+    system_message: str
+    # Etiqueta del paciente en el historial ("Usuario" o "Paciente")
+    speaker: str
+    greeting_instruction: str
+    greeting_variant_instruction: str
+    fallback_responses: Dict[int, str]
+    fallback_default: str
+    extraction_system: str
+    # Dónde se acumulan los datos de cita del turno: "data" o "appointment_info"
+    appointment_key: str = "data"
+    # Incluir en el prompt los datos de cita ya recopilados
+    show_appointment_info: bool = False
+    # Fragmentos de la base de conocimiento precompilada
+    knowledge_fragment: str = "knowledge_base"
+    knowledge_default: str = "Información del consultorio no disponible."
+    doctor_info_fragment: Optional[str] = None
+    doctor_info_default: str = "Información del doctor no disponible."
+
+
+BASIC_PROMPT = """Eres una asistente virtual del Consultorio Médico de la {doctor}.
+
+        Tu objetivo es ayudar a los pacientes a agendar citas y responder sus consultas de manera profesional y cálida.
+
+        INFORMACIÓN DEL CONSULTORIO:
+        - Horarios: {horarios}
+        - Ubicación: {ubicacion}
+        - Para primera consulta: {preparacion}
+        - Emergencias: acudir al servicio de urgencias más cercano
+
+        INSTRUCCIONES:
+        1. Saluda amablemente al paciente
+        2. Si quiere agendar cita: recopila nombre, teléfono, motivo de consulta
+        3. Si pregunta por horarios, ubicación, etc.: proporciona la información
+        4. Sé profesional pero cálida
+        5. Habla en español mexicano
+        6. Confirma la información antes de terminar
+
+        CONTEXTO DE LA CONVERSACIÓN:
+        - Esta es la llamada número {step} del paciente
+        - Número de teléfono: {phone_number}
+        - Información previa: {previous_info}
+
+        Responde de manera natural y conversacional, como si fuera una conversación real por teléfono."""
+
+ENHANCED_PROMPT = """Eres una asistente virtual del Consultorio Médico de la {doctor}, especialista en {especialidad}.
+
+INFORMACIÓN DEL DOCTOR:
+{doctor_info}
+
+BASE DE CONOCIMIENTO:
+{knowledge_base}
+
+TU ROL:
+- Eres la primera línea de contacto para pacientes que llaman al consultorio
+- Debes ser profesional, cálida y empática
+- Habla en español mexicano de manera natural
+- Proporciona información precisa basada en la knowledge base
+- Ayuda a agendar citas recopilando información necesaria
+- Responde preguntas sobre horarios, ubicación, preparación para consultas, etc.
+
+INSTRUCCIONES ESPECÍFICAS:
+1. SALUDO INICIAL: Saluda amablemente y presenta el consultorio
+2. IDENTIFICAR NECESIDAD: Pregunta en qué puede ayudar al paciente
+3. PROPORCIONAR INFORMACIÓN: Usa la knowledge base para responder preguntas
+4. AGENDAR CITA: Si el paciente quiere una cita, recopila:
+   - Nombre completo
+   - Número de teléfono
+   - Motivo de consulta
+   - Fecha/hora preferida (si menciona)
+5. CONFIRMAR: Resumen de la información antes de terminar
+
+CONTEXTO DE LA CONVERSACIÓN:
+- Esta es la llamada número {step} del paciente
+- Número de teléfono: {phone_number}
+- Información previa: {previous_info}
+
+IMPORTANTE:
+- Si es una emergencia, dirige al paciente a servicios de urgencias
+- Sé específica con horarios, ubicación y preparación
+- Mantén un tono profesional pero cálido
+- Confirma la información antes de terminar la conversación
+
+Responde de manera natural y conversacional, como si fuera una conversación real por teléfono."""
+
+SYSTEM_MESSAGE = "Eres una asistente virtual médica profesional y cálida."
+
+PROFILES = {
+    "basic": ConversationProfile(
+        name="basic",
+        base_prompt=BASIC_PROMPT,
+        system_message=SYSTEM_MESSAGE,
+        speaker="Usuario",
+        greeting_instruction="Genera un saludo inicial amable y profesional.",
+        greeting_variant_instruction="Genera un saludo inicial breve, amable y profesional.",
+        fallback_responses={
+            0: "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón. ¿En qué puedo ayudarle?",
+            1: "Perfecto, entiendo que desea agendar una cita. Un miembro de nuestro equipo se pondrá en contacto con usted.",
+            2: "Excelente, he tomado nota de su información. Recibirá una confirmación pronto.",
+            3: "Gracias por su confianza. Que tenga un excelente día."
+        },
+        fallback_default="Gracias por llamar. Que tenga un excelente día.",
+        extraction_system="Extrae información estructurada de conversaciones médicas.",
+    ),
+    "enhanced": ConversationProfile(
+        name="enhanced",
+        base_prompt=ENHANCED_PROMPT,
+        system_message=SYSTEM_MESSAGE,
+        speaker="Paciente",
+        greeting_instruction=(
+            "Genera un saludo inicial amable y profesional que presente el consultorio de la "
+            "Dra. Dolores Remedios del Rincón y pregunte en qué puede ayudar al paciente."
+        ),
+        greeting_variant_instruction=(
+            "Genera un saludo inicial breve, amable y profesional que mencione a la Dra. Dolores "
+            "Remedios del Rincón y el horario de atención, y pregunte en qué puede ayudar al paciente."
+        ),
+        fallback_responses={
+            0: "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón, especialista en Medicina Interna. ¿En qué puedo ayudarle hoy?",
+            1: "Perfecto, entiendo su consulta. Un miembro de nuestro equipo se pondrá en contacto con usted para brindarle la información que necesita.",
+            2: "Excelente, he tomado nota de su información. Recibirá una confirmación de su cita pronto.",
+            3: "Gracias por su confianza en la Dra. Dolores Remedios del Rincón. Que tenga un excelente día."
+        },
+        fallback_default="Gracias por llamar al consultorio. Que tenga un excelente día.",
+        extraction_system="Eres un asistente que extrae información estructurada de conversaciones.",
+        appointment_key="appointment_info",
+        show_appointment_info=True,
+        doctor_info_fragment="doctor_info",
+    ),
+}
+
+
+def clip_summary(text: str, max_chars: int = HISTORY_SUMMARY_MAX_CHARS) -> str:
+    """Recortar el resumen conservando lo más reciente"""
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    return "…" + text[-(max_chars - 1):].split(" ", 1)[-1]
+
+
+class ConversationEngine:
+    def __init__(self, profiles: Dict[str, ConversationProfile] = PROFILES, client: Any = None):
+        self.profiles = profiles
+        # Un solo cliente de LLM (y su pool de conexiones) para todos los asistentes
+        self.client = client or create_llm_client()
+        self._contexts: Dict[str, Dict[str, Any]] = {}
+        # Referencias a las compactaciones en curso (evita que el GC las cancele)
+        self._background: Set[asyncio.Task] = set()
+
+    def profile(self, name: str) -> ConversationProfile:
+        return self.profiles[name]
+
+    def fragment(self, name: str, default: str) -> str:
+        """Fragmento de prompt de la base de conocimiento precompilada"""
+        return knowledge_store.fragment(name, default)
+
+    def knowledge_base(self, profile: ConversationProfile) -> str:
+        return self.fragment(profile.knowledge_fragment, profile.knowledge_default)
+
+    def doctor_info(self, profile: ConversationProfile) -> str:
+        if not profile.doctor_info_fragment:
+            return profile.doctor_info_default
+        return self.fragment(profile.doctor_info_fragment, profile.doctor_info_default)
+
+    # Contextos de conversación
+
+    def contexts(self, namespace: str) -> Dict[str, Any]:
+        """Contextos por teléfono de un asistente (el mismo dict en cada llamada)"""
+        return self._contexts.setdefault(namespace, {})
+
+    def get_context(self, profile: ConversationProfile, phone_number: str) -> ConversationContext:
+        contexts = self.contexts(profile.name)
+        if phone_number not in contexts:
+            contexts[phone_number] = ConversationContext()
+        return contexts[phone_number]
+
+    def update_context(self, profile: ConversationProfile, phone_number: str, step: int,
+                       data: Dict[str, Any] = None):
+        context = self.get_context(profile, phone_number)
+        context.step = step
+        if data:
+            context.data.update(data)
+
+    def add_to_history(self, profile: ConversationProfile, phone_number: str, message: str, is_user: bool = False):
+        self.get_context(profile, phone_number).conversation_history.add(message, is_user)
+
+    def update_appointment_info(self, profile: ConversationProfile, phone_number: str, info: Dict[str, Any]):
+        self.get_context(profile, phone_number)[profile.appointment_key].update(info)
+
+    # Prompts
+
+    def render_prompt(self, profile: ConversationProfile, step: int, phone_number: str, previous_info: str) -> str:
+        # Datos del consultorio desde la base de conocimiento (siguen la recarga en caliente)
+        facts = knowledge_store.facts
+        doctor = facts.get("doctor", {})
+        hours = facts.get("horarios", {})
+        return profile.base_prompt.format(
+            step=step,
+            phone_number=phone_number,
+            previous_info=previous_info,
+            knowledge_base=self.knowledge_base(profile),
+            doctor_info=self.doctor_info(profile),
+            doctor=doctor.get("nombre", ""),
+            especialidad=doctor.get("especialidad", ""),
+            horarios=f"Lunes a viernes de {hours.get('lunes_viernes', '')}, Sábados de {hours.get('sabados', '')}",
+            ubicacion=facts.get("direccion", ""),
+            preparacion=f"traer {spoken_list(facts.get('documentos_primera_consulta', ()))}",
+        )
+
+    def build_prompt(self, profile: ConversationProfile, phone_number: str, user_input: str = None) -> str:
+        """Prompt del turno con el contexto y los últimos mensajes"""
+        context = self.get_context(profile, phone_number)
+
+        # Construir historial de conversación
+        conversation_text = ""
+        for msg in context.conversation_history.recent(5):  # Últimos 5 mensajes
+            role = profile.speaker if msg.is_user else "Asistente"
+            conversation_text += f"{role}: {msg.message}\n"
+
+        if user_input:
+            conversation_text += f"{profile.speaker}: {user_input}\n"
+
+        # Resumen de los mensajes ya compactados
+        summary_text = ""
+        if context.summary.text:
+            summary_text = f"RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{context.summary.text}\n\n"
+
+        # Información de cita si existe
+        appointment_text = ""
+        appointment_info = context.appointment_info
+        if profile.show_appointment_info and appointment_info:
+            appointment_text = f"\nINFORMACIÓN DE CITA RECOPILADA:\n{json.dumps(appointment_info, indent=2, ensure_ascii=False)}"
+
+        prompt = self.render_prompt(profile, context.step, phone_number, str(context.data))
+        prompt += f"\n\n{summary_text}HISTORIAL DE CONVERSACIÓN:\n{conversation_text}{appointment_text}\n\nAsistente:"
+        return prompt
+
+    def _messages(self, profile: ConversationProfile, prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": profile.system_message},
+            {"role": "user", "content": prompt}
+        ]
+
+    # Llamadas al LLM
+
+    async def complete(self, messages: List[Dict[str, Any]], route: RouteDecision,
+                       max_tokens: Optional[int] = None, **params) -> Any:
+        """Llamar al LLM dentro del presupuesto del turno y registrar latencia y costo"""
+        if not self.client:
+            raise Exception("Cliente de LLM no inicializado")
+
+        # Plazo por turno: si el LLM no responde a tiempo se usa el respaldo del paso
+        started = time.monotonic()
+        response = await llm_executor.run(lambda timeout: self.client.chat.completions.create(
+            model=route.model,
+            messages=messages,
+            max_tokens=max_tokens or route.max_tokens,
+            timeout=timeout,
+            **params
+        ))
+        model_router.record(route, time.monotonic() - started, getattr(response, "usage", None))
+        return response
+
+    async def complete_text(self, messages: List[Dict[str, Any]], route: RouteDecision, cache: bool = False) -> str:
+        """Respuesta en texto libre
+
+        Con `cache=True` se reutiliza la respuesta de un prompt equivalente
+        (mismo texto salvo teléfono, fecha u hora).
+        """
+        key = prompt_fingerprint(route.model, messages, max_tokens=route.max_tokens, temperature=0.7) if cache else None
+        if key:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = await self.complete(messages, route, temperature=0.7)
+        text = response.choices[0].message.content.strip()
+        if key:
+            llm_cache.set(key, text)
+        return text
+
+    async def complete_turn(self, messages: List[Dict[str, Any]], route: RouteDecision,
+                            cache: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Respuesta y datos de cita del turno en una sola llamada
+
+        Con `cache=True` solo se guardan los turnos sin datos de cita, que no
+        dependen de lo que dijo el paciente.
+        """
+        key = prompt_fingerprint(route.model, messages, tool=RESPOND_TOOL["function"]["name"],
+                                 max_tokens=route.max_tokens, temperature=0.7) if cache else None
+        if key:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                return tuple(cached)
+
+        response = await self.complete(messages, route, tools=[RESPOND_TOOL],
+                                       tool_choice=RESPOND_TOOL_CHOICE, temperature=0.7)
+        text, info = parse_turn(response.choices[0].message)
+        if key and text and not info:
+            llm_cache.set(key, [text, info])
+        return text, info
+
+    # Conversación
+
+    def fallback_response(self, profile: ConversationProfile, step: int) -> str:
+        """Respuesta de respaldo si el LLM falla"""
+        return profile.fallback_responses.get(step, profile.fallback_default)
+
+    async def generate_response(self, profile: ConversationProfile, phone_number: str, user_input: str = None) -> str:
+        """Responder un turno del paciente y acumular los datos de cita"""
+        step = 0
+        try:
+            context = self.get_context(profile, phone_number)
+            step = context.step
+
+            # Si es la primera llamada y no hay input del usuario, generar saludo
+            if step == 0 and not user_input:
+                return await self.generate_greeting(profile, phone_number)
+
+            prompt = self.build_prompt(profile, phone_number, user_input)
+
+            # Respuesta y datos de cita en la misma llamada
+            # El primer turno no depende de datos del paciente: se puede reutilizar
+            response, turn_info = await self.complete_turn(
+                self._messages(profile, prompt), model_router.route(user_input),
+                cache=not context.conversation_history
+            )
+            if not response:
+                response = self.fallback_response(profile, step)
+
+            # Actualizar contexto
+            if user_input:
+                self.add_to_history(profile, phone_number, user_input, is_user=True)
+            self.add_to_history(profile, phone_number, response, is_user=False)
+            if turn_info:
+                self.update_appointment_info(profile, phone_number, turn_info)
+
+            # Incrementar paso y compactar el historial fuera del turno
+            self.update_context(profile, phone_number, step + 1)
+            self.schedule_compaction(
+                context.conversation_history, context.summary,
+                lambda msg: f"{profile.speaker if msg.is_user else 'Asistente'}: {msg.message}"
+            )
+
+            return response
+
+        except Exception as e:
+            logger.error(f"Error generando respuesta con el LLM: {e}")
+            return self.fallback_response(profile, step)
+
+    async def generate_greeting(self, profile: ConversationProfile, phone_number: str) -> str:
+        """Generar saludo inicial"""
+        prompt = self.render_prompt(profile, 0, phone_number, "Primera llamada")
+
+        try:
+            response = await self.complete_text(
+                self._messages(profile, f"{prompt}\n\n{profile.greeting_instruction}"),
+                model_router.route(task="greeting"), cache=True
+            )
+            self.update_context(profile, phone_number, 1)
+            return response
+        except Exception as e:
+            logger.error(f"Error generando saludo: {e}")
+            return self.fallback_response(profile, 0)
+
+    async def generate_greeting_variant(self, profile: ConversationProfile) -> str:
+        """Generar una versión del saludo inicial sin asociarla a un paciente"""
+        prompt = self.render_prompt(profile, 0, "desconocido", "Primera llamada")
+        return await self.complete_text(
+            self._messages(profile, f"{prompt}\n\n{profile.greeting_variant_instruction}"),
+            model_router.route(task="greeting")
+        )
+
+    # Compactación del historial
+
+    async def summarize(self, previous: str, lines: List[str]) -> str:
+        """Nuevo resumen a partir del anterior y de los mensajes a compactar"""
+        transcript = "\n".join(lines)
+        messages = [
+            {"role": "system", "content": f"{SUMMARY_INSTRUCTION} Máximo {HISTORY_SUMMARY_MAX_CHARS} caracteres."},
+            {"role": "user", "content": f"Resumen anterior: {previous or 'ninguno'}\n\nMensajes:\n{transcript}"}
+        ]
+        try:
+            return clip_summary(await self.complete_text(messages, model_router.route(task="summary")))
+        except Exception as e:
+            # Sin LLM: resumen extractivo con lo último que se dijo
+            logger.warning(f"⚠️  Resumen con LLM no disponible ({e}), usando resumen extractivo")
+            return clip_summary(f"{previous} {' '.join(lines)}")
+
+    def schedule_compaction(self, history: HistoryRing, summary: ConversationSummary,
+                            render: Callable[[Any], str]):
+        """Compactar en segundo plano los mensajes antiguos si el historial creció
+
+        Los mensajes recientes quedan textuales; los anteriores pasan al
+        resumen. Solo hay una compactación en curso por conversación.
+        """
+        if summary.pending or len(history) <= HISTORY_COMPACT_AFTER:
+            return
+        count = len(history) - HISTORY_RECENT_MESSAGES
+        lines = [render(msg) for msg in history.oldest(count)]
+        summary.pending = True
+
+        async def compact():
+            try:
+                text = await self.summarize(summary.text, lines)
+                # Los mensajes nuevos se agregaron al final: los primeros `count` son los resumidos
+                summary.text = text
+                summary.messages += count
+                history.drop_oldest(count)
+            except Exception as e:
+                logger.error(f"Error compactando historial: {e}")
+            finally:
+                summary.pending = False
+
+        task = asyncio.get_running_loop().create_task(compact())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def extract_appointment_info(self, profile: ConversationProfile, conversation_text: str,
+                                 phone_number: str = None) -> Dict[str, Any]:
+        """Extraer información de cita del texto de conversación
+
+        Si se indica el teléfono se devuelven los datos ya acumulados turno a
+        turno, sin llamar al LLM.
+        """
+        contexts = self.contexts(profile.name)
+        if phone_number and phone_number in contexts:
+            result = empty_appointment_info()
+            result.update(contexts[phone_number][profile.appointment_key])
+            return result
+
+        try:
+            if not self.client:
+                raise Exception("Cliente de LLM no inicializado")
+
+            # Usar tool calling con esquema estricto en lugar de JSON en texto libre
+            response = self.client.chat.completions.create(
+                model=model_router.route(task="extraction").model,
+                messages=[
+                    {"role": "system", "content": profile.extraction_system},
+                    {"role": "user", "content": f"Conversación: {conversation_text}"}
+                ],
+                tools=[EXTRACT_TOOL],
+                tool_choice=EXTRACT_TOOL_CHOICE,
+                max_tokens=200,
+                temperature=0.1
+            )
+
+            return parse_extraction(response.choices[0].message)
+
+        except Exception as e:
+            logger.error(f"Error extrayendo información de cita: {e}")
+            return empty_appointment_info()
+
+# Instancia global del motor de conversación
+conversation_engine = ConversationEngine()
@@ -0,0 +1,173 @@
+"""
+Registros compactos del contexto de conversación
+
+Cada mensaje del historial es un registro con __slots__ (rol internado,
+texto y marca de tiempo monotónica) en lugar de un dict con la fecha ISO
+como texto, y el historial de cada paciente es un buffer circular acotado.
+ConversationContext admite el acceso por clave (`context["step"]`) que usan
+los gestores y los webhooks.
+
+Benchmark de memoria con 100k conversaciones:
+    python conversation_records.py
+"""
+
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+# Mensajes máximos por paciente (la compactación normalmente deja muchos menos)
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "32"))
+
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+SYSTEM = sys.intern("system")
+
+
+@dataclass
+class HistoryEntry:
+    __slots__ = ("role", "content", "timestamp")
+    role: str
+    content: str
+    timestamp: float
+
+    @property
+    def is_user(self) -> bool:
+        return self.role is USER
+
+    @property
+    def message(self) -> str:
+        return self.content
+
+    def as_message(self) -> Dict[str, str]:
+        """Mensaje en el formato de la API de chat"""
+        return {"role": self.role, "content": self.content}
+
+
+def history_entry(content: str, is_user: bool = False, role: Optional[str] = None) -> HistoryEntry:
+    return HistoryEntry(sys.intern(role) if role else (USER if is_user else ASSISTANT), content, time.monotonic())
+
+
+class HistoryRing(list):
+    """Historial de un paciente: solo se agrega al final y descarta lo más antiguo
+
+    Es una lista con tope y no un deque: con pocos mensajes por paciente el
+    bloque fijo de 64 entradas del deque ocupa más que los propios mensajes.
+    """
+
+    __slots__ = ()
+
+    maxlen = HISTORY_MAX_MESSAGES
+
+    def add(self, content: str, is_user: bool = False, role: Optional[str] = None) -> HistoryEntry:
+        entry = history_entry(content, is_user, role)
+        self.append(entry)
+        if len(self) > self.maxlen:
+            del self[0]
+        return entry
+
+    def recent(self, count: int) -> List[HistoryEntry]:
+        """Últimos `count` mensajes, del más antiguo al más nuevo"""
+        return self[-count:] if count > 0 else []
+
+    def oldest(self, count: int) -> List[HistoryEntry]:
+        return self[:count]
+
+    def drop_oldest(self, count: int):
+        del self[:count]
+
+
+class ConversationSummary:
+    """Resumen acotado de los mensajes ya compactados"""
+
+    __slots__ = ("text", "messages", "pending")
+
+    def __init__(self, text: str = "", messages: int = 0, pending: bool = False):
+        self.text = text
+        self.messages = messages
+        self.pending = pending
+
+
+class ConversationContext:
+    """Contexto de conversación de un paciente"""
+
+    __slots__ = ("step", "data", "conversation_history", "appointment_info", "summary")
+
+    def __init__(self):
+        self.step = 0
+        self.data: Dict[str, Any] = {}
+        self.conversation_history = HistoryRing()
+        self.appointment_info: Dict[str, Any] = {}
+        self.summary = ConversationSummary()
+
+    # Acceso por clave, como el dict que devolvían los gestores
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+
+def _legacy_context(turns: int) -> Dict[str, Any]:
+    """Contexto con el formato anterior (dicts y fechas ISO en texto)"""
+    from datetime import datetime
+    return {
+        "step": turns,
+        "data": {},
+        "conversation_history": [
+            {"message": MESSAGES[i % len(MESSAGES)], "is_user": i % 2 == 0, "timestamp": datetime.now().isoformat()}
+            for i in range(turns)
+        ],
+        "appointment_info": {},
+    }
+
+
+def _compact_context(turns: int) -> ConversationContext:
+    context = ConversationContext()
+    context.step = turns
+    for i in range(turns):
+        context.conversation_history.add(MESSAGES[i % len(MESSAGES)], is_user=i % 2 == 0)
+    return context
+
+
+# Textos compartidos: el benchmark mide los registros, no el texto de los mensajes
+MESSAGES = [
+    "Hola, quiero agendar una cita",
+    "Con gusto. ¿Qué día y a qué hora le gustaría venir?",
+    "El martes a las 10 de la mañana",
+    "Perfecto. ¿Me confirma su nombre completo?",
+]
+
+
+def benchmark(conversations: int = 100_000, turns: int = 12):
+    """Memoria (tracemalloc) de `conversations` contextos con `turns` mensajes cada uno"""
+    import tracemalloc
+
+    results = {}
+    for name, build in (("dict + ISO", _legacy_context), ("__slots__ + ring", _compact_context)):
+        tracemalloc.start()
+        store = {f"+52155{i:07d}": build(turns) for i in range(conversations)}
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = current
+        print(f"{name:18s} {current / 1_048_576:8.1f} MiB  {current / conversations:8.0f} bytes/paciente")
+        del store
+
+    legacy, compact = results.values()
+    print(f"Reducción: {legacy / compact:.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -5,12 +5,13 @@ Ejemplo de cómo integrar Vapi con tu API FastAPI existente en Render
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_vapi_integration import add_vapi_routes
+from notification_outbox import notification_outbox
 import os
 
 # Tu aplicación FastAPI existente
 app = FastAPI(
     title="Consultorio Médico API",
-    description="API para el consultorio del Dr. Xavier Xijemez Xifra con integración Vapi",
+    description="API para el consultorio de la Dra. Dolores Remedios del Rincón con integración Vapi",
     version="1.0.0"
 )
 
@@ -30,7 +31,7 @@ add_vapi_routes(app)
 @app.get("/")
 async def root():
     return {
-        "message": "API del Consultorio Médico - Dr. Xavier Xijemez Xifra",
+        "message": "API del Consultorio Médico - Dra. Dolores Remedios del Rincón",
         "version": "1.0.0",
         "integrations": ["Vapi", "8n8 (opcional)"]
     }
@@ -40,7 +41,7 @@ async def get_api_info():
     """Información de tu API existente"""
     return {
         "name": "Consultorio Médico API",
-        "doctor": "Dr. Xavier Xijemez Xifra",
+        "doctor": "Dra. Dolores Remedios del Rincón",
         "specialty": "Medicina Interna",
         "features": [
             "Reserva de citas",
@@ -77,14 +78,8 @@ async def create_appointment(appointment_data: dict):
             "status": "confirmed"
         }
         
-        # Opcional: Notificar a 8n8
-        n8n_webhook_url = os.getenv("N8N_WEBHOOK_URL")
-        if n8n_webhook_url:
-            import requests
-            try:
-                requests.post(n8n_webhook_url, json=appointment, timeout=5)
-            except Exception as e:
-                print(f"Error notificando a 8n8: {e}")
+        # Opcional: Notificar a 8n8 (se encola y se envía en segundo plano)
+        notification_outbox.enqueue("appointment_created", appointment)
         
         return {"success": True, "appointment": appointment}
     except Exception as e:
@@ -101,7 +96,7 @@ INSTRUCCIONES DE INTEGRACIÓN:
 
 1. COPIA EL ARCHIVO:
    - Copia 'fastapi_vapi_integration.py' a tu proyecto
-   - Añade 'requests' a tu requirements.txt si no lo tienes
+   - Añade 'aiohttp' a tu requirements.txt si no lo tienes
 
 2. AÑADE A TU main.py:
    from fastapi_vapi_integration import add_vapi_routes
@@ -8,19 +8,20 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import os
-import requests
 import logging
 from datetime import datetime
 
+from knowledge_base import knowledge_store
+from vapi_client import VapiError, async_vapi_client
+from call_campaigns import campaign_scheduler
+from notification_outbox import notification_outbox
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuración de Vapi
 VAPI_API_KEY = os.getenv("VAPI_API_KEY")
-VAPI_PHONE_NUMBER_ID = os.getenv("VAPI_PHONE_NUMBER_ID")
-VAPI_ASSISTANT_ID = os.getenv("VAPI_ASSISTANT_ID")
-VAPI_BASE_URL = "https://api.vapi.ai"
 
 # Modelos Pydantic
 class CallRequest(BaseModel):
@@ -41,129 +42,40 @@ class AppointmentRequest(BaseModel):
     time: str
     reason: Optional[str] = "Consulta general"
 
-# Base de conocimiento del consultorio
-MEDICAL_KNOWLEDGE = {
-    "horarios": {
-        "lunes_viernes": "8:00 a 18:00",
-        "sabados": "9:00 a 14:00",
-        "domingos": "Cerrado"
-    },
-    "ubicacion": "Estamos ubicados en [DIRECCIÓN COMPLETA]. Contamos con estacionamiento disponible.",
-    "doctor": "Dr. Xavier Xijemez Xifra - Médico Especialista en Medicina Interna",
-    "especialidades": [
-        "Diabetes Mellitus tipo 1 y 2",
-        "Hipertensión arterial", 
-        "Enfermedades cardiovasculares",
-        "Problemas respiratorios",
-        "Trastornos endocrinos",
-        "Medicina preventiva"
-    ],
-    "preparacion_consulta": [
-        "Documento de identidad",
-        "Carnet de obra social", 
-        "Estudios médicos previos",
-        "Lista de medicamentos actuales",
-        "Resumen de historia clínica"
-    ]
-}
-
 # Funciones de Vapi
-def create_vapi_call(phone_number: str, metadata: Optional[Dict] = None) -> Dict[str, Any]:
+async def create_vapi_call(phone_number: str, metadata: Optional[Dict] = None) -> Dict[str, Any]:
     """Crear una llamada usando Vapi"""
+    if not async_vapi_client.configured:
+        raise HTTPException(status_code=500, detail="VAPI_API_KEY no configurada")
     try:
-        if not VAPI_API_KEY:
-            raise HTTPException(status_code=500, detail="VAPI_API_KEY no configurada")
-        
-        headers = {
-            "Authorization": f"Bearer {VAPI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "phoneNumberId": VAPI_PHONE_NUMBER_ID,
-            "assistantId": VAPI_ASSISTANT_ID,
-            "customer": {
-                "number": phone_number
-            }
-        }
-        
-        if metadata:
-            payload["metadata"] = metadata
-        
-        response = requests.post(
-            f"{VAPI_BASE_URL}/call",
-            headers=headers,
-            json=payload
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Error Vapi: {response.status_code} - {response.text}")
-            raise HTTPException(status_code=500, detail="Error creando llamada en Vapi")
-            
-    except Exception as e:
-        logger.error(f"Excepción creando llamada: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        call = await async_vapi_client.create_call(phone_number, metadata)
+        return call.raw
+    except VapiError as e:
+        logger.error(f"Error Vapi: {e} {e.body}")
+        raise HTTPException(status_code=500, detail="Error creando llamada en Vapi")
 
-def get_vapi_call_status(call_id: str) -> Dict[str, Any]:
+async def get_vapi_call_status(call_id: str) -> Dict[str, Any]:
     """Obtener estado de una llamada de Vapi"""
     try:
-        headers = {
-            "Authorization": f"Bearer {VAPI_API_KEY}"
-        }
-        
-        response = requests.get(
-            f"{VAPI_BASE_URL}/call/{call_id}",
-            headers=headers
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"error": f"Status code: {response.status_code}"}
-            
-    except Exception as e:
+        call = await async_vapi_client.get_call(call_id)
+        return call.raw
+    except VapiError as e:
+        if e.status_code:
+            return {"error": f"Status code: {e.status_code}"}
         return {"error": str(e)}
 
 # Funciones del consultorio médico
 def handle_medical_function(function_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Manejar funciones específicas del consultorio médico"""
     
-    if function_name == "get_appointment_info":
-        return {
-            "horarios": MEDICAL_KNOWLEDGE["horarios"],
-            "ubicacion": MEDICAL_KNOWLEDGE["ubicacion"],
-            "doctor": MEDICAL_KNOWLEDGE["doctor"],
-            "preparacion": MEDICAL_KNOWLEDGE["preparacion_consulta"]
-        }
+    # Funciones sin argumentos: resultado precompilado en la base de conocimiento
+    result = knowledge_store.function_result(function_name)
+    if result is not None:
+        return result
     
-    elif function_name == "schedule_appointment":
+    if function_name == "schedule_appointment":
         return schedule_appointment(arguments)
     
-    elif function_name == "get_doctor_info":
-        return {
-            "name": "Dr. Xavier Xijemez Xifra",
-            "specialty": "Medicina Interna",
-            "experience": "Más de 5,000 consultas realizadas",
-            "certifications": [
-                "Consejo Mexicano de Medicina Interna",
-                "Colegio de Medicina Interna de México A.C.",
-                "Asociación Mexicana de Diabetes"
-            ],
-            "education": [
-                "UNAM - Facultad de Medicina",
-                "Hospital General de México - Residencia", 
-                "Diplomado en Diabetes y Endocrinología"
-            ]
-        }
-    
-    elif function_name == "get_specialties":
-        return {
-            "specialties": MEDICAL_KNOWLEDGE["especialidades"],
-            "description": "Especialista en medicina interna con enfoque en atención integral del paciente adulto"
-        }
-    
     elif function_name == "check_availability":
         return check_availability(arguments)
     
@@ -194,8 +106,8 @@ def schedule_appointment(args: Dict[str, Any]) -> Dict[str, Any]:
         # Simular guardado (aquí conectarías con tu base de datos)
         logger.info(f"Cita programada: {appointment}")
         
-        # Opcional: Notificar a 8n8
-        notify_8n8(appointment)
+        # Opcional: Notificar a 8n8 (se encola; el envío va en segundo plano)
+        notification_outbox.enqueue("appointment_created", appointment)
         
         return {
             "success": True,
@@ -226,16 +138,6 @@ def check_availability(args: Dict[str, Any]) -> Dict[str, Any]:
         "is_available": time in available_slots if time else True
     }
 
-def notify_8n8(appointment_data: Dict[str, Any]):
-    """Notificar a 8n8 sobre nueva cita (opcional)"""
-    n8n_webhook_url = os.getenv("N8N_WEBHOOK_URL")
-    if n8n_webhook_url:
-        try:
-            requests.post(n8n_webhook_url, json=appointment_data, timeout=5)
-            logger.info("Notificación enviada a 8n8")
-        except Exception as e:
-            logger.error(f"Error notificando a 8n8: {str(e)}")
-
 def process_vapi_webhook(webhook_data: Dict[str, Any]) -> Dict[str, Any]:
     """Procesar webhook de Vapi"""
     try:
@@ -256,6 +158,9 @@ def process_vapi_webhook(webhook_data: Dict[str, Any]) -> Dict[str, Any]:
         elif event_type == "call-ended":
             call_id = webhook_data.get("callId")
             logger.info(f"Llamada terminada: {call_id}")
+            # Liberar su lugar si es de una campaña
+            campaign_scheduler.record_hangup(call_id, webhook_data.get("endedReason")
+                                             or (webhook_data.get("data") or {}).get("endedReason"))
             return {"status": "processed", "message": "Call ended"}
             
         elif event_type == "speech-start":
@@ -278,6 +183,15 @@ def process_vapi_webhook(webhook_data: Dict[str, Any]) -> Dict[str, Any]:
 def add_vapi_routes(app: FastAPI):
     """Añadir rutas de Vapi a tu aplicación FastAPI"""
     
+    @app.on_event("startup")
+    async def start_notification_outbox():
+        notification_outbox.start()
+    
+    @app.on_event("shutdown")
+    async def close_vapi_client():
+        await async_vapi_client.close()
+        await notification_outbox.stop()
+    
     @app.post("/vapi-webhook")
     async def vapi_webhook(request: Request):
         """Endpoint para recibir webhooks de Vapi"""
@@ -302,12 +216,14 @@ def add_vapi_routes(app: FastAPI):
             if call_request.metadata:
                 metadata.update(call_request.metadata)
             
-            result = create_vapi_call(call_request.phone_number, metadata)
+            result = await create_vapi_call(call_request.phone_number, metadata)
             return {
                 "success": True,
                 "message": "Llamada iniciada",
                 "call_data": result
             }
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error creando llamada: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
@@ -316,7 +232,7 @@ def add_vapi_routes(app: FastAPI):
     async def get_call_status(call_id: str):
         """Obtener estado de una llamada"""
         try:
-            result = get_vapi_call_status(call_id)
+            result = await get_vapi_call_status(call_id)
             return result
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -340,12 +256,13 @@ def add_vapi_routes(app: FastAPI):
     @app.get("/medical-info")
     async def get_medical_info():
         """Obtener información del consultorio"""
+        facts = knowledge_store.facts
         return {
-            "consultorio": "Dr. Xavier Xijemez Xifra",
-            "especialidad": "Medicina Interna",
-            "horarios": MEDICAL_KNOWLEDGE["horarios"],
-            "ubicacion": MEDICAL_KNOWLEDGE["ubicacion"],
-            "especialidades": MEDICAL_KNOWLEDGE["especialidades"]
+            "consultorio": facts["doctor"]["nombre"],
+            "especialidad": facts["doctor"]["especialidad"],
+            "horarios": facts["horarios"],
+            "ubicacion": knowledge_store.answer("ubicacion"),
+            "especialidades": facts["especialidades"]
         }
     
     @app.get("/health")
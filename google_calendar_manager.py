@@ -4,7 +4,9 @@ Sistema de gestión de citas con Google Calendar
 
 import os
 import json
-from typing import Dict, Any, Optional, List
+import re
+import time
+from typing import Dict, Any, Iterator, Optional, List, Tuple
 from datetime import datetime, timedelta
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -12,6 +14,16 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import logging
+from calendar_time import (
+    CLINIC_TZ_NAME, day_bounds, event_interval, free_slots, merge_intervals,
+    epoch_to_local, epoch_to_rfc3339, format_wall_time, local_to_epoch, today_local
+)
+from calendar_index import (
+    CalendarIndex, IndexedEvent, RECHECK_MAX_AGE, normalize_phone, phone_from_description
+)
+from slot_leases import SlotLeaseTable
+from spanish_datetime import parse_date_time
+from resilience import UpstreamUnavailable, upstream
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -20,11 +32,32 @@ logger = logging.getLogger(__name__)
 # Scopes para Google Calendar
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+# Duración (segundos) de un horario apartado mientras se recopilan los datos del paciente
+SLOT_HOLD_TTL = int(os.getenv("SLOT_HOLD_TTL", "300"))
+
+# Días hacia adelante que se sincronizan en el índice local
+UPCOMING_SYNC_DAYS = int(os.getenv("CALENDAR_SYNC_DAYS", "60"))
+
+# Segundos entre revisiones de cambios hechos directamente en Google Calendar (0 = desactivado)
+CALENDAR_RESYNC_INTERVAL = float(os.getenv("CALENDAR_RESYNC_INTERVAL", "300"))
+
+# Segundos que se solapan las revisiones de cambios (desfase de relojes con Google)
+CHANGES_OVERLAP_SECONDS = 60
+
+# Días cambiados a partir de los cuales conviene re-sincronizar todo el rango
+CHANGES_MAX_DAYS = 15
+
 class GoogleCalendarManager:
     def __init__(self):
         self.calendar_id = os.getenv("GOOGLE_CALENDAR_ID", "primary")
         self.credentials = None
         self.service = None
+        self.index = CalendarIndex()
+        self.leases = SlotLeaseTable()
+        self._upcoming_synced = False
+        # Inicio y día de la última sincronización completa o de cambios
+        self._changes_since: Optional[float] = None
+        self._synced_day: Optional[str] = None
         self._authenticate()
     
     def _authenticate(self):
@@ -56,58 +89,247 @@ class GoogleCalendarManager:
             logger.error(f"❌ Error autenticando con Google Calendar: {e}")
             self.service = None
     
-    def get_available_slots(self, date: str, duration_minutes: int = 30) -> List[Dict[str, Any]]:
-        """Obtener horarios disponibles para una fecha específica"""
-        try:
-            if not self.service:
-                logger.error("Servicio de Google Calendar no disponible")
-                return []
-            
-            # Convertir fecha a datetime
-            start_date = datetime.strptime(date, "%Y-%m-%d")
-            end_date = start_date + timedelta(days=1)
+    @staticmethod
+    def _execute(request):
+        """Ejecutar una petición a Google con circuit breaker y límites de tasa"""
+        with upstream("google").guard():
+            return request.execute()
+    
+    @staticmethod
+    def _index_event(event: Dict[str, Any], fallback_id: str) -> IndexedEvent:
+        """Parsear un evento de Google Calendar una sola vez para el índice"""
+        start, end = event_interval(event)
+        summary = event.get('summary', '')
+        phone = phone_from_description(event.get('description')) if 'Cita:' in summary else ''
+        return IndexedEvent(event.get('id') or fallback_id, start, end, summary, phone)
+    
+    def _sync_day(self, date: str):
+        """Sincronizar todos los eventos de un día en el índice
+        
+        Se pide el día completo y no solo el horario laboral: store_day
+        reemplaza el día, y una cita fuera de horario que ya estaba indexada
+        se daría por cancelada (con sus recordatorios).
+        """
+        day = day_bounds(date)
+        
+        events_result = self._execute(self.service.events().list(
+            calendarId=self.calendar_id,
+            timeMin=epoch_to_rfc3339(day.day_start),
+            timeMax=epoch_to_rfc3339(day.day_end),
+            singleEvents=True,
+            orderBy='startTime',
+            fields='items(id,start,end,summary,description)'
+        ))
+        
+        # Parsear cada evento una sola vez a intervalos enteros
+        events = []
+        for position, event in enumerate(events_result.get('items', [])):
+            try:
+                events.append(self._index_event(event, f"_{date}_{position}"))
+            except (KeyError, ValueError):
+                continue
+        
+        self.index.store_day(date, events)
+    
+    def sync_upcoming(self, days: int = UPCOMING_SYNC_DAYS) -> int:
+        """Sincronizar en el índice los próximos días del calendario
+        
+        Recorre events.list página por página; después las búsquedas por
+        teléfono y la disponibilidad de esos días no consultan a Google.
+        Devuelve el número de eventos indexados.
+        """
+        if not self.service:
+            return 0
+        
+        started = time.time()
+        first_date = datetime.strptime(today_local(), '%Y-%m-%d')
+        dates = [(first_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+        by_date: Dict[str, List[IndexedEvent]] = {date: [] for date in dates}
+        
+        page_token = None
+        total = 0
+        while True:
+            events_result = self._execute(self.service.events().list(
+                calendarId=self.calendar_id,
+                timeMin=epoch_to_rfc3339(day_bounds(dates[0]).day_start),
+                timeMax=epoch_to_rfc3339(day_bounds(dates[-1]).day_end),
+                singleEvents=True,
+                orderBy='startTime',
+                maxResults=250,
+                pageToken=page_token,
+                fields='nextPageToken,items(id,start,end,summary,description)'
+            ))
             
-            # Horarios de trabajo
-            work_start = start_date.replace(hour=8, minute=0)  # 8:00 AM
-            work_end = start_date.replace(hour=18, minute=0)   # 6:00 PM
+            for event in events_result.get('items', []):
+                try:
+                    indexed = self._index_event(event, f"_{total}")
+                except (KeyError, ValueError):
+                    continue
+                # Un evento de varios días ocupa cada día que toca
+                for date in self._event_days(indexed):
+                    if date in by_date:
+                        by_date[date].append(indexed)
+                total += 1
             
-            # Obtener eventos existentes para esa fecha
-            events_result = self.service.events().list(
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                break
+        
+        for date, events in by_date.items():
+            self.index.store_day(date, events)
+        
+        self._upcoming_synced = True
+        self._changes_since = started
+        self._synced_day = dates[0]
+        logger.info(f"🔄 Índice del calendario sincronizado: {total} eventos en {days} días")
+        return total
+    
+    def sync_changes(self) -> int:
+        """Aplicar al índice los cambios hechos en Google desde la última revisión
+        
+        Pide solo los eventos modificados (updatedMin, incluidos los
+        cancelados) y re-sincroniza los días que tocan, antes y después del
+        cambio; store_day avisa a los listeners (recordatorios) solo de lo que
+        cambió. Con un día nuevo o muchos días cambiados se re-sincroniza todo
+        el rango. Devuelve el número de días re-sincronizados.
+        """
+        if not self.service:
+            return 0
+        if self._changes_since is None or self._synced_day != today_local():
+            self.sync_upcoming()
+            return UPCOMING_SYNC_DAYS
+        
+        started = time.time()
+        first_date = datetime.strptime(self._synced_day, '%Y-%m-%d')
+        window = {(first_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(UPCOMING_SYNC_DAYS)}
+        
+        changed_dates = set()
+        page_token = None
+        while True:
+            events_result = self._execute(self.service.events().list(
                 calendarId=self.calendar_id,
-                timeMin=work_start.isoformat() + 'Z',
-                timeMax=work_end.isoformat() + 'Z',
+                updatedMin=epoch_to_rfc3339(int(self._changes_since - CHANGES_OVERLAP_SECONDS)),
+                timeMin=epoch_to_rfc3339(day_bounds(min(window)).day_start),
+                timeMax=epoch_to_rfc3339(day_bounds(max(window)).day_end),
+                showDeleted=True,
                 singleEvents=True,
-                orderBy='startTime'
-            ).execute()
+                maxResults=250,
+                pageToken=page_token,
+                fields='nextPageToken,items(id,status,start,end)'
+            ))
             
-            events = events_result.get('items', [])
+            for event in events_result.get('items', []):
+                # Día anterior según el índice (cita movida o cancelada) y días nuevos
+                previous_date = self.index.date_of(event.get('id', ''))
+                if previous_date:
+                    changed_dates.add(previous_date)
+                if event.get('status') == 'cancelled':
+                    continue
+                try:
+                    changed_dates.update(self._event_days(self._index_event(event, "")))
+                except (KeyError, ValueError):
+                    continue
+            
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                break
+        
+        changed_dates &= window
+        if len(changed_dates) > CHANGES_MAX_DAYS:
+            self.sync_upcoming()
+            return UPCOMING_SYNC_DAYS
+        for date in sorted(changed_dates):
+            self._sync_day(date)
+        
+        self._changes_since = started
+        if changed_dates:
+            logger.info(f"🔄 Cambios del calendario aplicados en {len(changed_dates)} días")
+        return len(changed_dates)
+    
+    @staticmethod
+    def _event_days(event: IndexedEvent) -> List[str]:
+        """Días (fecha local) que toca un evento"""
+        days = []
+        day_date = epoch_to_local(event.start)
+        while True:
+            days.append(day_date.strftime('%Y-%m-%d'))
+            day_date += timedelta(days=1)
+            if day_bounds(day_date.strftime('%Y-%m-%d')).day_start >= event.end:
+                return days
+    
+    def find_appointments_by_phone(self, phone: str) -> List[Dict[str, Any]]:
+        """Citas próximas de un paciente buscadas por teléfono en el índice local"""
+        try:
+            if not self._upcoming_synced:
+                self.sync_upcoming()
+            
+            appointments = []
+            for event in self.index.find_by_phone(phone, after=int(datetime.now().timestamp())):
+                start = epoch_to_local(event.start)
+                appointments.append({
+                    'id': event.event_id,
+                    'patient_name': event.summary.replace('Cita: ', ''),
+                    'date': start.strftime('%Y-%m-%d'),
+                    'time': start.strftime('%H:%M'),
+                    'start_time': start.isoformat(),
+                    'end_time': epoch_to_local(event.end).isoformat()
+                })
+            return appointments
+            
+        except Exception as e:
+            logger.error(f"Error buscando citas por teléfono: {e}")
+            return []
+    
+    def get_busy_intervals(self, date: str, max_age: Optional[float] = None) -> List[Tuple[int, int]]:
+        """Intervalos ocupados del día desde el índice, sincronizando si está vencido"""
+        busy = self.index.get_busy(date, max_age)
+        if busy is None:
+            try:
+                self._sync_day(date)
+            except UpstreamUnavailable:
+                # Durante una caída de Google se ofrece lo último sincronizado;
+                # la re-verificación antes de insertar (max_age) no acepta datos viejos
+                stale = self.index.get_busy(date, max_age=float("inf")) if max_age is None else None
+                if stale is None:
+                    raise
+                logger.warning(f"⚠️  Google Calendar no disponible, usando índice sin actualizar para {date}")
+                return stale
+            busy = self.index.get_busy(date, max_age=float("inf"))
+        return busy
+    
+    def get_unavailable_intervals(self, date: str, holder: Optional[str] = None) -> List[Tuple[int, int]]:
+        """Intervalos ocupados en el calendario más los apartados por otros titulares"""
+        busy = self.get_busy_intervals(date)
+        held = self.leases.held_intervals(date, exclude_holder=holder)
+        if held:
+            busy = merge_intervals(busy + held)
+        return busy
+    
+    def get_available_slots(self, date: str, duration_minutes: int = 30,
+                            holder: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Obtener horarios disponibles para una fecha específica
+        
+        Los horarios apartados con hold_slot no se ofrecen, salvo al mismo titular.
+        """
+        try:
+            if not self.service:
+                logger.error("Servicio de Google Calendar no disponible")
+                return []
+            
+            # Límites del día en la zona horaria del consultorio (epoch)
+            day = day_bounds(date)
+            busy = self.get_unavailable_intervals(date, holder)
             
             # Generar slots disponibles
+            step = duration_minutes * 60
             available_slots = []
-            current_time = work_start
-            
-            while current_time < work_end:
-                slot_end = current_time + timedelta(minutes=duration_minutes)
-                
-                # Verificar si el slot está disponible
-                is_available = True
-                for event in events:
-                    event_start = datetime.fromisoformat(event['start'].get('dateTime', event['start'].get('date')))
-                    event_end = datetime.fromisoformat(event['end'].get('dateTime', event['end'].get('date')))
-                    
-                    # Verificar si hay conflicto
-                    if (current_time < event_end and slot_end > event_start):
-                        is_available = False
-                        break
-                
-                if is_available:
-                    available_slots.append({
-                        'start_time': current_time.strftime('%H:%M'),
-                        'end_time': slot_end.strftime('%H:%M'),
-                        'datetime': current_time.isoformat()
-                    })
-                
-                current_time = slot_end
+            for slot_start in free_slots(day, busy, duration_minutes):
+                start_time = format_wall_time(day, slot_start)
+                available_slots.append({
+                    'start_time': start_time,
+                    'end_time': format_wall_time(day, slot_start + step),
+                    'datetime': f"{date}T{start_time}:00"
+                })
             
             return available_slots
             
@@ -115,6 +337,92 @@ class GoogleCalendarManager:
             logger.error(f"Error obteniendo slots disponibles: {e}")
             return []
     
+    def hold_slot(self, date: str, time: str, holder: str,
+                  ttl_seconds: int = SLOT_HOLD_TTL, duration_minutes: int = 30) -> Dict[str, Any]:
+        """Apartar un horario mientras se recopilan los datos del paciente
+        
+        El titular (por ejemplo, el teléfono de quien llama) puede volver a
+        apartar o confirmar; para los demás el horario deja de estar disponible.
+        """
+        try:
+            if not self.service:
+                return {"success": False, "error": "Servicio no disponible"}
+            
+            start = local_to_epoch(date, time)
+            end = start + duration_minutes * 60
+            
+            if CalendarIndex.overlaps(self.get_busy_intervals(date), start, end):
+                return {"success": False, "error": "Horario ocupado"}
+            
+            lease = self.leases.acquire(date, start, end, holder, ttl_seconds)
+            if lease is None:
+                return {"success": False, "error": "Horario apartado por otro paciente"}
+            
+            logger.info(f"📌 Horario apartado: {date} {time} ({lease.lease_id})")
+            return {
+                "success": True,
+                "hold_id": lease.lease_id,
+                "date": date,
+                "time": time,
+                "expires_in": ttl_seconds
+            }
+            
+        except Exception as e:
+            logger.error(f"Error apartando horario: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def release_slot(self, hold_id: str) -> Dict[str, Any]:
+        """Liberar un horario apartado"""
+        lease = self.leases.release(hold_id)
+        if lease is None:
+            return {"success": False, "error": "Apartado no encontrado o expirado"}
+        
+        logger.info(f"🔓 Horario liberado: {hold_id}")
+        return {"success": True}
+    
+    def confirm_slot(self, hold_id: str, appointment_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Convertir un horario apartado en cita
+        
+        Se re-verifica el horario contra el índice recién sincronizado antes
+        de insertar; el apartado se libera siempre al terminar.
+        """
+        lease = self.leases.get(hold_id)
+        if lease is None:
+            return {"success": False, "error": "Apartado no encontrado o expirado"}
+        
+        try:
+            busy = self.get_busy_intervals(lease.date, max_age=RECHECK_MAX_AGE)
+            if CalendarIndex.overlaps(busy, lease.start, lease.end):
+                return {"success": False, "error": "Horario ocupado"}
+            
+            day = day_bounds(lease.date)
+            return self.create_appointment({
+                **appointment_data,
+                'fecha': lease.date,
+                'hora': format_wall_time(day, lease.start)
+            })
+            
+        except Exception as e:
+            logger.error(f"Error confirmando horario apartado: {e}")
+            return {"success": False, "error": str(e)}
+        finally:
+            self.leases.release(hold_id)
+    
+    @staticmethod
+    def _normalize_date_time(date: str, time: str) -> Tuple[str, str]:
+        """Aceptar fecha y hora tal como las dijo el paciente ("el martes", "a las 4")"""
+        try:
+            datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
+            return date, time
+        except ValueError:
+            pass
+        
+        if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", date or ""):
+            date = parse_date_time(date).date or date
+        if not re.fullmatch(r"\d{1,2}:\d{2}", time or ""):
+            time = parse_date_time(time).time or time
+        return date, time
+    
     def create_appointment(self, appointment_data: Dict[str, Any]) -> Dict[str, Any]:
         """Crear una cita en Google Calendar"""
         try:
@@ -126,8 +434,9 @@ class GoogleCalendarManager:
             patient_name = appointment_data.get('nombre', 'Paciente')
             phone = appointment_data.get('telefono', '')
             reason = appointment_data.get('motivo', 'Consulta médica')
-            date = appointment_data.get('fecha', datetime.now().strftime('%Y-%m-%d'))
+            date = appointment_data.get('fecha', today_local())
             time = appointment_data.get('hora', '10:00')
+            date, time = self._normalize_date_time(date, time)
             
             # Crear datetime para la cita
             appointment_datetime = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
@@ -139,11 +448,11 @@ class GoogleCalendarManager:
                 'description': f'Motivo: {reason}\nTeléfono: {phone}',
                 'start': {
                     'dateTime': appointment_datetime.isoformat(),
-                    'timeZone': 'America/Mexico_City',
+                    'timeZone': CLINIC_TZ_NAME,
                 },
                 'end': {
                     'dateTime': end_datetime.isoformat(),
-                    'timeZone': 'America/Mexico_City',
+                    'timeZone': CLINIC_TZ_NAME,
                 },
                 'reminders': {
                     'useDefault': False,
@@ -154,13 +463,20 @@ class GoogleCalendarManager:
                 },
             }
             
-            event = self.service.events().insert(
+            event = self._execute(self.service.events().insert(
                 calendarId=self.calendar_id,
                 body=event
-            ).execute()
+            ))
             
             logger.info(f"✅ Cita creada: {event.get('htmlLink')}")
             
+            # Reflejar la cita en el índice local
+            start_epoch = local_to_epoch(date, time)
+            self.index.add_event(date, IndexedEvent(
+                event.get('id'), start_epoch, start_epoch + 30 * 60,
+                f'Cita: {patient_name}', normalize_phone(phone)
+            ))
+            
             return {
                 "success": True,
                 "event_id": event.get('id'),
@@ -179,16 +495,15 @@ class GoogleCalendarManager:
             if not self.service:
                 return []
             
-            start_date = datetime.strptime(date, "%Y-%m-%d")
-            end_date = start_date + timedelta(days=1)
+            day = day_bounds(date)
             
-            events_result = self.service.events().list(
+            events_result = self._execute(self.service.events().list(
                 calendarId=self.calendar_id,
-                timeMin=start_date.isoformat() + 'Z',
-                timeMax=end_date.isoformat() + 'Z',
+                timeMin=epoch_to_rfc3339(day.day_start),
+                timeMax=epoch_to_rfc3339(day.day_end),
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
+            ))
             
             events = events_result.get('items', [])
             
@@ -213,17 +528,62 @@ class GoogleCalendarManager:
             logger.error(f"Error obteniendo citas: {e}")
             return []
     
+    def iter_appointments(self, start_date: str, end_date: str, page_size: int = 250) -> Iterator[Dict[str, Any]]:
+        """Recorrer las citas de un rango de fechas (inclusivo) página por página
+        
+        Solo se mantiene en memoria una página de events.list a la vez, así que
+        sirve para exportar meses de citas.
+        """
+        if not self.service:
+            return
+        
+        page_token = None
+        while True:
+            events_result = self._execute(self.service.events().list(
+                calendarId=self.calendar_id,
+                timeMin=epoch_to_rfc3339(day_bounds(start_date).day_start),
+                timeMax=epoch_to_rfc3339(day_bounds(end_date).day_end),
+                singleEvents=True,
+                orderBy='startTime',
+                maxResults=page_size,
+                pageToken=page_token,
+                fields='nextPageToken,items(id,start,end,summary,description,htmlLink)'
+            ))
+            
+            for event in events_result.get('items', []):
+                if 'Cita:' not in event.get('summary', ''):
+                    continue
+                
+                start = event['start'].get('dateTime', event['start'].get('date'))
+                end = event['end'].get('dateTime', event['end'].get('date'))
+                description = event.get('description', '')
+                
+                yield {
+                    'id': event['id'],
+                    'patient_name': event['summary'].replace('Cita: ', ''),
+                    'phone': phone_from_description(description),
+                    'start_time': start,
+                    'end_time': end,
+                    'description': description,
+                    'link': event.get('htmlLink', '')
+                }
+            
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                break
+    
     def cancel_appointment(self, event_id: str) -> Dict[str, Any]:
         """Cancelar una cita"""
         try:
             if not self.service:
                 return {"success": False, "error": "Servicio no disponible"}
             
-            self.service.events().delete(
+            self._execute(self.service.events().delete(
                 calendarId=self.calendar_id,
                 eventId=event_id
-            ).execute()
+            ))
             
+            self.index.remove_event(event_id)
             logger.info(f"✅ Cita cancelada: {event_id}")
             return {"success": True}
             
@@ -235,7 +595,7 @@ class GoogleCalendarManager:
         """Obtener la próxima fecha disponible"""
         try:
             if not start_date:
-                start_date = datetime.now().strftime('%Y-%m-%d')
+                start_date = today_local()
             
             current_date = datetime.strptime(start_date, '%Y-%m-%d')
             
@@ -254,7 +614,7 @@ class GoogleCalendarManager:
             
         except Exception as e:
             logger.error(f"Error obteniendo próxima fecha disponible: {e}")
-            return start_date or datetime.now().strftime('%Y-%m-%d')
+            return start_date or today_local()
 
 # Instancia global del manager
 calendar_manager = GoogleCalendarManager() 
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Pool de saludos pre-generados
+
+Una tarea en segundo plano mantiene varias versiones del saludo inicial
+(con el nombre de la doctora y los horarios) generadas con OpenAI y las
+renueva periódicamente. Contestar una llamada solo toma la siguiente versión
+del pool, sin esperar al LLM; si el pool está vacío se usa el texto fijo.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import logging
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Versiones del saludo que se mantienen en el pool
+GREETING_POOL_SIZE = int(os.getenv("GREETING_POOL_SIZE", "5"))
+
+# Segundos entre renovaciones del pool
+GREETING_POOL_REFRESH = int(os.getenv("GREETING_POOL_REFRESH", "1800"))
+
+STATIC_GREETING = (
+    "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón, especialista en Medicina Interna. "
+    "Atendemos de lunes a viernes de 8:00 a 18:00. ¿En qué puedo ayudarle hoy?"
+)
+
+
+async def _generate_with_enhanced_manager() -> str:
+    from ai_conversation_enhanced import enhanced_ai_manager
+    return await enhanced_ai_manager.generate_greeting_variant()
+
+
+def mark_greeted(phone_number: str):
+    """Registrar en el gestor de conversación que el paciente ya fue saludado"""
+    try:
+        from ai_conversation_enhanced import enhanced_ai_manager
+        enhanced_ai_manager.update_conversation_context(phone_number, 1)
+    except Exception as e:
+        logger.error(f"Error registrando saludo de {phone_number}: {e}")
+
+
+class GreetingPool:
+    def __init__(self, generate: Callable[[], Awaitable[str]] = _generate_with_enhanced_manager,
+                 fallback: str = STATIC_GREETING, size: int = GREETING_POOL_SIZE,
+                 refresh_seconds: int = GREETING_POOL_REFRESH):
+        self.generate = generate
+        self.fallback = fallback
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        self._greetings = deque()
+        self._refreshed_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self) -> str:
+        """Siguiente saludo del pool (rotando), o el texto fijo si está vacío"""
+        if not self._greetings:
+            return self.fallback
+        greeting = self._greetings[0]
+        self._greetings.rotate(-1)
+        return greeting
+
+    async def refresh(self) -> int:
+        """Generar un juego nuevo de saludos y reemplazar el pool"""
+        results = await asyncio.gather(*(self.generate() for _ in range(self.size)), return_exceptions=True)
+        greetings = [result.strip() for result in results if isinstance(result, str) and result.strip()]
+
+        failures = len(results) - len(greetings)
+        if failures:
+            logger.warning(f"⚠️  {failures} saludos no se pudieron generar")
+
+        if greetings:
+            # Reemplazo en una sola asignación: las llamadas nunca ven un pool a medias
+            self._greetings = deque(greetings)
+            self._refreshed_at = time.time()
+            logger.info(f"👋 Pool de saludos renovado: {len(greetings)} versiones")
+        return len(greetings)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error renovando el pool de saludos: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self):
+        """Iniciar la renovación en segundo plano (llamar desde el evento startup)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "size": len(self._greetings),
+            "refreshed_at": self._refreshed_at,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+# Instancia global del pool de saludos
+greeting_pool = GreetingPool()
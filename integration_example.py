@@ -19,9 +19,9 @@ def vapi_webhook():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
-# Endpoint para crear llamadas
+# Endpoint para crear llamadas (las vistas async requieren `pip install flask[async]`)
 @app.route('/create-call', methods=['POST'])
-def create_call():
+async def create_call():
     """Crear una llamada médica"""
     try:
         data = request.get_json()
@@ -31,7 +31,7 @@ def create_call():
         if not phone_number:
             return jsonify({"error": "phone_number es requerido"}), 400
         
-        result = create_medical_call(phone_number, patient_info)
+        result = await create_medical_call(phone_number, patient_info)
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -55,7 +55,7 @@ async def vapi_webhook(request: Request):
 
 @app.post("/create-call")
 async def create_call(call_request: CallRequest):
-    result = create_medical_call(call_request.phone_number, call_request.patient_info)
+    result = await create_medical_call(call_request.phone_number, call_request.patient_info)
     return result
 """
 
@@ -65,6 +65,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
+from asgiref.sync import async_to_sync
 from vapi_integration import process_vapi_webhook, create_medical_call
 
 @csrf_exempt
@@ -84,7 +85,7 @@ def create_call(request):
     if not phone_number:
         return JsonResponse({"error": "phone_number es requerido"}, status=400)
     
-    result = create_medical_call(phone_number, patient_info)
+    result = async_to_sync(create_medical_call)(phone_number, patient_info)
     return JsonResponse(result)
 """
 
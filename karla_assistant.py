@@ -7,35 +7,50 @@ Especializada en hacer, cambiar o cancelar citas para la Dra. Dolores Remedios d
 import os
 import json
 import asyncio
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
-import openai
 from dotenv import load_dotenv
 
+from calendar_time import CLINIC_TZ_NAME, today_local
+from karla_dialogue import (
+    FIELD_QUESTIONS, FIELD_REASKS, TEMPLATES, INTERPRET_DATETIME_TOOL, INTERPRET_DATETIME_CHOICE,
+    confirmation_text, format_options, is_booking_request, is_change_request, is_question,
+    match_offered_slot, new_dialogue_state, next_missing_field, parse_field, parse_yes_no,
+    split_reply, valid_date_time
+)
+from spanish_datetime import parse_date_time, slots_for_part_of_day
+from llm_executor import LLMBudgetExceeded
+from model_router import model_router
+from conversation_engine import conversation_engine
+from knowledge_base import knowledge_store
+from conversation_records import ConversationSummary, HistoryRing
+
+# Calendario (opcional): sin él Karla sigue funcionando solo con OpenAI
+try:
+    from google_calendar_manager import calendar_manager
+except ImportError as e:
+    print(f"⚠️  ADVERTENCIA: google_calendar_manager no disponible para Karla: {e}")
+    calendar_manager = None
+
+def _calendar_ready() -> bool:
+    """Hay calendario y está autenticado con Google"""
+    return calendar_manager is not None and calendar_manager.service is not None
+
 # Cargar variables de entorno
 load_dotenv()
 
 class KarlaAssistant:
-    def __init__(self):
+    def __init__(self, engine=conversation_engine):
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.client = None
-        self.conversation_context = {}
         self.appointment_data = {}
         
-        # Inicializar cliente OpenAI
-        if self.openai_api_key:
-            try:
-                self.client = openai.OpenAI(api_key=self.openai_api_key)
-                print("✅ Cliente OpenAI inicializado para Karla")
-            except Exception as e:
-                print(f"❌ Error inicializando cliente OpenAI: {e}")
+        # Cliente de LLM, contextos y documentos compartidos (ver conversation_engine)
+        self.engine = engine
+        self.conversation_context = engine.contexts("karla")
+        if self.client:
+            print(f"✅ Cliente de LLM inicializado para Karla ({self.client.name})")
         
-        # Cargar base de conocimiento
-        self.knowledge_base = self.load_knowledge_base()
-        self.doctor_info = self.load_doctor_info()
-        
-        # Estado de la conversación
-        self.current_step = "greeting"
+        # Pasos de la máquina de estados del diálogo (ver karla_dialogue)
         self.appointment_flow = {
             "greeting": "Saludo inicial",
             "ask_date_time": "Preguntar día y hora",
@@ -45,26 +60,30 @@ class KarlaAssistant:
             "end": "Finalizar conversación"
         }
     
+    @property
+    def client(self):
+        return self.engine.client
+    
+    @property
+    def knowledge_base(self) -> str:
+        return self.load_knowledge_base()
+    
+    @property
+    def doctor_info(self) -> str:
+        return self.load_doctor_info()
+    
     def load_knowledge_base(self) -> str:
         """Cargar base de conocimiento desde archivo"""
-        try:
-            with open("BaseDeConocimiento.txt", "r", encoding="utf-8") as f:
-                return f.read()
-        except Exception as e:
-            print(f"❌ Error cargando base de conocimiento: {e}")
-            return "Información del consultorio médico."
+        return self.engine.fragment("knowledge_base", "Información del consultorio médico.")
     
     def load_doctor_info(self) -> str:
         """Cargar información de la doctora"""
-        try:
-            with open("CurriculumDr.DoloresRemediosdelRincon.txt", "r", encoding="utf-8") as f:
-                return f.read()
-        except Exception as e:
-            print(f"❌ Error cargando información de la doctora: {e}")
-            return "Dra. Dolores Remedios del Rincón, especialista en Medicina Interna."
+        return self.engine.fragment("doctor_info", "Dra. Dolores Remedios del Rincón, especialista en Medicina Interna.")
     
     def get_system_prompt(self) -> str:
         """Obtener el prompt del sistema para Karla"""
+        # Horarios desde la base de conocimiento (siguen la recarga en caliente)
+        hours = knowledge_store.facts.get("horarios", {})
         return f"""
 Eres Karla, asistente virtual de la doctora Dolores Remedios del Rincón. Tu función es hacer, cambiar o cancelar citas.
 
@@ -123,9 +142,9 @@ Principios clave para esta respuesta:
 {self.knowledge_base}
 
 ## HORARIOS DISPONIBLES
-- Lunes a Viernes: 8:00 AM - 6:00 PM
-- Sábados: 9:00 AM - 2:00 PM
-- Domingos: Cerrado
+- Lunes a Viernes: {hours.get("lunes_viernes", "")}
+- Sábados: {hours.get("sabados", "")}
+- Domingos: {hours.get("domingos", "")}
 
 ## DOCUMENTOS NECESARIOS PARA PRIMERA CONSULTA
 - Documento de identidad
@@ -172,53 +191,239 @@ Responde de manera natural, empática y profesional. Siempre confirma la informa
         """Guardar información del paciente"""
         self.appointment_data[phone_number] = info
     
+    def _get_state(self, phone_number: str) -> Dict[str, Any]:
+        """Estado del diálogo de un paciente"""
+        if phone_number not in self.conversation_context:
+            self.conversation_context[phone_number] = {
+                **new_dialogue_state(), "messages": HistoryRing(), "summary": ConversationSummary()
+            }
+        return self.conversation_context[phone_number]
+    
     async def generate_response(self, phone_number: str, user_input: str = None, context: Dict = None) -> str:
-        """Generar respuesta de Karla"""
-        if not self.client:
-            return "Lo siento, no puedo procesar tu solicitud en este momento. Un miembro de nuestro equipo se pondrá en contacto contigo pronto."
+        """Generar respuesta de Karla
+        
+        Los pasos deterministas del protocolo se responden con plantillas; el
+        LLM solo se usa para preguntas libres e interpretar fechas.
+        """
+        state = self._get_state(phone_number)
         
         try:
-            # Obtener contexto de conversación
-            conversation_context = self.conversation_context.get(phone_number, {
-                "step": "greeting",
-                "appointment_data": {},
-                "messages": []
-            })
+            if not user_input:
+                state["step"] = "greeting"
+                reply = TEMPLATES["greeting"]
+            else:
+                reply = await self._advance(phone_number, state, user_input)
             
-            # Agregar mensaje del usuario
             if user_input:
-                conversation_context["messages"].append({"role": "user", "content": user_input})
+                state["messages"].add(user_input, is_user=True)
+            state["messages"].add(reply)
             
-            # Construir mensajes para OpenAI
-            messages = [
-                {"role": "system", "content": self.get_system_prompt()},
-                {"role": "assistant", "content": "Hola soy Karla, asistente de la doctora Dolores Remedios del Rincón. ¿En qué puedo ayudarte hoy?"}
-            ]
-            
-            # Agregar historial de conversación
-            for msg in conversation_context["messages"][-5:]:  # Últimos 5 mensajes
-                messages.append(msg)
-            
-            # Generar respuesta
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=300,
-                temperature=0.7
+            # Compactar los mensajes antiguos fuera del turno
+            self.engine.schedule_compaction(
+                state["messages"], state["summary"],
+                lambda msg: f"{'Paciente' if msg.is_user else 'Karla'}: {msg.content}"
             )
-            
-            karla_response = response.choices[0].message.content
-            
-            # Actualizar contexto
-            conversation_context["messages"].append({"role": "assistant", "content": karla_response})
-            self.conversation_context[phone_number] = conversation_context
-            
-            return karla_response
+            return reply
             
         except Exception as e:
             print(f"❌ Error generando respuesta de Karla: {e}")
             return "Lo siento, estoy teniendo dificultades técnicas. Un miembro de nuestro equipo se pondrá en contacto contigo pronto."
     
+    async def _advance(self, phone_number: str, state: Dict[str, Any], user_input: str) -> str:
+        """Avanzar la máquina de estados con la respuesta del paciente"""
+        step = state["step"]
+        
+        if step in ("greeting", "end"):
+            if is_change_request(user_input):
+                return await self.handle_change_or_cancel(phone_number, user_input)
+            if is_booking_request(user_input):
+                # Cita nueva: no heredar los datos ni el apartado de la cita anterior
+                self._release_hold(state)
+                state.update(appointment_data={}, pending_field=None, offered_slots=[], part_of_day=None)
+                state["step"] = "ask_date_time"
+                return TEMPLATES["ask_date_time"]
+            return await self._llm_reply(state, user_input)
+        
+        if step == "ask_date_time":
+            picked = match_offered_slot(user_input, state["offered_slots"])
+            if picked:
+                state["appointment_data"]["time"] = picked
+            else:
+                if is_question(user_input):
+                    return split_reply(await self._llm_reply(state, user_input), TEMPLATES["reask_date_time"])
+                parsed = parse_date_time(user_input)
+                date = parsed.date or (state["appointment_data"].get("date") if parsed.time else None)
+                time = parsed.time
+                if not date:
+                    # Frases que las reglas no cubren: interpretar con el LLM
+                    date, time = await self._interpret_date_time(user_input)
+                if not date:
+                    return TEMPLATES["reask_date_time"]
+                state["appointment_data"].update({"date": date, "time": time})
+                state["part_of_day"] = parsed.part_of_day
+            state["step"] = "check_availability"
+            return await self._check_and_hold(phone_number, state)
+        
+        if step == "collect_patient_info":
+            field = state["pending_field"]
+            value = parse_field(field, user_input)
+            if value is None:
+                if is_question(user_input):
+                    return split_reply(await self._llm_reply(state, user_input), FIELD_QUESTIONS[field])
+                return FIELD_REASKS.get(field, FIELD_QUESTIONS[field])
+            state["appointment_data"][field] = value
+            return self._ask_next_field(state)
+        
+        if step == "confirm_appointment":
+            answer = parse_yes_no(user_input)
+            if answer is None:
+                if is_question(user_input):
+                    return split_reply(await self._llm_reply(state, user_input), TEMPLATES["confirm_reask"])
+                return TEMPLATES["confirm_reask"]
+            if not answer:
+                self._release_hold(state)
+                state["step"] = "ask_date_time"
+                return TEMPLATES["restart"]
+            return await self._book(phone_number, state)
+        
+        return await self._llm_reply(state, user_input)
+    
+    async def _check_and_hold(self, phone_number: str, state: Dict[str, Any]) -> str:
+        """Verificar disponibilidad y apartar el horario mientras se piden los datos"""
+        data = state["appointment_data"]
+        date, time = data["date"], data.get("time")
+        
+        if not _calendar_ready():
+            # Sin calendario (o sin credenciales de Google) se acepta el horario pedido y el equipo lo confirma después
+            if not time:
+                state["step"] = "ask_date_time"
+                return TEMPLATES["reask_date_time"]
+            return self._ask_next_field(state)
+        
+        # Las consultas a Google Calendar corren fuera del event loop
+        available = await asyncio.to_thread(calendar_manager.get_available_slots, date, holder=phone_number)
+        slots = [slot['start_time'] for slot in available]
+        
+        if not slots:
+            state["step"] = "ask_date_time"
+            state["offered_slots"] = []
+            return TEMPLATES["day_full"].format(date=date)
+        
+        if time not in slots:
+            state["step"] = "ask_date_time"
+            preferred = slots_for_part_of_day(slots, state.get("part_of_day")) or slots
+            state["offered_slots"] = self._nearest_slots(preferred, time)
+            return TEMPLATES["slot_unavailable"].format(date=date, options=format_options(state["offered_slots"]))
+        
+        self._release_hold(state)
+        hold = await asyncio.to_thread(calendar_manager.hold_slot, date, time, holder=phone_number)
+        if not hold["success"]:
+            state["step"] = "ask_date_time"
+            return TEMPLATES["booking_failed"]
+        state["hold_id"] = hold["hold_id"]
+        
+        state["offered_slots"] = []
+        return TEMPLATES["slot_held"].format(date=date, time=time) + self._ask_next_field(state)
+    
+    @staticmethod
+    def _nearest_slots(slots: List[str], time: Optional[str], count: int = 3) -> List[str]:
+        """Horarios libres más cercanos a la hora pedida"""
+        if not time:
+            return slots[:count]
+        later = [slot for slot in slots if slot >= time]
+        earlier = [slot for slot in slots if slot < time]
+        return sorted((later + earlier[::-1])[:count])
+    
+    def _ask_next_field(self, state: Dict[str, Any]) -> str:
+        """Preguntar el siguiente dato pendiente o pasar a la confirmación"""
+        field = next_missing_field(state["appointment_data"])
+        if field:
+            state["step"] = "collect_patient_info"
+            state["pending_field"] = field
+            return FIELD_QUESTIONS[field]
+        
+        state["step"] = "confirm_appointment"
+        state["pending_field"] = None
+        return confirmation_text(state["appointment_data"])
+    
+    async def _book(self, phone_number: str, state: Dict[str, Any]) -> str:
+        """Confirmar la cita apartada en el calendario"""
+        data = state["appointment_data"]
+        
+        if _calendar_ready() and state["hold_id"]:
+            result = await asyncio.to_thread(calendar_manager.confirm_slot, state["hold_id"], {
+                'nombre': data.get('name'),
+                'telefono': data.get('phone'),
+                'motivo': f"{data.get('reason')} ({data.get('type')}) - Pago: {data.get('payment')}"
+            })
+            state["hold_id"] = None
+            if not result.get("success"):
+                state["step"] = "ask_date_time"
+                return TEMPLATES["booking_failed"]
+        
+        self.save_patient_info(phone_number, dict(data))
+        state["step"] = "end"
+        return self.get_appointment_confirmation(data)
+    
+    def _release_hold(self, state: Dict[str, Any]):
+        if calendar_manager and state.get("hold_id"):
+            calendar_manager.release_slot(state["hold_id"])
+        state["hold_id"] = None
+    
+    async def _interpret_date_time(self, user_input: str) -> Tuple[Optional[str], Optional[str]]:
+        """Interpretar con el LLM la fecha y hora pedidas en texto libre"""
+        if not self.client:
+            return None, None
+        
+        try:
+            response = await self.engine.complete(
+                [
+                    {"role": "system", "content": f"Hoy es {today_local()} (zona horaria {CLINIC_TZ_NAME}). Interpreta la fecha y hora que pide el paciente."},
+                    {"role": "user", "content": user_input}
+                ],
+                model_router.route(task="date_time"),
+                max_tokens=60,
+                tools=[INTERPRET_DATETIME_TOOL],
+                tool_choice=INTERPRET_DATETIME_CHOICE,
+                temperature=0
+            )
+            
+            tool_calls = response.choices[0].message.tool_calls or []
+            if not tool_calls:
+                return None, None
+            arguments = json.loads(tool_calls[0].function.arguments)
+            return valid_date_time(arguments.get("fecha"), arguments.get("hora"))
+            
+        except Exception as e:
+            print(f"❌ Error interpretando fecha con OpenAI: {e}")
+            return None, None
+    
+    async def _llm_reply(self, state: Dict[str, Any], user_input: str) -> str:
+        """Responder con el LLM una pregunta libre del paciente"""
+        if not self.client:
+            return "Lo siento, no puedo procesar tu solicitud en este momento. Un miembro de nuestro equipo se pondrá en contacto contigo pronto."
+        
+        # Construir mensajes para OpenAI
+        messages = [
+            {"role": "system", "content": self.get_system_prompt()},
+            {"role": "assistant", "content": TEMPLATES["greeting"]}
+        ]
+        if state["summary"].text:
+            messages.insert(1, {"role": "system", "content": f"Resumen de la conversación anterior: {state['summary'].text}"})
+        
+        # Agregar historial de conversación
+        for msg in state["messages"].recent(5):  # Últimos 5 mensajes
+            messages.append(msg.as_message())
+        messages.append({"role": "user", "content": user_input})
+        
+        # Generar respuesta dentro del plazo del turno, con el modelo según la complejidad
+        try:
+            response = await self.engine.complete(messages, model_router.route(user_input), temperature=0.7)
+        except LLMBudgetExceeded:
+            return TEMPLATES["llm_timeout"]
+        
+        return response.choices[0].message.content
+    
     async def handle_appointment_request(self, phone_number: str, user_input: str) -> str:
         """Manejar solicitud de cita específicamente"""
         try:
@@ -236,13 +441,36 @@ Responde de manera natural, empática y profesional. Siempre confirma la informa
     
     async def handle_first_time_appointment(self, phone_number: str, user_input: str) -> str:
         """Manejar cita de primera vez"""
-        return await self.generate_response(phone_number, 
-            f"Entiendo que necesitas una cita de primera vez. {user_input}. Te ayudo a agendar tu cita. ¿Qué día te gustaría venir?")
+        return self._start_booking(phone_number, "primera vez")
     
     async def handle_follow_up_appointment(self, phone_number: str, user_input: str) -> str:
         """Manejar cita de seguimiento"""
-        return await self.generate_response(phone_number, 
-            f"Perfecto, cita de seguimiento. {user_input}. ¿Qué día te gustaría venir para tu control?")
+        return self._start_booking(phone_number, "seguimiento")
+    
+    def _start_booking(self, phone_number: str, appointment_type: str) -> str:
+        """Iniciar el flujo de reserva con el tipo de consulta ya conocido"""
+        state = self._get_state(phone_number)
+        state["appointment_data"]["type"] = appointment_type
+        state["step"] = "ask_date_time"
+        return TEMPLATES["ask_date_time"]
+    
+    def find_existing_appointments(self, phone_number: str) -> List[Dict[str, Any]]:
+        """Buscar las citas próximas del paciente en el índice local del calendario"""
+        if not _calendar_ready():
+            return []
+        return calendar_manager.find_appointments_by_phone(phone_number)
+    
+    async def handle_change_or_cancel(self, phone_number: str, user_input: str) -> str:
+        """Manejar solicitud de cambiar o cancelar una cita existente"""
+        appointments = await asyncio.to_thread(self.find_existing_appointments, phone_number)
+        
+        if appointments:
+            found = "; ".join(f"{apt['date']} a las {apt['time']}" for apt in appointments)
+            context_text = f"{user_input}. (Citas encontradas para este teléfono: {found})"
+        else:
+            context_text = f"{user_input}. (No se encontraron citas próximas para este teléfono)"
+        
+        return await self._llm_reply(self._get_state(phone_number), context_text)
     
     def get_appointment_confirmation(self, appointment_data: Dict[str, str]) -> str:
         """Generar confirmación de cita"""
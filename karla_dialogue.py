@@ -0,0 +1,204 @@
+"""
+Máquina de estados del diálogo de reserva de Karla
+
+Lleva el registro de los datos ya recopilados y responde con plantillas los
+pasos deterministas (preguntas, repreguntas, confirmaciones). El LLM solo se
+usa para entender texto libre: preguntas generales del paciente e
+interpretación de fechas y horas.
+
+Flujo: greeting -> ask_date_time -> check_availability ->
+       collect_patient_info -> confirm_appointment -> end
+"""
+
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+from intent_classifier import intent_classifier, normalize_text
+
+# Datos del paciente, en el orden del protocolo de reserva
+PATIENT_FIELDS = ("name", "phone", "type", "reason", "preferred_hours", "payment")
+
+FIELD_QUESTIONS = {
+    "name": "¿Me podrías decir el nombre completo del paciente?",
+    "phone": "¿Cuál es un número de teléfono de contacto?",
+    "type": "¿Es tu primera consulta con la doctora o es una consulta de seguimiento?",
+    "reason": "¿Cuál es el motivo general de la consulta?",
+    "preferred_hours": "¿Qué horarios te acomodan mejor en caso de que necesitemos reprogramar?",
+    "payment": "¿Cuentas con obra social o cuál será tu forma de pago?",
+}
+
+FIELD_REASKS = {
+    "phone": "Disculpa, no alcancé a tomar el número. ¿Me lo podrías repetir, dígito por dígito?",
+    "type": "Perdona, ¿la consulta es de primera vez o de seguimiento?",
+}
+
+TEMPLATES = {
+    "greeting": "Hola soy Karla, asistente de la doctora Dolores Remedios del Rincón. ¿En qué puedo ayudarte hoy?",
+    "ask_date_time": "Con gusto te ayudo a agendar tu cita. ¿Qué día y a qué hora te gustaría venir?",
+    "reask_date_time": "No me quedó clara la fecha. ¿Qué día y a qué hora te gustaría tu cita? Por ejemplo, el martes a las 10 de la mañana.",
+    "slot_held": "Perfecto, tengo disponible el {date} a las {time} y te lo estoy apartando. ",
+    "slot_unavailable": "Ese horario no está disponible. Para el {date} tengo: {options}. ¿Cuál prefieres?",
+    "day_full": "Lo siento, el {date} no tengo horarios disponibles. ¿Qué otro día te acomoda?",
+    "confirm": (
+        "Para confirmar: cita el {date} a las {time} para {name}, consulta de {type}, "
+        "motivo: {reason}, teléfono {phone}, pago: {payment}. ¿Confirmo la cita?"
+    ),
+    "confirm_reask": "¿Me confirmas la cita? Responde sí para confirmarla o no para cambiar la fecha.",
+    "restart": "De acuerdo, no la confirmo. ¿Qué otro día y hora te gustaría?",
+    "booking_failed": "Lo siento, ese horario acaba de ocuparse. ¿Te gustaría otro día u hora?",
+    "end": "Gracias por llamar. Que tengas un excelente día.",
+    "llm_timeout": "Disculpa, no tengo esa información a la mano. Un miembro de nuestro equipo te la hará llegar.",
+}
+
+_YES_WORDS = ("si", "claro", "confirmo", "correcto", "de acuerdo", "esta bien", "perfecto", "adelante", "ok")
+_NO_WORDS = ("no", "cambiar", "otra fecha", "otro dia", "otro horario")
+_QUESTION_STARTS = ("que ", "como ", "donde ", "cuando ", "cuanto ", "cuanta ", "cual ", "cuales ", "aceptan", "tienen", "puedo")
+
+_NAME_PREFIXES = re.compile(r"^(me llamo|mi nombre es|soy|es|el paciente es|la paciente es|a nombre de)\s+", re.IGNORECASE)
+_DIGITS = re.compile(r"\d")
+_TIME_IN_TEXT = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\b")
+
+
+def _has_word(normalized: str, words) -> bool:
+    padded = f" {normalized} "
+    return any(f" {word} " in padded for word in words)
+
+
+def is_booking_request(text: str) -> bool:
+    return intent_classifier.intent(text) == "appointment"
+
+
+def is_change_request(text: str) -> bool:
+    return intent_classifier.intent(text) == "change"
+
+
+def is_question(text: str) -> bool:
+    """Heurística: el paciente hace una pregunta en lugar de responder"""
+    normalized = normalize_text(text)
+    return "?" in text or normalized.startswith(_QUESTION_STARTS)
+
+
+def parse_yes_no(text: str) -> Optional[bool]:
+    """True si confirma, False si rechaza, None si no está claro"""
+    normalized = normalize_text(text).strip(" .!,¡")
+    if normalized == "no" or normalized.startswith("no "):
+        return False
+    if _has_word(normalized, _YES_WORDS):
+        return True
+    if _has_word(normalized, _NO_WORDS):
+        return False
+    return None
+
+
+def parse_field(field: str, text: str) -> Optional[str]:
+    """Normalizar la respuesta del paciente para un dato; None si hay que repreguntar"""
+    value = text.strip().strip(".")
+    if not value:
+        return None
+
+    if field == "phone":
+        digits = "".join(_DIGITS.findall(value))
+        return digits if len(digits) >= 8 else None
+
+    if field == "type":
+        normalized = normalize_text(value)
+        if "primera" in normalized or "nuevo" in normalized or "nueva" in normalized:
+            return "primera vez"
+        if "seguimiento" in normalized or "control" in normalized or "revision" in normalized:
+            return "seguimiento"
+        return None
+
+    if field == "name":
+        value = _NAME_PREFIXES.sub("", value)
+
+    return value
+
+
+def match_offered_slot(text: str, offered: List[str]) -> Optional[str]:
+    """Elegir uno de los horarios ofrecidos ("la primera", "a las 10", "10:30")"""
+    if not offered:
+        return None
+
+    normalized = normalize_text(text)
+    ordinals = (("primer", 0), ("segund", 1), ("tercer", 2), ("ultim", len(offered) - 1))
+    for prefix, position in ordinals:
+        if prefix in normalized and position < len(offered):
+            return offered[position]
+
+    for match in _TIME_IN_TEXT.finditer(normalized):
+        hour = int(match.group(1))
+        minute = int(match.group(2) or 0)
+        for candidate in (hour, hour + 12):
+            slot = f"{candidate:02d}:{minute:02d}"
+            if slot in offered:
+                return slot
+    return None
+
+
+def new_dialogue_state() -> Dict[str, Any]:
+    """Estado inicial del diálogo de un paciente"""
+    return {
+        "step": "greeting",
+        "appointment_data": {},
+        "messages": [],
+        "pending_field": None,
+        "offered_slots": [],
+        "hold_id": None,
+        "part_of_day": None,
+    }
+
+
+def next_missing_field(data: Dict[str, Any]) -> Optional[str]:
+    for field in PATIENT_FIELDS:
+        if not data.get(field):
+            return field
+    return None
+
+
+def confirmation_text(data: Dict[str, Any]) -> str:
+    return TEMPLATES["confirm"].format(**{key: data.get(key, "") for key in
+                                          ("date", "time", "name", "type", "reason", "phone", "payment")})
+
+
+def format_options(slots: List[str]) -> str:
+    if len(slots) == 1:
+        return slots[0]
+    return ", ".join(slots[:-1]) + " o " + slots[-1]
+
+
+# Herramienta para que el LLM interprete fecha y hora en texto libre
+INTERPRET_DATETIME_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "interpretar_fecha_hora",
+        "description": "Convertir la fecha y hora que pidió el paciente a formato estándar.",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "fecha": {"type": ["string", "null"], "description": "Fecha en formato YYYY-MM-DD"},
+                "hora": {"type": ["string", "null"], "description": "Hora en formato HH:MM de 24 horas"},
+            },
+            "required": ["fecha", "hora"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+INTERPRET_DATETIME_CHOICE = {"type": "function", "function": {"name": "interpretar_fecha_hora"}}
+
+
+def split_reply(reply: str, follow_up: str) -> str:
+    """Unir una respuesta libre del LLM con la pregunta pendiente"""
+    return f"{reply.rstrip()} {follow_up}".strip()
+
+
+def valid_date_time(date: Optional[str], time: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Validar el formato de fecha (YYYY-MM-DD) y hora (HH:MM)"""
+    if not date or not re.fullmatch(r"\d{4}-\d{2}-\d{2}", date):
+        date = None
+    if not time or not re.fullmatch(r"\d{1,2}:\d{2}", time):
+        time = None
+    elif len(time) == 4:
+        time = "0" + time
+    return date, time
@@ -0,0 +1,507 @@
+"""
+Base de conocimiento precompilada
+
+`python build_knowledge.py` compila los archivos de texto (preguntas
+frecuentes y curriculum de la doctora) en un solo artefacto versionado
+(KNOWLEDGE_ARTIFACT) con:
+- pares pregunta/respuesta por sección
+- índice invertido para recuperar respuestas por palabras
+- conteo aproximado de tokens de cada pieza
+- fragmentos de prompt listos para insertar
+- datos del consultorio (DatosConsultorio.json: horarios, dirección, obras
+  sociales, documentos) y las respuestas y resultados de funciones de Vapi
+  que se arman con ellos
+
+Los textos citan los datos con `{horarios.lunes_viernes}`; así cada dato
+vive en un solo archivo (también la identidad de la doctora: el curriculum
+cita `{doctor.nombre}`). Un marcador sin completar (`[HORA]`) o una
+referencia a un dato inexistente se reporta como advertencia al compilar;
+`build_knowledge.py --strict` lo convierte en error.
+
+En el arranque el artefacto se lee con mmap y se verifica su checksum; si
+no existe se compila en memoria desde los archivos fuente, y si una fuente
+ya no coincide con el SHA-256 guardado en el artefacto se recompila.
+`reload_if_changed()` solo recarga cuando cambia el checksum del artefacto.
+
+Recarga en caliente: knowledge_watcher revisa cada KNOWLEDGE_WATCH_INTERVAL
+segundos las fuentes y el artefacto; si cambian, recompila en su hilo y
+reemplaza la versión cargada en una sola asignación. Las llamadas en curso
+terminan con la versión que ya tenían y las siguientes usan la nueva.
+
+Formato: una línea de encabezado JSON ({"format", "checksum"}) seguida del
+cuerpo JSON; el checksum es el SHA-256 del cuerpo.
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import logging
+
+from intent_classifier import normalize_text
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Artefacto generado por build_knowledge.py
+KNOWLEDGE_ARTIFACT = os.getenv("KNOWLEDGE_ARTIFACT", "knowledge.kb")
+
+ARTIFACT_FORMAT = 2
+
+# Segundos entre revisiones de las fuentes (0 desactiva la recarga en caliente)
+KNOWLEDGE_WATCH_INTERVAL = float(os.getenv("KNOWLEDGE_WATCH_INTERVAL", "5"))
+
+# Fragmento -> archivo fuente
+KNOWLEDGE_SOURCES = {
+    "knowledge_base": "BaseDeConocimiento.txt",
+    "doctor_info": "CurriculumDr.DoloresRemediosdelRincon.txt",
+    "facts": "DatosConsultorio.json",
+}
+
+_SECTION = re.compile(r"^###\s+(.+?)\s*$", re.MULTILINE)
+_QA = re.compile(r"\*\*P:\s*(.+?)\*\*\s*\n+R:\s*(.+?)(?=\n\s*\*\*P:|\n\s*#|\Z)", re.DOTALL)
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_TERM = re.compile(r"[a-z0-9ñ]+")
+_FACT_REF = re.compile(r"\{([a-z_]+(?:\.[a-z_]+)*)\}")
+_PLACEHOLDER = re.compile(r"\[[A-ZÁÉÍÓÚÑ0-9 _]+\]")
+
+# Palabras sin valor para la recuperación
+STOPWORDS = frozenset(
+    "a al algo alguna como con cual cuales cuando de del debo donde el en es esta este hacen hago "
+    "la las lo los me mi mis no o para pero por puedo que se si sin su sus tiene un una y ya yo".split()
+)
+
+
+class KnowledgeArtifactError(Exception):
+    """El artefacto no existe, está dañado o no coincide su checksum"""
+
+
+class FrozenDict(dict):
+    """dict de solo lectura; se serializa a JSON como cualquier dict"""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Los datos del consultorio son de solo lectura")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+def freeze(value: Any) -> Any:
+    """Copia inmutable: dicts -> FrozenDict, listas -> tuplas"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def estimate_tokens(text: str) -> int:
+    """Conteo aproximado de tokens (palabras y signos, +30% por subpalabras)"""
+    return math.ceil(len(_TOKEN.findall(text)) * 1.3)
+
+
+def terms(text: str) -> List[str]:
+    """Términos normalizados (sin acentos ni palabras vacías) para el índice"""
+    return [term for term in _TERM.findall(normalize_text(text)) if term not in STOPWORDS and len(term) > 2]
+
+
+def parse_qa(text: str) -> List[Dict[str, Any]]:
+    """Pares pregunta/respuesta del archivo de preguntas frecuentes, con su sección"""
+    sections = [(match.start(), match.group(1).strip()) for match in _SECTION.finditer(text)]
+    pairs = []
+    for match in _QA.finditer(text):
+        section = ""
+        for start, name in sections:
+            if start > match.start():
+                break
+            section = name
+        question = " ".join(match.group(1).split())
+        answer = " ".join(match.group(2).split())
+        pairs.append({
+            "id": len(pairs),
+            "section": section,
+            "question": question,
+            "answer": answer,
+            "tokens": estimate_tokens(f"{question} {answer}"),
+        })
+    return pairs
+
+
+def build_index(pairs: List[Dict[str, Any]]) -> Dict[str, List[List[int]]]:
+    """Índice invertido término -> [id, peso]; un término de la pregunta pesa 2, de la respuesta 1"""
+    index: Dict[str, List[List[int]]] = {}
+    for pair in pairs:
+        question_terms = set(terms(pair["question"]))
+        for term in question_terms | set(terms(pair["answer"])):
+            index.setdefault(term, []).append([pair["id"], 2 if term in question_terms else 1])
+    return index
+
+
+def fact(facts: Dict[str, Any], path: str) -> Any:
+    """Dato por ruta con puntos ("horarios.sabados")"""
+    value: Any = facts
+    for key in path.split("."):
+        value = value[key]
+    return value
+
+
+def spoken_list(items: List[str]) -> str:
+    """Enumeración hablada: a, b y c"""
+    items = list(items)
+    if len(items) < 2:
+        return "".join(items)
+    return f"{', '.join(items[:-1])} y {items[-1]}"
+
+
+def render_facts(text: str, facts: Dict[str, Any]) -> str:
+    """Reemplazar `{ruta.del.dato}` por su valor; las referencias inexistentes quedan igual"""
+    def replace(match):
+        try:
+            value = fact(facts, match.group(1))
+        except (KeyError, TypeError):
+            return match.group(0)
+        return spoken_list(value) if isinstance(value, list) else str(value)
+    return _FACT_REF.sub(replace, text)
+
+
+def find_placeholders(facts: Dict[str, Any], templates: Dict[str, str]) -> List[str]:
+    """Marcadores sin completar ("[HORA]") y referencias a datos inexistentes"""
+    problems = []
+
+    def walk(value: Any, path: str):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(item, f"{path}.{key}")
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                walk(item, f"{path}[{i}]")
+        elif isinstance(value, str):
+            problems.extend(f"{path}: {match}" for match in _PLACEHOLDER.findall(value))
+
+    walk({key: value for key, value in facts.items() if key != "respuestas"}, "facts")
+    for name, text in templates.items():
+        problems.extend(f"{name}: {match}" for match in _PLACEHOLDER.findall(text))
+        problems.extend(f"{name}: {{{match}}} (dato inexistente)" for match in _FACT_REF.findall(render_facts(text, facts)))
+    return list(dict.fromkeys(problems))
+
+
+def compile_functions(facts: Dict[str, Any], answers: Dict[str, str]) -> Dict[str, Any]:
+    """Resultados fijos de las funciones de Vapi que no dependen de los argumentos"""
+    doctor = facts["doctor"]
+    return {
+        "get_appointment_info": {
+            "horarios": facts["horarios"],
+            "ubicacion": answers["ubicacion"],
+            "doctor": doctor["titulo"],
+            "preparacion": facts["documentos_primera_consulta"],
+        },
+        "get_doctor_info": {
+            "name": doctor["nombre"],
+            "specialty": doctor["especialidad"],
+            "experience": doctor["experiencia"],
+            "certifications": doctor["certificaciones"],
+            "education": doctor["formacion"],
+        },
+        "get_specialties": {
+            "specialties": facts["especialidades"],
+            "description": doctor["descripcion"],
+        },
+    }
+
+
+def read_sources(sources: Dict[str, str] = KNOWLEDGE_SOURCES) -> Dict[str, str]:
+    documents = {}
+    for name, path in sources.items():
+        with open(path, "r", encoding="utf-8") as f:
+            documents[name] = f.read()
+    return documents
+
+
+def stale_sources(body: Dict[str, Any], sources: Dict[str, str] = KNOWLEDGE_SOURCES) -> List[str]:
+    """Fuentes cuyo contenido en disco ya no es el que se compiló en el artefacto
+
+    Una fuente que no existe en disco no cuenta: el despliegue puede llevar
+    solo el artefacto.
+    """
+    compiled = body.get("sources", {})
+    stale = []
+    for name, path in sources.items():
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                digest = hashlib.sha256(f.read().encode("utf-8")).hexdigest()
+        except OSError:
+            continue
+        if compiled.get(name, {}).get("sha256") != digest:
+            stale.append(name)
+    return stale
+
+
+def compile_knowledge(documents: Dict[str, str], sources: Dict[str, str] = KNOWLEDGE_SOURCES) -> Dict[str, Any]:
+    """Cuerpo del artefacto a partir del texto de cada fuente"""
+    facts = json.loads(documents["facts"]) if "facts" in documents else {}
+    fragments = {name: render_facts(text, facts).strip() for name, text in documents.items() if name != "facts"}
+    pairs = parse_qa(fragments.get("knowledge_base", ""))
+    answers = {topic: render_facts(template, facts) for topic, template in facts.get("respuestas", {}).items()}
+    fragments["faq"] = "\n".join(f"P: {pair['question']}\nR: {pair['answer']}" for pair in pairs)
+    return {
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "sources": {
+            name: {"path": sources[name], "sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()}
+            for name, text in documents.items()
+        },
+        "qa": pairs,
+        "index": build_index(pairs),
+        "fragments": fragments,
+        "fragment_tokens": {name: estimate_tokens(text) for name, text in fragments.items()},
+        "facts": facts,
+        "answers": answers,
+        "functions": compile_functions(facts, answers) if facts else {},
+        "placeholders": find_placeholders(facts, {
+            **{name: text for name, text in documents.items() if name != "facts"},
+            **{f"respuestas.{topic}": template for topic, template in facts.get("respuestas", {}).items()},
+        }),
+    }
+
+
+def serialize_artifact(body: Dict[str, Any]) -> Tuple[str, bytes]:
+    """(checksum, bytes del artefacto)"""
+    payload = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    checksum = hashlib.sha256(payload).hexdigest()
+    header = {"format": ARTIFACT_FORMAT, "checksum": checksum}
+    return checksum, json.dumps(header).encode("utf-8") + b"\n" + payload
+
+
+def write_artifact(body: Dict[str, Any], path: str = KNOWLEDGE_ARTIFACT) -> str:
+    """Escribir el artefacto de forma atómica; devuelve su checksum"""
+    checksum, data = serialize_artifact(body)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return checksum
+
+
+def read_checksum(path: str = KNOWLEDGE_ARTIFACT) -> Optional[str]:
+    """Checksum del encabezado del artefacto, sin leer el cuerpo"""
+    try:
+        with open(path, "rb") as f:
+            return json.loads(f.readline())["checksum"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_artifact(path: str = KNOWLEDGE_ARTIFACT) -> Tuple[str, Dict[str, Any]]:
+    """Leer con mmap y verificar el artefacto; devuelve (checksum, cuerpo)"""
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end = mm.find(b"\n")
+            header = json.loads(mm[:header_end])
+            payload = mm[header_end + 1:]
+    except (OSError, ValueError) as e:
+        raise KnowledgeArtifactError(f"No se pudo leer {path}: {e}") from e
+
+    if header.get("format") != ARTIFACT_FORMAT:
+        raise KnowledgeArtifactError(f"Formato {header.get('format')} de {path} no soportado")
+    if hashlib.sha256(payload).hexdigest() != header.get("checksum"):
+        raise KnowledgeArtifactError(f"Checksum de {path} no coincide")
+    return header["checksum"], json.loads(payload)
+
+
+class KnowledgeStore:
+    def __init__(self, path: str = KNOWLEDGE_ARTIFACT, sources: Dict[str, str] = KNOWLEDGE_SOURCES):
+        self.path = path
+        self.sources = sources
+        self.checksum: Optional[str] = None
+        self._body: Dict[str, Any] = {
+            "qa": [], "index": {}, "fragments": {}, "fragment_tokens": {},
+            "facts": FrozenDict(), "answers": FrozenDict(), "functions": FrozenDict(), "placeholders": [],
+        }
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.load()
+
+    def _swap(self, checksum: str, body: Dict[str, Any]):
+        # Tablas de consulta inmutables: se comparten entre peticiones sin copiarlas
+        body = {**body, **{section: freeze(body[section]) for section in ("facts", "answers", "functions")}}
+        if body["placeholders"]:
+            logger.warning(f"⚠️  Datos del consultorio sin completar: {'; '.join(body['placeholders'])}")
+
+        # Una sola asignación: quien ya leyó self._body sigue con la versión anterior
+        with self._lock:
+            if self.checksum is not None:
+                self.reloads += 1
+            self._body = body
+            self.checksum = checksum
+
+    def load(self) -> bool:
+        """Cargar el artefacto; sin artefacto, o si sus fuentes cambiaron, se compila desde las fuentes"""
+        try:
+            checksum, body = load_artifact(self.path)
+            stale = stale_sources(body, self.sources)
+            if stale:
+                # Fuentes editadas con el servidor apagado: el artefacto ya no las refleja
+                logger.warning(f"⚠️  {self.path} no coincide con {', '.join(stale)}; recompilando")
+                if self.rebuild():
+                    return True
+            logger.info(f"📚 Base de conocimiento {checksum[:12]} cargada ({len(body['qa'])} preguntas)")
+        except KnowledgeArtifactError as e:
+            if self.checksum:
+                # Ya hay una versión cargada: conservarla
+                logger.error(f"❌ {e}; se conserva la versión {self.checksum[:12]}")
+                return False
+            logger.warning(f"⚠️  {e}; compilando la base de conocimiento desde las fuentes")
+            try:
+                body = compile_knowledge(read_sources(self.sources), self.sources)
+            except (OSError, ValueError, KeyError) as source_error:
+                logger.error(f"❌ Error compilando las fuentes de conocimiento: {source_error}")
+                return False
+            checksum, _ = serialize_artifact(body)
+
+        self._swap(checksum, body)
+        return True
+
+    def rebuild(self) -> bool:
+        """Recompilar desde las fuentes, guardar el artefacto y reemplazar la versión cargada"""
+        try:
+            body = compile_knowledge(read_sources(self.sources), self.sources)
+        except Exception as e:
+            logger.error(f"❌ Error recompilando la base de conocimiento, se conserva la versión actual: {e}")
+            return False
+
+        try:
+            checksum = write_artifact(body, self.path)
+        except OSError as e:
+            # Sistema de archivos de solo lectura: la versión nueva queda solo en memoria
+            logger.warning(f"⚠️  No se pudo guardar {self.path}: {e}")
+            checksum, _ = serialize_artifact(body)
+
+        self._swap(checksum, body)
+        logger.info(f"📚 Base de conocimiento recompilada: {checksum[:12]} ({len(body['qa'])} preguntas)")
+        return True
+
+    def reload_if_changed(self) -> bool:
+        """Recargar solo si cambió el checksum del artefacto en disco"""
+        checksum = read_checksum(self.path)
+        if checksum is None or checksum == self.checksum:
+            return False
+        return self.load()
+
+    def fragment(self, name: str, default: str = "") -> str:
+        """Fragmento de prompt precompilado ("knowledge_base", "doctor_info", "faq")"""
+        return self._body["fragments"].get(name) or default
+
+    def fragment_tokens(self, name: str) -> int:
+        return self._body["fragment_tokens"].get(name, 0)
+
+    @property
+    def facts(self) -> Dict[str, Any]:
+        """Datos del consultorio (solo lectura)"""
+        return self._body["facts"]
+
+    def answer(self, topic: str, default: str = "") -> str:
+        """Respuesta fija por tema ("horarios", "ubicacion", "preparacion", ...)"""
+        return self._body["answers"].get(topic, default)
+
+    def function_result(self, name: str) -> Optional[Dict[str, Any]]:
+        """Resultado precompilado de una función de Vapi sin argumentos (solo lectura)"""
+        return self._body["functions"].get(name)
+
+    def search(self, query: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """Preguntas frecuentes que mejor coinciden con la consulta del paciente"""
+        body = self._body
+        scores: Dict[int, float] = {}
+        for term in set(terms(query)):
+            postings = body["index"].get(term, ())
+            for qa_id, weight in postings:
+                # Términos poco frecuentes pesan más
+                scores[qa_id] = scores.get(qa_id, 0.0) + weight / len(postings)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{**body["qa"][qa_id], "score": round(score, 3)} for qa_id, score in best]
+
+    def stats(self) -> Dict[str, Any]:
+        body = self._body
+        return {
+            "checksum": self.checksum,
+            "built_at": body.get("built_at"),
+            "qa": len(body["qa"]),
+            "terms": len(body["index"]),
+            "fragment_tokens": dict(body["fragment_tokens"]),
+            "answers": sorted(body["answers"]),
+            "placeholders": list(body["placeholders"]),
+            "reloads": self.reloads,
+        }
+
+
+class KnowledgeWatcher:
+    """Revisión periódica de las fuentes y del artefacto (sin dependencias de inotify)"""
+
+    def __init__(self, store: KnowledgeStore, interval: float = KNOWLEDGE_WATCH_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._signatures = self._snapshot()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _snapshot(self) -> Dict[str, Optional[Tuple[int, int]]]:
+        signatures = {}
+        for path in list(self.store.sources.values()) + [self.store.path]:
+            try:
+                stat = os.stat(path)
+                signatures[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signatures[path] = None
+        return signatures
+
+    def check(self) -> bool:
+        """Recompilar si cambió una fuente, o recargar si cambió el artefacto"""
+        snapshot = self._snapshot()
+        if snapshot == self._signatures:
+            return False
+        sources_changed = any(snapshot[path] != self._signatures.get(path) for path in self.store.sources.values())
+        self._signatures = snapshot
+
+        if sources_changed:
+            reloaded = self.store.rebuild()
+            # El artefacto recién escrito no debe disparar otra recarga
+            self._signatures = self._snapshot()
+            return reloaded
+        return self.store.reload_if_changed()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error revisando la base de conocimiento: {e}")
+
+    def start(self):
+        """Iniciar la revisión en segundo plano (llamar desde el evento startup)"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="knowledge-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"👀 Recarga en caliente de la base de conocimiento cada {self.interval:g}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+# Instancia global de la base de conocimiento
+knowledge_store = KnowledgeStore()
+
+# Recarga en caliente de knowledge_store
+knowledge_watcher = KnowledgeWatcher(knowledge_store)
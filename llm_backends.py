@@ -0,0 +1,301 @@
+"""
+Backends de LLM intercambiables
+
+Todos exponen la misma interfaz que el cliente de OpenAI
+(`client.chat.completions.create(...)`), así que los gestores de conversación
+y Karla no cambian según el backend elegido con LLM_BACKEND:
+- "openai": API de OpenAI
+- "llamacpp": servidor local compatible con llama.cpp (endpoint /v1 de OpenAI)
+- "scripted": modelo determinista sin red, para pruebas y pruebas de carga
+
+Con LLM_LOCAL_FALLBACK (desactivado por defecto) el backend remoto pasa al
+modo local degradado cuando la API no responde o su circuito está abierto.
+Un error de configuración (sin paquete o sin clave) nunca usa el modo local.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import logging
+
+from appointment_extraction import EXTRACT_TOOL_NAME, RESPOND_TOOL_NAME, empty_appointment_info
+from intent_classifier import intent_classifier
+from resilience import Upstream, UpstreamUnavailable, upstream
+from spanish_datetime import parse_date_time
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Backend principal: openai, llamacpp o scripted
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+
+# Backend local para el modo degradado durante caídas de la API (vacío = desactivado)
+LLM_LOCAL_FALLBACK = os.getenv("LLM_LOCAL_FALLBACK", "").lower()
+
+# URL del servidor compatible con llama.cpp
+LLAMACPP_URL = os.getenv("LLAMACPP_URL", "http://localhost:8080/v1")
+
+# Segundos de latencia simulada del modelo determinista (pruebas de carga)
+LLM_SCRIPTED_LATENCY = float(os.getenv("LLM_SCRIPTED_LATENCY", "0"))
+
+SCRIPTED_REPLIES = {
+    "greeting": (
+        "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón. "
+        "Atendemos de lunes a viernes de 8:00 a 18:00. ¿En qué puedo ayudarle hoy?"
+    ),
+    "appointment": "Con gusto le ayudo a agendar su cita. ¿Qué día y a qué hora le gustaría venir?",
+    "date_time": "Perfecto, tengo anotado {when}. ¿Me confirma su nombre completo, por favor?",
+    "change": "Entiendo que desea cambiar o cancelar su cita. Un miembro de nuestro equipo se pondrá en contacto con usted para confirmarlo.",
+    "schedule": "Atendemos de lunes a viernes de 8:00 a 18:00. ¿Le gustaría agendar una cita?",
+    "location": "Con gusto le compartimos la dirección del consultorio. Contamos con estacionamiento disponible. ¿Le gustaría agendar una cita?",
+    "preparation": "Para la primera consulta traiga su documento de identidad, su carnet de obra social y sus estudios previos.",
+    "emergency": "Si se trata de una emergencia, por favor llame al 911 o acuda a urgencias de inmediato.",
+    "general": "Gracias por la información. ¿En qué más puedo ayudarle?",
+}
+
+_PATIENT_LINE = re.compile(r"^(?:Usuario|Paciente):\s*(.*)$", re.MULTILINE)
+# Los gestores piden el saludo con el prompt base, sin historial
+_GREETING_REQUEST = "Genera un saludo"
+# Compactación del historial (ver conversation_engine)
+_SUMMARY_REQUEST = "Resume la conversación"
+_PREVIOUS_SUMMARY = re.compile(r"^Resumen anterior: (.*)$", re.MULTILINE)
+_TODAY = re.compile(r"Hoy es (\d{4}-\d{2}-\d{2})")
+_NAME = re.compile(
+    r"(?:me llamo|mi nombre es|soy)\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+(?:de\s+|del\s+)?[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)*)"
+)
+_PHONE = re.compile(r"\+?\d[\d\s-]{6,}\d")
+
+
+def _response(content: Optional[str] = None, tool_name: Optional[str] = None,
+              arguments: Optional[Dict[str, Any]] = None, prompt_tokens: int = 0) -> SimpleNamespace:
+    """Respuesta con la misma forma que la de OpenAI (choices, message, usage)"""
+    tool_calls = None
+    completion = content or ""
+    if tool_name:
+        completion = json.dumps(arguments, ensure_ascii=False)
+        tool_calls = [SimpleNamespace(
+            id=f"call_{tool_name}", type="function",
+            function=SimpleNamespace(name=tool_name, arguments=completion),
+        )]
+    message = SimpleNamespace(role="assistant", content=content, tool_calls=tool_calls)
+    completion_tokens = len(completion.split())
+    return SimpleNamespace(
+        choices=[SimpleNamespace(index=0, message=message, finish_reason="tool_calls" if tool_calls else "stop")],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              total_tokens=prompt_tokens + completion_tokens),
+    )
+
+
+class ChatBackend(ABC):
+    """Interfaz común: `backend.chat.completions.create(**kwargs)` como en OpenAI"""
+
+    name = "base"
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @abstractmethod
+    def create(self, **kwargs) -> Any:
+        """Generar una respuesta con los mismos argumentos que la API de OpenAI"""
+
+
+class OpenAIBackend(ChatBackend):
+    """API de OpenAI, o cualquier servidor con la misma API (llama.cpp)"""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 service: Optional[Upstream] = None, name: str = "openai"):
+        super().__init__()
+        from openai import OpenAI
+
+        self.name = name
+        self.service = service or upstream(name)
+        self._client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"), base_url=base_url)
+
+    def create(self, **kwargs) -> Any:
+        # Con el circuito abierto falla al instante (ver resilience)
+        with self.service.guard():
+            return self._client.chat.completions.create(**kwargs)
+
+
+class ScriptedBackend(ChatBackend):
+    """Modelo determinista sin red
+
+    Responde según la intención del último mensaje del paciente y llena las
+    herramientas de datos de cita con el intérprete de fechas en español.
+    """
+
+    name = "scripted"
+
+    def __init__(self, replies: Dict[str, str] = SCRIPTED_REPLIES, latency: float = LLM_SCRIPTED_LATENCY):
+        super().__init__()
+        self.replies = replies
+        self.latency = latency
+
+    @staticmethod
+    def _patient_text(messages: List[Dict[str, Any]]) -> str:
+        """Último mensaje del paciente, también dentro de un prompt con historial"""
+        for message in reversed(messages):
+            if message.get("role") != "user":
+                continue
+            content = message.get("content") or ""
+            if "HISTORIAL DE CONVERSACIÓN" in content:
+                lines = _PATIENT_LINE.findall(content.split("HISTORIAL DE CONVERSACIÓN", 1)[1])
+                return lines[-1].strip() if lines else ""
+            if _GREETING_REQUEST in content:
+                return ""
+            return content.strip()
+        return ""
+
+    @staticmethod
+    def _today(messages: List[Dict[str, Any]]) -> Optional[str]:
+        for message in messages:
+            match = _TODAY.search(message.get("content") or "")
+            if match:
+                return match.group(1)
+        return None
+
+    def extract(self, text: str, today: Optional[str] = None) -> Dict[str, Any]:
+        """Datos de cita mencionados en el texto (null los que no aparecen)"""
+        info = empty_appointment_info()
+        name = _NAME.search(text)
+        if name:
+            info["nombre"] = name.group(1)
+        phone = _PHONE.search(text)
+        if phone:
+            info["telefono"] = re.sub(r"[\s-]", "", phone.group(0))
+        parsed = parse_date_time(text, today)
+        info["fecha_preferida"] = parsed.date
+        info["hora_preferida"] = parsed.time
+        return info
+
+    def reply(self, text: str, today: Optional[str] = None) -> str:
+        if not text:
+            return self.replies["greeting"]
+        intent = intent_classifier.intent(text)
+        if intent in ("appointment", "general"):
+            parsed = parse_date_time(text, today)
+            if parsed.date or parsed.time:
+                when = " a las ".join(part for part in (parsed.date, parsed.time) if part)
+                return self.replies["date_time"].format(when=when)
+        return self.replies.get(intent, self.replies["general"])
+
+    def create(self, model: str = "", messages: List[Dict[str, Any]] = (), tools: Optional[list] = None,
+               tool_choice: Any = None, **kwargs) -> SimpleNamespace:
+        if self.latency:
+            time.sleep(self.latency)
+
+        messages = list(messages)
+        text = self._patient_text(messages)
+        today = self._today(messages)
+        prompt_tokens = sum(len((message.get("content") or "").split()) for message in messages)
+
+        tool_name = None
+        if isinstance(tool_choice, dict):
+            tool_name = tool_choice["function"]["name"]
+        elif tools:
+            tool_name = tools[0]["function"]["name"]
+
+        if not tool_name and any(_SUMMARY_REQUEST in (message.get("content") or "")
+                                 for message in messages if message.get("role") == "system"):
+            # Resumen extractivo: el resumen anterior y lo que dijo el paciente
+            content = messages[-1].get("content") or ""
+            previous = _PREVIOUS_SUMMARY.search(content)
+            lines = [line.strip() for line in _PATIENT_LINE.findall(content)]
+            if previous and previous.group(1) != "ninguno":
+                lines.insert(0, previous.group(1))
+            return _response("; ".join(lines), prompt_tokens=prompt_tokens)
+
+        if tool_name == RESPOND_TOOL_NAME:
+            arguments = {"respuesta": self.reply(text, today), "datos_cita": self.extract(text, today)}
+        elif tool_name == EXTRACT_TOOL_NAME:
+            arguments = self.extract(text, today)
+        elif tool_name:
+            # Interpretación de fecha y hora (Karla)
+            parsed = parse_date_time(text, today)
+            arguments = {"fecha": parsed.date, "hora": parsed.time}
+        else:
+            return _response(self.reply(text, today), prompt_tokens=prompt_tokens)
+        return _response(tool_name=tool_name, arguments=arguments, prompt_tokens=prompt_tokens)
+
+
+def _is_unreachable(error: BaseException) -> bool:
+    """La API no respondió: circuito abierto, error de conexión o timeout del cliente"""
+    if isinstance(error, (UpstreamUnavailable, ConnectionError, TimeoutError)):
+        return True
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class FallbackBackend(ChatBackend):
+    """Backend remoto con modo local degradado mientras la API no responde"""
+
+    def __init__(self, primary: ChatBackend, local: ChatBackend):
+        super().__init__()
+        self.primary = primary
+        self.local = local
+        self.name = f"{primary.name}+{local.name}"
+        self._lock = threading.Lock()
+        self._degraded = False
+        self._stats = {"calls": 0, "local_calls": 0}
+
+    def create(self, **kwargs) -> Any:
+        self._count("calls")
+        try:
+            response = self.primary.create(**kwargs)
+        except Exception as e:
+            if not _is_unreachable(e):
+                raise
+            self._set_degraded(True, e)
+            self._count("local_calls")
+            return self.local.create(**kwargs)
+        self._set_degraded(False)
+        return response
+
+    def _set_degraded(self, degraded: bool, error: Optional[BaseException] = None):
+        with self._lock:
+            changed = degraded != self._degraded
+            self._degraded = degraded
+        if changed and degraded:
+            logger.error(f"🛟 {self.primary.name} no responde ({error}), usando el modo local {self.local.name}")
+        elif changed:
+            logger.info(f"✅ {self.primary.name} responde de nuevo, saliendo del modo local")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "degraded": self._degraded}
+
+
+_BACKENDS: Dict[str, Callable[[], ChatBackend]] = {
+    "openai": lambda: OpenAIBackend(),
+    "llamacpp": lambda: OpenAIBackend(api_key=os.getenv("LLAMACPP_API_KEY", "sin-clave"),
+                                      base_url=LLAMACPP_URL, name="llamacpp"),
+    "scripted": lambda: ScriptedBackend(),
+}
+
+
+def create_llm_client(name: str = LLM_BACKEND, local_fallback: str = LLM_LOCAL_FALLBACK) -> Optional[ChatBackend]:
+    """Crear el cliente de LLM configurado, con modo local si corresponde
+
+    Si el backend no se puede inicializar (sin paquete o sin clave) devuelve
+    None: es un error de configuración y no se disfraza con respuestas del
+    modo local, que solo cubre caídas de la API en tiempo de ejecución.
+    """
+    try:
+        backend = _BACKENDS[name]()
+    except Exception as e:
+        logger.error(f"❌ Error inicializando el backend de LLM {name}: {e}")
+        return None
+
+    if local_fallback and local_fallback != name and isinstance(backend, OpenAIBackend):
+        return FallbackBackend(backend, _BACKENDS[local_fallback]())
+    return backend
@@ -0,0 +1,169 @@
+"""
+Caché de respuestas del LLM
+
+Los saludos y las respuestas del primer turno usan el mismo prompt en todas
+las llamadas salvo por el teléfono del paciente y la hora. La clave de la
+caché es una huella del prompt normalizado (sin teléfonos, fechas ni horas,
+en minúsculas y con espacios colapsados), así que esas llamadas comparten
+respuesta.
+
+- Nivel en memoria: LRU acotado por número de entradas, con TTL
+- Nivel en disco (opcional): SQLite en LLM_CACHE_DB, sobrevive reinicios
+- Estadísticas de aciertos y fallos en `stats()`
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import logging
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Segundos que una respuesta se considera vigente
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+
+# Entradas máximas en memoria
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+
+# Ruta del nivel en disco; vacío para usar solo memoria
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}(?:[t ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:z|[+-]\d{2}:?\d{2})?)?")
+_CLOCK = re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?\b")
+_PHONE = re.compile(r"\+?\d[\d\s().-]{6,}\d")
+
+
+def normalize_prompt(text: str) -> str:
+    """Quitar del prompt lo que cambia entre llamadas sin cambiar la respuesta"""
+    text = " ".join(text.lower().split())
+    text = _TIMESTAMP.sub("<fecha>", text)
+    text = _CLOCK.sub("<hora>", text)
+    return _PHONE.sub("<telefono>", text)
+
+
+def prompt_fingerprint(model: str, messages: List[Dict[str, str]], **params: Any) -> str:
+    """Huella SHA-256 del modelo, los mensajes normalizados y los parámetros"""
+    payload = {
+        "model": model,
+        "messages": [[message["role"], normalize_prompt(message["content"])] for message in messages],
+        "params": params,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, ttl_seconds: int = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 db_path: Optional[str] = LLM_CACHE_DB):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "stores": 0}
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+                self._db.commit()
+                logger.info(f"💾 Caché de respuestas en disco: {db_path}")
+            except sqlite3.Error as e:
+                logger.error(f"Error abriendo caché en disco {db_path}: {e}")
+                self._db = None
+
+    def get(self, key: str) -> Optional[Any]:
+        """Respuesta guardada para la huella, o None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+            value = self._get_from_disk(key, now)
+            if value is not None:
+                self._stats["hits"] += 1
+                self._stats["disk_hits"] += 1
+                return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[int] = None):
+        """Guardar una respuesta (texto o estructura serializable a JSON)"""
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._store_in_memory(key, value, expires_at)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), expires_at),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Error guardando en caché en disco: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Aciertos, fallos y tamaño de la caché"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["disk"] = self._db is not None
+        return stats
+
+    def _store_in_memory(self, key: str, value: Any, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _get_from_disk(self, key: str, now: float) -> Optional[Any]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error leyendo caché en disco: {e}")
+            return None
+        if row is None:
+            return None
+
+        value = json.loads(row[0])
+        # Subir al nivel en memoria conservando la expiración original
+        self._store_in_memory(key, value, row[1])
+        return value
+
+# Instancia global de la caché de respuestas
+llm_cache = LLMResponseCache()
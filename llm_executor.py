@@ -0,0 +1,157 @@
+"""
+Ejecutor de llamadas al LLM con presupuesto de latencia
+
+Cada turno tiene un plazo (LLM_TURN_BUDGET). La llamada síncrona al cliente
+de OpenAI corre en un hilo para no detener el event loop; si tarda más que
+el p95 observado se lanza una copia (hedge) y gana la primera respuesta.
+Si el plazo se agota se lanza LLMBudgetExceeded y el gestor de conversación
+responde con su texto de respaldo del paso actual. La protección del servicio
+(ver resilience) la aplica cada backend de LLM (ver llm_backends).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import logging
+
+from resilience import Upstream
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Segundos máximos de espera por respuesta del LLM en un turno
+LLM_TURN_BUDGET = float(os.getenv("LLM_TURN_BUDGET", "6"))
+
+# Lanzar una copia de la petición cuando se supera el p95 observado
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() != "false"
+
+# Muestras necesarias antes de calcular el p95 para el hedge
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+
+class LLMBudgetExceeded(Exception):
+    """El LLM no respondió dentro del presupuesto del turno"""
+
+
+class LatencyBudgetExecutor:
+    def __init__(self, budget_seconds: float = LLM_TURN_BUDGET, hedge: bool = LLM_HEDGE_ENABLED,
+                 hedge_percentile: float = 0.95, min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 window: int = 200, service: Optional[Upstream] = None):
+        self.service = service
+        self.budget_seconds = budget_seconds
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "budget_misses": 0, "errors": 0, "hedges": 0, "hedge_wins": 0}
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Latencia (segundos) del percentil indicado en la ventana reciente"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(fraction * len(samples)))
+        return samples[index]
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+        return self.percentile(self.hedge_percentile)
+
+    async def run(self, call: Callable[[float], T], budget_seconds: Optional[float] = None) -> T:
+        """Ejecutar `call(timeout)` en un hilo dentro del presupuesto
+
+        `call` recibe los segundos restantes para pasarlos como timeout al
+        cliente HTTP, de modo que el hilo se libere aunque se abandone.
+        """
+        budget = self.budget_seconds if budget_seconds is None else budget_seconds
+        started = time.monotonic()
+        deadline = started + budget
+        self._count("calls")
+
+        def launch():
+            remaining = max(0.1, deadline - time.monotonic())
+            return asyncio.ensure_future(asyncio.to_thread(self._guarded, call, remaining))
+
+        pending = {launch()}
+        primary = next(iter(pending))
+        hedge_delay = self._hedge_delay()
+        last_error: Optional[BaseException] = None
+
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                # Esperar hasta el p95 antes de lanzar la copia, luego hasta el plazo
+                wait_for = remaining
+                if hedge_delay is not None:
+                    wait_for = min(remaining, max(0.0, started + hedge_delay - time.monotonic()))
+
+                done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        self._record(time.monotonic() - started)
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+                    last_error = task.exception()
+
+                if hedge_delay is not None and not done and time.monotonic() < deadline:
+                    logger.info(f"⏱️  LLM sin respuesta tras {hedge_delay:.2f}s (p95), lanzando petición duplicada")
+                    pending.add(launch())
+                    self._count("hedges")
+                    hedge_delay = None
+
+                if not pending and last_error is not None:
+                    self._count("errors")
+                    raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+        self._count("budget_misses")
+        logger.warning(f"⏰ LLM sin respuesta en {budget:.1f}s, usando respuesta de respaldo")
+        raise LLMBudgetExceeded(f"Sin respuesta del LLM en {budget:.1f}s")
+
+    def _guarded(self, call: Callable[[float], T], timeout: float) -> T:
+        # Con el circuito abierto falla al instante y el turno usa el respaldo
+        if self.service is None:
+            return call(timeout)
+        with self.service.guard():
+            return call(timeout)
+
+    def _record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Llamadas, fallos de presupuesto y latencias recientes"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["budget_miss_rate"] = round(stats["budget_misses"] / stats["calls"], 4) if stats["calls"] else 0.0
+        stats["budget_seconds"] = self.budget_seconds
+        stats["p50_seconds"] = self.percentile(0.5)
+        stats["p95_seconds"] = self.percentile(0.95)
+        return stats
+
+# Instancia global del ejecutor de llamadas al LLM
+llm_executor = LatencyBudgetExecutor()
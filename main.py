@@ -1,17 +1,32 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, Response
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
+import io
+import csv
 import json
+import asyncio
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 import requests
+from calendar_time import today_local
+from intent_classifier import intent_classifier
+from llm_cache import llm_cache
+from llm_executor import llm_executor
+from resilience import resilience_stats
+from model_router import model_router
+from knowledge_base import knowledge_store, knowledge_watcher
+from call_campaigns import campaign_scheduler, parse_targets
+from appointment_reminders import reminder_scheduler
+from notification_outbox import notification_outbox
 
 # Importar nuestros nuevos módulos (opcional)
 AI_AVAILABLE = False
 ai_manager = None
 CALENDAR_AVAILABLE = False
 calendar_manager = None
+booking_engine = None
 
 try:
     from ai_conversation import ai_manager
@@ -23,13 +38,15 @@ except ImportError as e:
     ai_manager = None
 
 try:
-    from google_calendar_manager import calendar_manager
+    from google_calendar_manager import CALENDAR_RESYNC_INTERVAL, calendar_manager
+    from booking_engine import booking_engine
     CALENDAR_AVAILABLE = True
     print("✅ Calendar manager cargado correctamente")
 except ImportError as e:
     print(f"⚠️  ADVERTENCIA: google_calendar_manager no disponible: {e}. Usando sistema simulado.")
     CALENDAR_AVAILABLE = False
     calendar_manager = None
+    booking_engine = None
 
 # Cargar variables de entorno
 load_dotenv()
@@ -72,18 +89,86 @@ class TelnyxWebhook(BaseModel):
     data: Dict[str, Any]
     meta: Dict[str, Any]
 
-# Base de conocimiento (simplificada)
-KNOWLEDGE_BASE = {
-    "horarios": "Nuestros horarios son de lunes a viernes de 8:00 a 18:00. Sábados de 9:00 a 14:00.",
-    "ubicacion": "Estamos ubicados en [DIRECCIÓN]. Contamos con estacionamiento disponible.",
-    "citas": "Para reservar una cita, necesito su nombre, número de teléfono y motivo de consulta.",
-    "preparacion": "Para la primera consulta traiga: documento de identidad, carnet de obra social, estudios previos.",
-    "emergencias": "Para emergencias médicas, acuda inmediatamente al servicio de urgencias más cercano."
-}
+# Sincronización inicial del calendario (corre en un hilo)
+calendar_sync_future: Optional[asyncio.Future] = None
+
+def log_calendar_sync(future: asyncio.Future):
+    """Reportar el error de la sincronización inicial (la revisión periódica la reintenta)"""
+    if not future.cancelled() and future.exception():
+        print(f"❌ Error en la sincronización inicial del calendario: {future.exception()}")
+
+@app.on_event("startup")
+async def sync_calendar_index():
+    """Sincronizar el índice local del calendario sin bloquear el arranque"""
+    global calendar_sync_future
+    if CALENDAR_AVAILABLE and calendar_manager:
+        calendar_sync_future = asyncio.get_running_loop().run_in_executor(None, calendar_manager.sync_upcoming)
+        calendar_sync_future.add_done_callback(log_calendar_sync)
+
+async def watch_calendar_changes():
+    """Aplicar al índice (y a los recordatorios) los cambios hechos directamente en Google"""
+    while True:
+        await asyncio.sleep(CALENDAR_RESYNC_INTERVAL)
+        try:
+            await asyncio.to_thread(calendar_manager.sync_changes)
+        except Exception as e:
+            print(f"❌ Error revisando cambios del calendario: {e}")
+
+# Tarea en segundo plano que revisa los cambios del calendario
+calendar_watch_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_calendar_watch():
+    global calendar_watch_task
+    if CALENDAR_AVAILABLE and calendar_manager and CALENDAR_RESYNC_INTERVAL > 0:
+        calendar_watch_task = asyncio.get_running_loop().create_task(watch_calendar_changes())
+
+@app.on_event("shutdown")
+async def stop_calendar_watch():
+    if calendar_watch_task:
+        calendar_watch_task.cancel()
+        await asyncio.gather(calendar_watch_task, return_exceptions=True)
+
+@app.on_event("startup")
+async def start_knowledge_watcher():
+    """Recargar la base de conocimiento cuando cambian sus archivos"""
+    knowledge_watcher.start()
+
+@app.on_event("shutdown")
+async def stop_knowledge_watcher():
+    knowledge_watcher.stop()
+
+@app.on_event("startup")
+async def resume_campaigns():
+    """Retomar las campañas de llamadas que quedaron en curso"""
+    campaign_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_campaigns():
+    await campaign_scheduler.stop()
+
+@app.on_event("startup")
+async def start_notification_outbox():
+    """Enviar en segundo plano las notificaciones para n8n, incluidas las pendientes"""
+    notification_outbox.start()
+
+@app.on_event("shutdown")
+async def stop_notification_outbox():
+    await notification_outbox.stop()
+
+@app.on_event("startup")
+async def start_reminders():
+    """Programar los recordatorios de las citas del índice local"""
+    if CALENDAR_AVAILABLE and calendar_manager:
+        reminder_scheduler.start(calendar_manager.index)
+
+@app.on_event("shutdown")
+async def stop_reminders():
+    await reminder_scheduler.stop()
 
 @app.get("/")
 async def root():
-    return {"message": "API del Consultorio Médico - Dr. Xavier Xijemez Xifra - Railway Deploy v1.0"}
+    return {"message": "API del Consultorio Médico - Dra. Dolores Remedios del Rincón - Railway Deploy v1.0"}
 
 @app.get("/test")
 async def test():
@@ -127,7 +212,10 @@ async def vapi_webhook(request: Request):
             return {"status": "processed", "message": "Call started"}
             
         elif event_type == "call-ended":
-            # Llamada terminada
+            # Llamada terminada: liberar su lugar si es de una campaña
+            data = body.get("data") or {}
+            campaign_scheduler.record_hangup(body.get("callId") or data.get("callId"),
+                                             body.get("endedReason") or data.get("endedReason"))
             return {"status": "processed", "message": "Call ended"}
             
         elif event_type == "speech-start":
@@ -156,9 +244,9 @@ async def handle_function_call(body: Dict[str, Any]):
     if function_name == "get_appointment_info":
         return {
             "result": {
-                "horarios": KNOWLEDGE_BASE["horarios"],
-                "ubicacion": KNOWLEDGE_BASE["ubicacion"],
-                "preparacion": KNOWLEDGE_BASE["preparacion"]
+                "horarios": knowledge_store.answer("horarios"),
+                "ubicacion": knowledge_store.answer("ubicacion"),
+                "preparacion": knowledge_store.answer("preparacion")
             }
         }
     
@@ -189,27 +277,95 @@ async def handle_function_call(body: Dict[str, Any]):
     
     return {"result": {"error": "Function not found"}}
 
+APPOINTMENT_EXPORT_FIELDS = ['id', 'patient_name', 'phone', 'start_time', 'end_time', 'description', 'link']
+
+def _ndjson_rows(appointments):
+    """Serializar citas como NDJSON, una línea por cita"""
+    for appointment in appointments:
+        yield json.dumps(appointment, ensure_ascii=False) + "\n"
+
+def _csv_rows(appointments):
+    """Serializar citas como CSV, fila por fila"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=APPOINTMENT_EXPORT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for appointment in appointments:
+        writer.writerow(appointment)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
 @app.get("/appointments")
-async def get_appointments():
-    """Obtener lista de citas (simulado)"""
-    return {
-        "appointments": [
-            {
-                "id": "apt_1",
-                "patient_name": "Juan Pérez",
-                "phone": "+1234567890",
-                "date": "2024-01-15",
-                "time": "10:00",
-                "status": "confirmed"
-            }
-        ]
-    }
+async def get_appointments(
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    format: str = "ndjson"
+):
+    """Exportar citas de un rango de fechas (YYYY-MM-DD) como NDJSON o CSV
+    
+    Las filas se envían conforme llegan las páginas de Google Calendar.
+    """
+    if not CALENDAR_AVAILABLE or not calendar_manager:
+        raise HTTPException(status_code=503, detail="Calendario no disponible")
+    
+    from_date = from_date or today_local()
+    try:
+        start = datetime.strptime(from_date, "%Y-%m-%d")
+        end = datetime.strptime(to_date, "%Y-%m-%d") if to_date else start + timedelta(days=30)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fechas inválidas, use el formato YYYY-MM-DD")
+    
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' debe ser posterior a 'from'")
+    
+    appointments = calendar_manager.iter_appointments(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+    filename = f"citas_{start:%Y%m%d}_{end:%Y%m%d}"
+    
+    if format == "csv":
+        return StreamingResponse(
+            _csv_rows(appointments),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+        )
+    if format == "ndjson":
+        return StreamingResponse(
+            _ndjson_rows(appointments),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.ndjson"'}
+        )
+    raise HTTPException(status_code=400, detail="Formato no soportado, use 'ndjson' o 'csv'")
 
 @app.get("/health")
 async def health_check():
     """Verificar estado del servidor"""
     return {"status": "healthy"}
 
+@app.get("/llm-cache/stats")
+async def llm_cache_stats():
+    """Aciertos y fallos de la caché de respuestas del LLM"""
+    return llm_cache.stats()
+
+@app.get("/llm-executor/stats")
+async def llm_executor_stats():
+    """Latencias del LLM, peticiones duplicadas y tasa de turnos fuera de plazo"""
+    return llm_executor.stats()
+
+@app.get("/model-router/stats")
+async def model_router_stats():
+    """Turnos, latencia media y costo por modelo (rápido/potente)"""
+    return model_router.stats()
+
+@app.get("/knowledge/stats")
+async def knowledge_status():
+    """Versión, preguntas y tokens de la base de conocimiento precompilada"""
+    return knowledge_store.stats()
+
+@app.get("/resilience/stats")
+async def resilience_status():
+    """Estado de los circuit breakers y límites de OpenAI, Telnyx, Vapi y Google"""
+    return resilience_stats()
+
 @app.post("/telnyx-webhook")
 async def telnyx_webhook(request: Request):
     """Webhook para recibir eventos de Telnyx"""
@@ -284,7 +440,7 @@ async def process_telnyx_form_webhook(form_data):
                 conversation_response = await generate_ai_conversation_response(call_sid, from_number)
         except Exception as e:
             print(f"❌ Error con AI manager: {e}")
-            conversation_response = "¡Hola! Bienvenido al Consultorio del Dr. Xavier Xijemez Xifra. Un miembro de nuestro equipo se pondrá en contacto con usted pronto."
+            conversation_response = "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón. Un miembro de nuestro equipo se pondrá en contacto con usted pronto."
         
         texml_response = f"""<?xml version="1.0" encoding="UTF-8"?>
 <Response>
@@ -305,6 +461,7 @@ async def process_telnyx_json_webhook(body):
     """Procesar webhook de Telnyx en formato JSON"""
     try:
         event_type = body.get("data", {}).get("event_type")
+        payload = body.get("data", {}).get("payload") or {}
         print(f"🎯 Evento JSON detectado: {event_type}")
         
         if event_type == "call.initiated":
@@ -313,10 +470,17 @@ async def process_telnyx_json_webhook(body):
             
         elif event_type == "call.answered":
             print("✅ Llamada contestada")
+            # Llamadas de campaña: leer el recordatorio
+            await campaign_scheduler.speak_reminder(payload.get("call_control_id"), payload.get("client_state"))
             return {"status": "processed", "message": "Call answered"}
+
+        elif event_type == "call.speak.ended":
+            await campaign_scheduler.end_reminder(payload.get("call_control_id"), payload.get("client_state"))
+            return {"status": "processed", "message": "Speak ended"}
             
         elif event_type == "call.hangup":
             print("📴 Llamada terminada")
+            campaign_scheduler.record_hangup(payload.get("call_control_id"), payload.get("hangup_cause"))
             return {"status": "processed", "message": "Call ended"}
         
         return {"status": "ignored", "message": f"Unknown event type: {event_type}"}
@@ -341,19 +505,21 @@ async def process_speech_with_ai(speech_text: str):
         # Aquí integrarías con OpenAI, Claude, etc.
         # Por ahora simulamos la respuesta
         
-        if "cita" in speech_text.lower() or "appointment" in speech_text.lower():
+        intent = intent_classifier.intent(speech_text)
+        
+        if intent in ("appointment", "change"):
             return {
                 "response": "Entiendo que quieres agendar una cita. ¿Podrías decirme tu nombre completo y el motivo de la consulta?",
                 "action": "gather_info"
             }
-        elif "horarios" in speech_text.lower():
+        elif intent == "schedule":
             return {
-                "response": "Nuestros horarios son de lunes a viernes de 8:00 a 18:00. Sábados de 9:00 a 14:00.",
+                "response": knowledge_store.answer("horarios"),
                 "action": "info"
             }
         else:
             return {
-                "response": "Gracias por llamar al consultorio del Dr. Xavier Xijemez Xifra. ¿En qué puedo ayudarte?",
+                "response": "Gracias por llamar al consultorio de la Dra. Dolores Remedios del Rincón. ¿En qué puedo ayudarte?",
                 "action": "general"
             }
     except Exception as e:
@@ -386,6 +552,62 @@ async def create_telnyx_call(call_request: CallRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/campaigns")
+async def create_campaign(request: Request, provider: str = Query("telnyx", description="telnyx o vapi")):
+    """Campaña de llamadas de recordatorio a partir de un CSV o una lista JSON de pacientes
+
+    Columnas: phone_number, patient_name, appointment_time, reason
+    """
+    if provider not in campaign_scheduler.dialers:
+        raise HTTPException(status_code=400, detail=f"Proveedor no soportado: {provider}")
+    raw_body = await request.body()
+    try:
+        targets, rejected = parse_targets(raw_body.decode("utf-8-sig"), request.headers.get("content-type", ""))
+    except (ValueError, AttributeError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Lista de llamadas inválida: {e}")
+    if not targets:
+        raise HTTPException(status_code=400, detail={"message": "No hay teléfonos válidos", "rejected": rejected})
+
+    campaign_id = campaign_scheduler.create(provider, targets)
+    return {"success": True, "campaign_id": campaign_id, "calls": len(targets), "rejected": rejected}
+
+@app.get("/campaigns")
+async def list_campaigns():
+    """Avance y ritmo de todas las campañas"""
+    return {"campaigns": campaign_scheduler.reports()}
+
+@app.get("/campaigns/{campaign_id}")
+async def campaign_status(campaign_id: str):
+    """Llamadas por estado, reintentos, llamadas por minuto y tiempo restante"""
+    report = campaign_scheduler.report(campaign_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    return report
+
+@app.post("/campaigns/{campaign_id}/cancel")
+async def cancel_campaign(campaign_id: str):
+    """Cancelar las llamadas pendientes de una campaña"""
+    if not await campaign_scheduler.cancel(campaign_id):
+        raise HTTPException(status_code=404, detail="Campaña no encontrada")
+    return campaign_scheduler.report(campaign_id)
+
+@app.get("/reminders")
+async def reminders_status():
+    """Citas con recordatorio programado, el próximo envío y los enviados"""
+    return reminder_scheduler.stats()
+
+@app.get("/outbox")
+async def outbox_status():
+    """Notificaciones para n8n pendientes, entregadas y en dead letter"""
+    return {**notification_outbox.stats(), "dead_letters": notification_outbox.store.dead()}
+
+@app.post("/outbox/dead/{item_id}/retry")
+async def retry_dead_notification(item_id: int):
+    """Volver a encolar una notificación de dead letter"""
+    if not notification_outbox.requeue(item_id):
+        raise HTTPException(status_code=404, detail="Notificación no encontrada")
+    return notification_outbox.stats()
+
 @app.post("/telnyx-ai-webhook")
 async def telnyx_ai_webhook(request: Request):
     """Webhook para recibir eventos de Telnyx AI"""
@@ -440,14 +662,16 @@ async def process_ai_speech(speech_text: str, webhook_data: Dict[str, Any]):
         # Aquí puedes implementar lógica específica basada en el contenido del speech
         # Por ejemplo, detectar si el usuario está agendando una cita
         
-        if any(word in speech_text.lower() for word in ["cita", "appointment", "agendar", "reservar"]):
+        intent = intent_classifier.intent(speech_text)
+        
+        if intent in ("appointment", "change"):
             print("📅 Usuario quiere agendar cita")
             # Aquí podrías guardar en base de datos o enviar a 8n8
             
-        elif any(word in speech_text.lower() for word in ["horarios", "horario", "schedule"]):
+        elif intent == "schedule":
             print("🕐 Usuario pregunta por horarios")
             
-        elif any(word in speech_text.lower() for word in ["ubicación", "dirección", "location"]):
+        elif intent == "location":
             print("📍 Usuario pregunta por ubicación")
         
         return {
@@ -583,7 +807,7 @@ async def process_dtmf(request: Request):
     </Gather>
     
     <Say voice="alice" language="es-MX">
-        Gracias por llamar al consultorio del Dr. Xavier Xijemez Xifra. 
+        Gracias por llamar al consultorio de la Dra. Dolores Remedios del Rincón. 
         Que tenga un excelente día.
     </Say>
     
@@ -655,22 +879,22 @@ def handle_operator_request():
 async def generate_conversation_response(speech_text: str, call_sid: str, from_number: str):
     """Generar respuesta conversacional basada en el speech del usuario"""
     try:
-        speech_lower = speech_text.lower()
-        
         # Detectar intenciones del usuario
-        if any(word in speech_lower for word in ["cita", "appointment", "agendar", "reservar", "citar"]):
+        intent = intent_classifier.intent(speech_text)
+        
+        if intent in ("appointment", "change"):
             return await handle_appointment_request(speech_text, call_sid, from_number)
             
-        elif any(word in speech_lower for word in ["horarios", "horario", "schedule", "cuándo", "cuando"]):
+        elif intent == "schedule":
             return handle_schedule_inquiry()
             
-        elif any(word in speech_lower for word in ["ubicación", "dirección", "location", "dónde", "donde"]):
+        elif intent == "location":
             return handle_location_inquiry()
             
-        elif any(word in speech_lower for word in ["preparación", "preparar", "traer", "documentos"]):
+        elif intent == "preparation":
             return handle_preparation_inquiry()
             
-        elif any(word in speech_lower for word in ["emergencia", "emergencias", "urgencia"]):
+        elif intent == "emergency":
             return handle_emergency_inquiry()
             
         else:
@@ -696,10 +920,7 @@ async def handle_appointment_request(speech_text: str, call_sid: str, from_numbe
 
 def handle_schedule_inquiry():
     """Manejar consulta sobre horarios"""
-    return """Nuestros horarios de atención son:
-    Lunes a viernes de 8:00 de la mañana a 6:00 de la tarde.
-    Sábados de 9:00 de la mañana a 2:00 de la tarde.
-    Los domingos no atendemos.
+    return f"""{knowledge_store.answer("horarios")}
     ¿En qué horario le gustaría agendar su cita?"""
 
 def handle_location_inquiry():
@@ -724,8 +945,8 @@ def handle_emergency_inquiry():
 
 def handle_general_inquiry(speech_text: str):
     """Manejar consultas generales"""
-    return f"""Gracias por su consulta. Soy la asistente virtual del 
-    Dr. Xavier Xijemez Xifra. Puedo ayudarle con:
+    return f"""Gracias por su consulta. Soy la asistente virtual de la 
+    Dra. Dolores Remedios del Rincón. Puedo ayudarle con:
     - Agendar citas
     - Consultar horarios
     - Información sobre ubicación
@@ -745,7 +966,7 @@ async def generate_ai_conversation_response(call_sid: str, from_number: str):
         # Generar respuesta basada en el contexto
         if conversation_context["step"] == 0:
             # Primera interacción - saludo
-            response = """¡Hola! Bienvenido al Consultorio Médico del Dr. Xavier Xijemez Xifra. 
+            response = """¡Hola! Bienvenido al Consultorio Médico de la Dra. Dolores Remedios del Rincón. 
             Soy su asistente virtual. ¿En qué puedo ayudarle hoy?
             
             Puedo ayudarle con:
@@ -775,21 +996,19 @@ async def generate_ai_conversation_response(call_sid: str, from_number: str):
             
         elif conversation_context["step"] == 2:
             # Tercera interacción - confirmación
-            response = """Excelente, he tomado nota de toda su información. 
+            response = f"""Excelente, he tomado nota de toda su información. 
             Su cita ha sido registrada en nuestro sistema.
             
             Recibirá una confirmación por mensaje de texto o llamada 
             en las próximas 24 horas con los detalles de su cita.
             
-            Para recordarle, nuestros horarios son:
-            Lunes a viernes de 8:00 a 18:00
-            Sábados de 9:00 a 14:00
+            {knowledge_store.answer("horarios")}
             
             ¿Hay algo más en lo que pueda ayudarle?"""
             
         else:
             # Interacciones adicionales
-            response = """Gracias por su confianza en el Consultorio del Dr. Xavier Xijemez Xifra. 
+            response = """Gracias por su confianza en el Consultorio de la Dra. Dolores Remedios del Rincón. 
             Si tiene alguna pregunta adicional, no dude en llamar nuevamente.
             
             Que tenga un excelente día y cuide su salud."""
@@ -801,7 +1020,7 @@ async def generate_ai_conversation_response(call_sid: str, from_number: str):
         
     except Exception as e:
         print(f"❌ Error generando respuesta conversacional: {e}")
-        return """Gracias por llamar al Consultorio del Dr. Xavier Xijemez Xifra. 
+        return """Gracias por llamar al Consultorio de la Dra. Dolores Remedios del Rincón. 
         Un miembro de nuestro equipo se pondrá en contacto con usted pronto."""
 
 # Simular base de datos de contexto de conversación
@@ -832,20 +1051,10 @@ async def create_appointment(appointment: AppointmentRequest):
             'hora': appointment.preferred_time
         }
         
-        # Si no hay fecha preferida, obtener la próxima disponible
-        if not appointment_data['fecha']:
-            appointment_data['fecha'] = calendar_manager.get_next_available_date()
-        
-        # Si no hay hora preferida, usar la primera disponible
-        if not appointment_data['hora']:
-            available_slots = calendar_manager.get_available_slots(appointment_data['fecha'])
-            if available_slots:
-                appointment_data['hora'] = available_slots[0]['start_time']
-            else:
-                appointment_data['hora'] = '10:00'
-        
-        # Crear la cita en Google Calendar
-        result = calendar_manager.create_appointment(appointment_data)
+        # Reservar con el motor de reservas: aparta el horario, lo re-verifica
+        # y si está ocupado pasa al siguiente libre. Se ejecuta en un hilo para
+        # no bloquear el event loop mientras se consulta Google Calendar.
+        result = await asyncio.to_thread(booking_engine.book, appointment_data)
         
         if result['success']:
             return {
@@ -856,14 +1065,16 @@ async def create_appointment(appointment: AppointmentRequest):
                     "patient_name": appointment.patient_name,
                     "phone": appointment.phone,
                     "reason": appointment.reason,
-                    "date": appointment_data['fecha'],
-                    "time": appointment_data['hora'],
+                    "date": result['fecha'],
+                    "time": result['hora'],
                     "calendar_link": result['event_link']
                 }
             }
         else:
-            raise HTTPException(status_code=500, detail=result['error'])
+            raise HTTPException(status_code=400 if result.get('invalid') else 500, detail=result['error'])
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -893,6 +1104,22 @@ async def get_appointments_for_date(date: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/appointments/by-phone/{phone}")
+async def get_appointments_by_phone(phone: str):
+    """Obtener las citas próximas de un paciente por su número de teléfono"""
+    if not CALENDAR_AVAILABLE or not calendar_manager:
+        raise HTTPException(status_code=503, detail="Calendario no disponible")
+    
+    try:
+        appointments = await asyncio.to_thread(calendar_manager.find_appointments_by_phone, phone)
+        return {
+            "phone": phone,
+            "appointments": appointments,
+            "total_appointments": len(appointments)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/appointments/{event_id}")
 async def cancel_appointment(event_id: str):
     """Cancelar una cita"""
@@ -5,11 +5,25 @@ from dotenv import load_dotenv
 import json
 from typing import Optional, Dict, Any
 
+from greeting_pool import greeting_pool, mark_greeted
+from knowledge_base import knowledge_store, knowledge_watcher
+
 # Cargar variables de entorno
 load_dotenv()
 
 app = FastAPI(title="Consultorio Médico - Interactive Version", version="1.0.0")
 
+@app.on_event("startup")
+async def start_greeting_pool():
+    """Generar saludos en segundo plano para contestar sin esperar a OpenAI"""
+    greeting_pool.start()
+    knowledge_watcher.start()
+
+@app.on_event("shutdown")
+async def stop_greeting_pool():
+    await greeting_pool.stop()
+    knowledge_watcher.stop()
+
 @app.get("/")
 async def root():
     return {"message": "API del Consultorio Médico - Dra. Dolores Remedios del Rincón - Interactive Version"}
@@ -122,14 +136,10 @@ def update_conversation_step(phone_number: str, step: int, data: Dict = None):
 
 async def handle_initial_greeting(phone_number: str, call_sid: str):
     """Manejar el saludo inicial y presentar menú principal"""
-    try:
-        # Generar saludo personalizado con AI
-        from ai_conversation_enhanced import enhanced_ai_manager
-        greeting = await enhanced_ai_manager.generate_response(phone_number)
-        print(f"🤖 Saludo AI generado: {greeting}")
-    except Exception as e:
-        print(f"❌ Error con AI manager: {e}")
-        greeting = "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón, especialista en Medicina Interna."
+    # Saludo pre-generado: no se espera a OpenAI al contestar
+    greeting = greeting_pool.get()
+    print(f"🤖 Saludo: {greeting}")
+    mark_greeted(phone_number)
     
     # Menú principal
     menu_text = f"""
@@ -223,7 +233,7 @@ async def handle_schedule_info(phone_number: str, call_sid: str):
         print(f"🤖 Respuesta AI para horarios: {response}")
     except Exception as e:
         print(f"❌ Error con AI manager: {e}")
-        response = "Nuestros horarios son de lunes a viernes de 8:00 a 18:00. Sábados de 9:00 a 14:00. Estamos ubicados en [DIRECCIÓN]. Contamos con estacionamiento disponible."
+        response = f"{knowledge_store.answer('horarios')} {knowledge_store.answer('ubicacion')}"
     
     menu_text = f"""
     {response}
@@ -260,7 +270,7 @@ async def handle_preparation_info(phone_number: str, call_sid: str):
         print(f"🤖 Respuesta AI para preparación: {response}")
     except Exception as e:
         print(f"❌ Error con AI manager: {e}")
-        response = "Para la primera consulta traiga: documento de identidad, carnet de obra social, estudios médicos previos, lista de medicamentos actuales y resumen de su historia clínica si tiene."
+        response = knowledge_store.answer("preparacion")
     
     menu_text = f"""
     {response}
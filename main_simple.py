@@ -12,7 +12,7 @@ app = FastAPI(title="Consultorio Médico - Simple Version", version="1.0.0")
 
 @app.get("/")
 async def root():
-    return {"message": "API del Consultorio Médico - Dr. Xavier Xijemez Xifra - Simple Version"}
+    return {"message": "API del Consultorio Médico - Dra. Dolores Remedios del Rincón - Simple Version"}
 
 @app.get("/health")
 async def health_check():
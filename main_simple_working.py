@@ -4,12 +4,22 @@ import os
 from dotenv import load_dotenv
 import json
 from typing import Optional, Dict, Any
+from knowledge_base import knowledge_store, knowledge_watcher
 
 # Cargar variables de entorno
 load_dotenv()
 
 app = FastAPI(title="Consultorio Médico - Simple Working Version", version="1.0.0")
 
+@app.on_event("startup")
+async def start_knowledge_watcher():
+    """Recargar la base de conocimiento cuando cambian sus archivos"""
+    knowledge_watcher.start()
+
+@app.on_event("shutdown")
+async def stop_knowledge_watcher():
+    knowledge_watcher.stop()
+
 @app.get("/")
 async def root():
     return {"message": "API del Consultorio Médico - Dra. Dolores Remedios del Rincón - Simple Working Version"}
@@ -175,7 +185,7 @@ async def handle_menu_selection_dtmf(digits: str, from_number: str, call_sid: st
         if digits == "1":
             response = await karla_assistant.generate_response(from_number, "Necesito agendar una cita nueva")
         elif digits == "2":
-            response = await karla_assistant.generate_response(from_number, "Necesito cambiar o cancelar una cita existente")
+            response = await karla_assistant.handle_change_or_cancel(from_number, "Necesito cambiar o cancelar una cita existente")
         elif digits == "3":
             response = await karla_assistant.generate_response(from_number, "Necesito consultar horarios y ubicación")
         elif digits == "4":
@@ -195,9 +205,9 @@ async def handle_menu_selection_dtmf(digits: str, from_number: str, call_sid: st
         elif digits == "2":
             response = "Para cambiar o cancelar su cita, un miembro de nuestro equipo se pondrá en contacto con usted pronto."
         elif digits == "3":
-            response = "Nuestros horarios son de lunes a viernes de 8:00 a 18:00. Sábados de 9:00 a 14:00. Estamos ubicados en [DIRECCIÓN]."
+            response = f"{knowledge_store.answer('horarios')} {knowledge_store.answer('ubicacion')}"
         elif digits == "4":
-            response = "Para la primera consulta traiga: documento de identidad, carnet de obra social, estudios médicos previos y lista de medicamentos actuales."
+            response = knowledge_store.answer("preparacion")
         elif digits == "5":
             response = "Un miembro de nuestro equipo se pondrá en contacto con usted pronto. Gracias por su paciencia."
         elif digits == "0":
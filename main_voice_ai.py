@@ -7,14 +7,33 @@ from typing import Optional, Dict, Any
 import asyncio
 import aiohttp
 
+from greeting_pool import greeting_pool, mark_greeted
+from knowledge_base import knowledge_store, knowledge_watcher
+from resilience import UpstreamUnavailable, upstream
+
 # Cargar variables de entorno
 load_dotenv()
 
+# Contexto de conversación de las llamadas de Call Control (el saludo y la IA usan el mismo)
+CALL_CONTROL_CONTEXT = "+1234567890"
+
 app = FastAPI(title="Consultorio Médico - Voice AI Bot", version="1.0.0")
 
+@app.on_event("startup")
+async def start_greeting_pool():
+    """Generar saludos en segundo plano para contestar sin esperar a OpenAI"""
+    greeting_pool.start()
+    knowledge_watcher.start()
+
+@app.on_event("shutdown")
+async def stop_greeting_pool():
+    await greeting_pool.stop()
+    knowledge_watcher.stop()
+
 # Configuración de Telnyx
 TELNYX_API_KEY = os.getenv("TELNYX_API_KEY")
 TELNYX_WEBHOOK_SECRET = os.getenv("TELNYX_WEBHOOK_SECRET", "your_webhook_secret")
+TELNYX_TIMEOUT = aiohttp.ClientTimeout(total=float(os.getenv("TELNYX_TIMEOUT", "10")))
 
 @app.get("/")
 async def root():
@@ -167,8 +186,12 @@ async def handle_call_hangup(event_data: Dict):
     
     return {"status": "processed", "message": "Call ended"}
 
-async def configure_voice_recognition(call_control_id: str):
-    """Configurar reconocimiento de voz en la llamada"""
+async def post_call_action(call_control_id: str, payload: Dict[str, Any], label: str, error_label: str):
+    """Enviar una acción de Call Control a Telnyx
+    
+    Pasa por el circuit breaker de Telnyx: durante una caída se descarta la
+    acción al instante en lugar de dejar esperando el webhook.
+    """
     url = f"https://api.telnyx.com/v2/calls/{call_control_id}/actions"
     
     headers = {
@@ -176,6 +199,22 @@ async def configure_voice_recognition(call_control_id: str):
         "Content-Type": "application/json"
     }
     
+    try:
+        with upstream("telnyx").guard():
+            async with aiohttp.ClientSession(timeout=TELNYX_TIMEOUT) as session:
+                async with session.post(url, json=payload, headers=headers) as response:
+                    print(f"{label}: {response.status}")
+                    # Los 5xx cuentan como fallo del servicio para el circuit breaker
+                    if response.status >= 500:
+                        response.raise_for_status()
+                    return await response.json()
+    except UpstreamUnavailable as e:
+        print(f"⚡ Acción de Telnyx descartada: {e}")
+    except Exception as e:
+        print(f"{error_label}: {e}")
+
+async def configure_voice_recognition(call_control_id: str):
+    """Configurar reconocimiento de voz en la llamada"""
     # Configurar para reconocimiento de voz
     payload = {
         "speech": {
@@ -185,24 +224,14 @@ async def configure_voice_recognition(call_control_id: str):
         }
     }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                print(f"🎤 Configuración de voz: {response.status}")
-                return await response.json()
-    except Exception as e:
-        print(f"❌ Error configurando voz: {e}")
+    return await post_call_action(call_control_id, payload, "🎤 Configuración de voz", "❌ Error configurando voz")
 
 async def start_conversation(call_control_id: str):
     """Comenzar conversación con saludo"""
-    try:
-        # Generar saludo con AI
-        from ai_conversation_enhanced import enhanced_ai_manager
-        greeting = await enhanced_ai_manager.generate_response("+1234567890")  # Número dummy
-        print(f"🤖 Saludo AI generado: {greeting}")
-    except Exception as e:
-        print(f"❌ Error con AI manager: {e}")
-        greeting = "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón. Soy su asistente virtual. ¿En qué puedo ayudarle hoy?"
+    # Saludo pre-generado: no se espera a OpenAI al contestar
+    greeting = greeting_pool.get()
+    print(f"🤖 Saludo: {greeting}")
+    mark_greeted(CALL_CONTROL_CONTEXT)
     
     await speak_text(call_control_id, greeting)
     await start_listening(call_control_id)
@@ -212,7 +241,7 @@ async def process_speech_with_ai(call_control_id: str, speech: str):
     try:
         # Generar respuesta con AI
         from ai_conversation_enhanced import enhanced_ai_manager
-        response = await enhanced_ai_manager.generate_response("+1234567890", speech)
+        response = await enhanced_ai_manager.generate_response(CALL_CONTROL_CONTEXT, speech)
         print(f"🤖 Respuesta AI: {response}")
     except Exception as e:
         print(f"❌ Error con AI manager: {e}")
@@ -223,13 +252,6 @@ async def process_speech_with_ai(call_control_id: str, speech: str):
 
 async def speak_text(call_control_id: str, text: str):
     """Hacer que el sistema hable el texto"""
-    url = f"https://api.telnyx.com/v2/calls/{call_control_id}/actions"
-    
-    headers = {
-        "Authorization": f"Bearer {TELNYX_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {
         "speak": {
             "payload": text,
@@ -238,23 +260,10 @@ async def speak_text(call_control_id: str, text: str):
         }
     }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                print(f"🗣️ Speak response: {response.status}")
-                return await response.json()
-    except Exception as e:
-        print(f"❌ Error hablando: {e}")
+    return await post_call_action(call_control_id, payload, "🗣️ Speak response", "❌ Error hablando")
 
 async def start_listening(call_control_id: str):
     """Comenzar a escuchar voz del usuario"""
-    url = f"https://api.telnyx.com/v2/calls/{call_control_id}/actions"
-    
-    headers = {
-        "Authorization": f"Bearer {TELNYX_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {
         "gather_using_speak": {
             "speech": {
@@ -270,13 +279,7 @@ async def start_listening(call_control_id: str):
         }
     }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                print(f"👂 Listen response: {response.status}")
-                return await response.json()
-    except Exception as e:
-        print(f"❌ Error escuchando: {e}")
+    return await post_call_action(call_control_id, payload, "👂 Listen response", "❌ Error escuchando")
 
 # Para webhooks tradicionales (DTMF)
 async def handle_dtmf_menu(from_number: str, call_sid: str, digits: str):
@@ -290,13 +293,10 @@ async def handle_dtmf_menu(from_number: str, call_sid: str, digits: str):
 
 async def handle_initial_greeting_dtmf(from_number: str, call_sid: str):
     """Saludo inicial con menú DTMF"""
-    try:
-        from ai_conversation_enhanced import enhanced_ai_manager
-        greeting = await enhanced_ai_manager.generate_response(from_number)
-        print(f"🤖 Saludo AI generado: {greeting}")
-    except Exception as e:
-        print(f"❌ Error con AI manager: {e}")
-        greeting = "¡Hola! Bienvenido al Consultorio de la Dra. Dolores Remedios del Rincón."
+    # Saludo pre-generado: no se espera a OpenAI al contestar
+    greeting = greeting_pool.get()
+    print(f"🤖 Saludo: {greeting}")
+    mark_greeted(from_number)
     
     menu_text = f"""
     {greeting}
@@ -333,9 +333,9 @@ async def handle_menu_selection_dtmf(digits: str, from_number: str, call_sid: st
     if digits == "1":
         response = "Para agendar su cita, necesito recopilar algunos datos. Un miembro de nuestro equipo se pondrá en contacto con usted pronto."
     elif digits == "2":
-        response = "Nuestros horarios son de lunes a viernes de 8:00 a 18:00. Sábados de 9:00 a 14:00. Estamos ubicados en [DIRECCIÓN]."
+        response = f"{knowledge_store.answer('horarios')} {knowledge_store.answer('ubicacion')}"
     elif digits == "3":
-        response = "Para la primera consulta traiga: documento de identidad, carnet de obra social, estudios médicos previos y lista de medicamentos actuales."
+        response = knowledge_store.answer("preparacion")
     elif digits == "4":
         response = "Un miembro de nuestro equipo se pondrá en contacto con usted pronto. Gracias por su paciencia."
     elif digits == "0":
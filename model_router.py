@@ -0,0 +1,131 @@
+"""
+Enrutamiento de turnos entre un modelo rápido y uno potente
+
+Los turnos rutinarios (confirmaciones, preguntas frecuentes de horarios,
+ubicación o preparación, saludos) van al modelo más barato y rápido; los
+turnos largos, ambiguos o delicados (emergencias, cambios de cita) suben al
+modelo potente. Las reglas se configuran con MODEL_ROUTING_RULES (JSON) y
+cada decisión registra su latencia y su costo según el uso de tokens.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+
+import logging
+
+from intent_classifier import intent_classifier, normalize_text
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+LLM_STRONG_MODEL = os.getenv("LLM_STRONG_MODEL", "gpt-4o")
+
+# USD por millón de tokens (entrada, salida); MODEL_PRICES (JSON) agrega o reemplaza
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    **{model: tuple(price) for model, price in json.loads(os.getenv("MODEL_PRICES", "{}")).items()},
+}
+
+DEFAULT_ROUTING_RULES = {
+    # Turnos con más palabras que esto se consideran complejos
+    "max_routine_words": 25,
+    # Sin intención clara y con más palabras que esto: ambiguo
+    "max_ambiguous_words": 12,
+    "routine_intents": ["schedule", "location", "preparation", "appointment"],
+    "escalate_intents": ["emergency", "change"],
+    "escalate_keywords": ["no entiendo", "queja", "medicamento", "sintoma", "dolor", "resultado", "receta"],
+    # Tareas internas que siempre usan el modelo rápido
+    "fast_tasks": ["greeting", "date_time", "extraction", "summary"],
+    "max_tokens": {"fast": 250, "strong": 400},
+}
+
+ROUTING_RULES = {**DEFAULT_ROUTING_RULES, **json.loads(os.getenv("MODEL_ROUTING_RULES", "{}"))}
+
+
+class RouteDecision(NamedTuple):
+    model: str
+    tier: str  # "fast" o "strong"
+    reason: str
+    max_tokens: int
+
+
+class ModelRouter:
+    def __init__(self, fast_model: str = LLM_FAST_MODEL, strong_model: str = LLM_STRONG_MODEL,
+                 rules: Dict[str, Any] = ROUTING_RULES):
+        self.models = {"fast": fast_model, "strong": strong_model}
+        self.rules = rules
+        self._escalate_keywords = tuple(normalize_text(word) for word in rules["escalate_keywords"])
+        self._lock = threading.Lock()
+        self._stats = {tier: {"turns": 0, "latency_total": 0.0, "cost_total": 0.0, "reasons": {}}
+                       for tier in self.models}
+
+    def _decision(self, tier: str, reason: str) -> RouteDecision:
+        return RouteDecision(self.models[tier], tier, reason, self.rules["max_tokens"][tier])
+
+    def route(self, user_input: Optional[str] = None, task: str = "turn") -> RouteDecision:
+        """Elegir el modelo para un turno según las reglas"""
+        if task in self.rules["fast_tasks"]:
+            return self._decision("fast", task)
+        if not user_input:
+            return self._decision("fast", "sin_texto")
+
+        normalized = normalize_text(user_input)
+        words = len(normalized.split())
+        intent = intent_classifier.intent(user_input)
+
+        if intent in self.rules["escalate_intents"]:
+            return self._decision("strong", f"intencion_{intent}")
+        if any(keyword in normalized for keyword in self._escalate_keywords):
+            return self._decision("strong", "palabra_clave")
+        if words > self.rules["max_routine_words"]:
+            return self._decision("strong", "turno_largo")
+        if intent == "general" and words > self.rules["max_ambiguous_words"]:
+            return self._decision("strong", "ambiguo")
+        if intent in self.rules["routine_intents"]:
+            return self._decision("fast", f"intencion_{intent}")
+        return self._decision("fast", "rutina")
+
+    @staticmethod
+    def cost(model: str, usage: Any) -> float:
+        """Costo en USD de una respuesta según `response.usage`"""
+        if usage is None or model not in MODEL_PRICES:
+            return 0.0
+        input_price, output_price = MODEL_PRICES[model]
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    def record(self, decision: RouteDecision, latency: float, usage: Any = None):
+        """Registrar la latencia (segundos) y el costo de una decisión"""
+        cost = self.cost(decision.model, usage)
+        with self._lock:
+            stats = self._stats[decision.tier]
+            stats["turns"] += 1
+            stats["latency_total"] += latency
+            stats["cost_total"] += cost
+            stats["reasons"][decision.reason] = stats["reasons"].get(decision.reason, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Turnos, latencia media y costo por nivel de modelo"""
+        with self._lock:
+            result = {}
+            for tier, stats in self._stats.items():
+                turns = stats["turns"]
+                result[tier] = {
+                    "model": self.models[tier],
+                    "turns": turns,
+                    "mean_latency_seconds": round(stats["latency_total"] / turns, 4) if turns else None,
+                    "cost_usd": round(stats["cost_total"], 6),
+                    "mean_cost_usd": round(stats["cost_total"] / turns, 6) if turns else None,
+                    "reasons": dict(stats["reasons"]),
+                }
+        return result
+
+# Instancia global del enrutador de modelos
+model_router = ModelRouter()
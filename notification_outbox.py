@@ -0,0 +1,291 @@
+"""
+Bandeja de salida de notificaciones a n8n
+
+Las notificaciones (citas nuevas, recordatorios) se guardan primero en
+SQLite (OUTBOX_DB) y un despachador en segundo plano las envía al webhook
+de n8n; quien notifica solo hace un INSERT y responde al momento.
+
+- Lotes: en cada vuelta se leen hasta OUTBOX_BATCH_SIZE notificaciones
+  vencidas, se envían a la vez por una sola sesión HTTP y los resultados
+  se guardan en una sola transacción
+- Reintentos: backoff exponencial con jitter (OUTBOX_RETRY_BASE_DELAY,
+  tope OUTBOX_RETRY_MAX_DELAY) hasta OUTBOX_MAX_ATTEMPTS intentos
+- Dead letter: al agotar los intentos, o ante un 4xx que no se arregla
+  reintentando, la notificación pasa a la tabla outbox_dead; desde ahí se
+  puede volver a encolar con `requeue()` (POST /outbox/dead/{id}/retry)
+- Cada notificación lleva un Idempotency-Key fijo para que n8n pueda
+  descartar un reenvío si la respuesta se perdió
+
+Uso:
+    notification_outbox.enqueue("appointment_created", appointment)
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import logging
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+N8N_WEBHOOK_URL = os.getenv("N8N_WEBHOOK_URL")
+
+# Base SQLite de la bandeja de salida
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox.db")
+
+# Notificaciones que se envían juntas en cada vuelta del despachador
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+
+# Intentos antes de pasar a dead letter y espera base entre intentos (segundos, se duplica)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv("OUTBOX_RETRY_BASE_DELAY", "5"))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv("OUTBOX_RETRY_MAX_DELAY", "900"))
+
+# Segundos máximos entre revisiones de la bandeja y timeout de cada envío
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_TIMEOUT = float(os.getenv("OUTBOX_TIMEOUT", "10"))
+
+# Respuestas 4xx que sí vale la pena reintentar
+RETRYABLE_STATUS = {408, 409, 425, 429}
+
+
+class DeliveryError(Exception):
+    """Fallo al entregar; `retryable` si vale la pena otro intento"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff exponencial con jitter: entre la mitad y el total de la espera"""
+    delay = min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class OutboxStore:
+    """Notificaciones pendientes y muertas en SQLite"""
+
+    def __init__(self, db_path: str = OUTBOX_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, kind TEXT NOT NULL,
+                url TEXT NOT NULL, payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL, created_at REAL NOT NULL, last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at);
+            CREATE TABLE IF NOT EXISTS outbox_dead (
+                id INTEGER PRIMARY KEY, key TEXT NOT NULL, kind TEXT NOT NULL,
+                url TEXT NOT NULL, payload TEXT NOT NULL, attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL, failed_at REAL NOT NULL, last_error TEXT
+            );
+        """)
+        self._db.commit()
+
+    def add(self, kind: str, url: str, payload: Dict[str, Any]) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (key, kind, url, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (uuid.uuid4().hex, kind, url, json.dumps(payload, ensure_ascii=False, default=str), now, now),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def due(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM outbox WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?", (now, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def next_attempt_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()
+        return row[0]
+
+    def record(self, delivered: List[int], retries: List[Tuple[int, float, str]], dead: List[Tuple[int, str]]):
+        """Guardar el resultado de un lote en una sola transacción"""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(item_id,) for item_id in delivered])
+            self._db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(next_at, error, item_id) for item_id, next_at, error in retries],
+            )
+            for item_id, error in dead:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO outbox_dead (id, key, kind, url, payload, attempts, created_at, failed_at, last_error) "
+                    "SELECT id, key, kind, url, payload, attempts + 1, created_at, ?, ? FROM outbox WHERE id = ?",
+                    (now, error, item_id),
+                )
+                self._db.execute("DELETE FROM outbox WHERE id = ?", (item_id,))
+
+    def dead(self, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM outbox_dead ORDER BY failed_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def requeue(self, item_id: int) -> bool:
+        """Volver a encolar una notificación muerta con los intentos en cero"""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (id, key, kind, url, payload, next_attempt_at, created_at, last_error) "
+                "SELECT id, key, kind, url, payload, ?, created_at, last_error FROM outbox_dead WHERE id = ?",
+                (time.time(), item_id),
+            )
+            self._db.execute("DELETE FROM outbox_dead WHERE id = ?", (item_id,))
+            return cursor.rowcount == 1
+
+    def counts(self) -> Dict[str, Any]:
+        with self._lock:
+            pending, oldest = self._db.execute("SELECT COUNT(*), MIN(created_at) FROM outbox").fetchone()
+            dead = self._db.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+        return {"pending": pending, "dead": dead, "oldest_pending_age": time.time() - oldest if oldest else None}
+
+
+class NotificationOutbox:
+    def __init__(self, store: Optional[OutboxStore] = None, url: Optional[str] = N8N_WEBHOOK_URL):
+        self._store = store
+        self.url = url
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stats = {"enqueued": 0, "delivered": 0, "retries": 0, "dead_lettered": 0}
+
+    @property
+    def store(self) -> OutboxStore:
+        # La base se abre al usarla, no al importar el módulo
+        if self._store is None:
+            self._store = OutboxStore()
+        return self._store
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url)
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> Optional[int]:
+        """Guardar una notificación para n8n (no bloquea en la red)
+
+        Se puede llamar desde cualquier hilo. Devuelve None si no hay
+        N8N_WEBHOOK_URL configurada.
+        """
+        if not self.url:
+            return None
+        item_id = self.store.add(kind, self.url, {"type": kind, **payload})
+        self._stats["enqueued"] += 1
+        self._wake()
+        return item_id
+
+    def requeue(self, item_id: int) -> bool:
+        """Reintentar una notificación de dead letter"""
+        if not self.store.requeue(item_id):
+            return False
+        self._wake()
+        return True
+
+    def start(self):
+        """Arrancar el despachador (llamar desde el evento startup); lo pendiente se retoma"""
+        if self._task:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+        pending = self.store.counts()["pending"]
+        if pending:
+            logger.info(f"📬 Retomando {pending} notificaciones pendientes para n8n")
+
+    async def stop(self):
+        """Detener el despachador; lo no enviado queda en la bandeja"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _wake(self):
+        if self._loop and self._wakeup and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        timeout = aiohttp.ClientTimeout(total=OUTBOX_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while True:
+                self._wakeup.clear()
+                try:
+                    sent = await self.dispatch(session)
+                except Exception as e:
+                    logger.error(f"❌ Error en la bandeja de n8n: {e}")
+                    sent = 0
+                if sent == OUTBOX_BATCH_SIZE:
+                    # Lote lleno: puede haber más vencidas
+                    continue
+
+                next_at = self.store.next_attempt_at()
+                wait = OUTBOX_POLL_INTERVAL if next_at is None else min(OUTBOX_POLL_INTERVAL, max(0.0, next_at - time.time()))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def dispatch(self, session: aiohttp.ClientSession) -> int:
+        """Enviar un lote de notificaciones vencidas; devuelve cuántas se intentaron"""
+        batch = self.store.due(time.time(), OUTBOX_BATCH_SIZE)
+        if not batch:
+            return 0
+
+        results = await asyncio.gather(*(self._deliver(session, item) for item in batch), return_exceptions=True)
+        delivered, retries, dead = [], [], []
+        now = time.time()
+        for item, result in zip(batch, results):
+            if result is None:
+                delivered.append(item["id"])
+                continue
+            error = str(result) or type(result).__name__
+            attempts = item["attempts"] + 1
+            if getattr(result, "retryable", True) and attempts < OUTBOX_MAX_ATTEMPTS:
+                retries.append((item["id"], now + retry_delay(attempts), error))
+            else:
+                dead.append((item["id"], error))
+                logger.error(f"💀 Notificación {item['kind']} #{item['id']} a dead letter tras {attempts} intentos: {error}")
+        self.store.record(delivered, retries, dead)
+
+        self._stats["delivered"] += len(delivered)
+        self._stats["retries"] += len(retries)
+        self._stats["dead_lettered"] += len(dead)
+        if delivered:
+            logger.info(f"📬 {len(delivered)} notificaciones entregadas a n8n")
+        if retries:
+            logger.warning(f"🔁 {len(retries)} notificaciones para n8n se reintentarán")
+        return len(batch)
+
+    @staticmethod
+    async def _deliver(session: aiohttp.ClientSession, item: Dict[str, Any]):
+        headers = {"Content-Type": "application/json", "Idempotency-Key": item["key"]}
+        try:
+            async with session.post(item["url"], data=item["payload"].encode("utf-8"), headers=headers) as response:
+                if response.status < 300:
+                    return None
+                body = (await response.text())[:200]
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise DeliveryError(f"{type(e).__name__} {e}") from e
+        retryable = response.status >= 500 or response.status in RETRYABLE_STATUS
+        raise DeliveryError(f"HTTP {response.status}: {body}", retryable=retryable)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"configured": self.configured, **self.store.counts(), **self._stats}
+
+# Instancia global de la bandeja de salida hacia n8n
+notification_outbox = NotificationOutbox()
@@ -0,0 +1,238 @@
+"""
+Protección de los servicios externos (OpenAI, llama.cpp, Telnyx, Vapi, Google Calendar)
+
+Cada servicio tiene:
+- Circuit breaker: tras varios fallos seguidos deja de llamar durante un
+  tiempo y luego prueba con una sola petición
+- Límite de concurrencia AIMD: sube de a poco mientras las llamadas salen
+  bien y se reduce a la mitad ante un fallo o una respuesta lenta
+- Token bucket: tope de peticiones por segundo
+
+Si el servicio no admite la llamada se lanza UpstreamUnavailable de
+inmediato, sin hacer cola, para que quien llama use su respuesta de
+respaldo mientras dura el incidente.
+
+Uso:
+    with upstream("google").guard():
+        request.execute()
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import logging
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fallos seguidos que abren el circuito
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+
+# Segundos con el circuito abierto antes de probar de nuevo
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+
+class UpstreamUnavailable(Exception):
+    """El servicio externo no admite más llamadas por ahora"""
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Solo los errores del servicio cuentan: 4xx (salvo 429) son del request"""
+    status = (
+        getattr(error, "status_code", None)
+        or getattr(getattr(error, "resp", None), "status", None)
+        or getattr(error, "status", None)
+    )
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return True
+    return status >= 500 or status == 429
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self, now: float) -> bool:
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            # Una sola petición de prueba a la vez
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self, now: float) -> bool:
+        """Registrar un fallo; True si el circuito se acaba de abrir"""
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            was_open = self.state == self.OPEN
+            self.state = self.OPEN
+            self.opened_at = now
+            return not was_open
+        return False
+
+
+class AIMDLimiter:
+    """Límite de llamadas simultáneas con aumento aditivo y reducción multiplicativa"""
+
+    def __init__(self, initial: float = 8, min_limit: float = 1, max_limit: float = 64,
+                 backoff: float = 0.5, latency_target: Optional[float] = None):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, success: bool, latency: float):
+        self.in_flight -= 1
+        if not success or (self.latency_target and latency > self.latency_target):
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        else:
+            # +1 por cada "ventana" completa de llamadas exitosas
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: Optional[float] = None):
+        self.rate = rate_per_second
+        self.capacity = burst if burst is not None else max(1.0, rate_per_second)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def try_take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Upstream:
+    def __init__(self, name: str, rate_per_second: float, initial_concurrency: float = 8,
+                 max_concurrency: float = 64, latency_target: Optional[float] = None,
+                 is_failure: Callable[[BaseException], bool] = is_upstream_failure):
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self.limiter = AIMDLimiter(initial=initial_concurrency, max_limit=max_concurrency,
+                                   latency_target=latency_target)
+        self.bucket = TokenBucket(rate_per_second)
+        self.is_failure = is_failure
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "failures": 0, "shed_open": 0, "shed_concurrency": 0, "shed_rate": 0}
+
+    def _admit(self):
+        now = time.monotonic()
+        with self._lock:
+            if not self.breaker.allow(now):
+                self._stats["shed_open"] += 1
+                raise UpstreamUnavailable(f"{self.name}: circuito abierto")
+            if not self.limiter.try_acquire():
+                self._release_probe()
+                self._stats["shed_concurrency"] += 1
+                raise UpstreamUnavailable(f"{self.name}: demasiadas llamadas simultáneas")
+            if not self.bucket.try_take(now):
+                self.limiter.in_flight -= 1
+                self._release_probe()
+                self._stats["shed_rate"] += 1
+                raise UpstreamUnavailable(f"{self.name}: límite de peticiones por segundo")
+            self._stats["calls"] += 1
+
+    def _release_probe(self):
+        # La petición de prueba no llegó a salir: permitir otra
+        self.breaker._probe_in_flight = False
+
+    def _finish(self, success: bool, started: float):
+        now = time.monotonic()
+        with self._lock:
+            self.limiter.release(success, now - started)
+            if success:
+                self.breaker.record_success()
+            else:
+                self._stats["failures"] += 1
+                if self.breaker.record_failure(now):
+                    logger.warning(f"🔌 Circuito de {self.name} abierto por {self.breaker.reset_seconds:.0f}s")
+
+    @contextmanager
+    def guard(self) -> Iterator["Upstream"]:
+        """Admitir la llamada o lanzar UpstreamUnavailable; registra el resultado
+
+        Funciona igual alrededor de código síncrono o de `await` dentro de
+        una corrutina.
+        """
+        self._admit()
+        started = time.monotonic()
+        success = True
+        try:
+            yield self
+        except Exception as e:
+            success = not self.is_failure(e)
+            raise
+        finally:
+            self._finish(success, started)
+
+    def call(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        with self.guard():
+            return function(*args, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "state": self.breaker.state,
+                "concurrency_limit": round(self.limiter.limit, 2),
+                "in_flight": self.limiter.in_flight,
+            })
+        return stats
+
+
+_UPSTREAMS = {
+    "openai": Upstream("openai", float(os.getenv("OPENAI_MAX_RPS", "10")),
+                       latency_target=float(os.getenv("OPENAI_LATENCY_TARGET", "8"))),
+    "llamacpp": Upstream("llamacpp", float(os.getenv("LLAMACPP_MAX_RPS", "10")), initial_concurrency=2, max_concurrency=8),
+    "telnyx": Upstream("telnyx", float(os.getenv("TELNYX_MAX_RPS", "20"))),
+    "vapi": Upstream("vapi", float(os.getenv("VAPI_MAX_RPS", "10"))),
+    "google": Upstream("google", float(os.getenv("GOOGLE_MAX_RPS", "5")), initial_concurrency=4, max_concurrency=16),
+}
+
+
+def upstream(name: str) -> Upstream:
+    """Protección compartida de un servicio externo ("openai", "llamacpp", "telnyx", "vapi", "google")"""
+    return _UPSTREAMS[name]
+
+
+def resilience_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: item.stats() for name, item in _UPSTREAMS.items()}
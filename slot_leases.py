@@ -0,0 +1,109 @@
+"""
+Tabla de reservas temporales (leases) de horarios
+
+Un lease aparta un horario durante unos segundos mientras se confirma una
+cita. Vive solo en memoria del proceso y expira automáticamente.
+"""
+
+import heapq
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Duración por defecto de un lease en segundos
+DEFAULT_LEASE_TTL = int(os.getenv("SLOT_LEASE_TTL", "30"))
+
+
+@dataclass
+class SlotLease:
+    lease_id: str
+    date: str
+    start: int
+    end: int
+    holder: str
+    expires_at: float
+
+
+class SlotLeaseTable:
+    def __init__(self, default_ttl: int = DEFAULT_LEASE_TTL):
+        self.default_ttl = default_ttl
+        self._leases: Dict[str, SlotLease] = {}
+        self._by_date: Dict[str, Dict[str, SlotLease]] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, date: str, start: int, end: int, holder: str,
+                ttl: Optional[int] = None) -> Optional[SlotLease]:
+        """Apartar [start, end) si ningún otro titular lo tiene; None si hay conflicto"""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+
+            for lease in self._by_date.get(date, {}).values():
+                if lease.holder != holder and lease.start < end and lease.end > start:
+                    return None
+
+            lease = SlotLease(
+                lease_id=uuid.uuid4().hex,
+                date=date,
+                start=start,
+                end=end,
+                holder=holder,
+                expires_at=now + (ttl or self.default_ttl),
+            )
+            self._leases[lease.lease_id] = lease
+            self._by_date.setdefault(date, {})[lease.lease_id] = lease
+            heapq.heappush(self._expiry_heap, (lease.expires_at, lease.lease_id))
+            return lease
+
+    def release(self, lease_id: str) -> Optional[SlotLease]:
+        """Liberar un lease; devuelve el lease liberado si seguía activo"""
+        with self._lock:
+            self._sweep(time.monotonic())
+            return self._remove(lease_id)
+
+    def get(self, lease_id: str) -> Optional[SlotLease]:
+        """Obtener un lease activo"""
+        with self._lock:
+            self._sweep(time.monotonic())
+            return self._leases.get(lease_id)
+
+    def held_intervals(self, date: str, exclude_holder: Optional[str] = None) -> List[Tuple[int, int]]:
+        """Intervalos apartados en una fecha, opcionalmente sin los de un titular"""
+        with self._lock:
+            self._sweep(time.monotonic())
+            return [
+                (lease.start, lease.end)
+                for lease in self._by_date.get(date, {}).values()
+                if lease.holder != exclude_holder
+            ]
+
+    def sweep(self) -> int:
+        """Eliminar los leases expirados; devuelve cuántos se eliminaron"""
+        with self._lock:
+            return self._sweep(time.monotonic())
+
+    def _sweep(self, now: float) -> int:
+        removed = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, lease_id = heapq.heappop(heap)
+            lease = self._leases.get(lease_id)
+            # El heap puede tener entradas viejas de leases liberados o extendidos
+            if lease and lease.expires_at == expires_at:
+                self._remove(lease_id)
+                removed += 1
+        return removed
+
+    def _remove(self, lease_id: str) -> Optional[SlotLease]:
+        lease = self._leases.pop(lease_id, None)
+        if lease:
+            by_date = self._by_date.get(lease.date)
+            if by_date is not None:
+                by_date.pop(lease_id, None)
+                if not by_date:
+                    del self._by_date[lease.date]
+        return lease
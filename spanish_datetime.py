@@ -0,0 +1,334 @@
+"""
+Interpretación determinista de fechas y horas dichas por el paciente (es-MX)
+
+Convierte frases como "el martes a las 4", "mañana en la tarde" o
+"15 de marzo a las diez" a fecha YYYY-MM-DD y hora HH:MM, listas para
+`get_available_slots`, sin consultar al LLM.
+
+- Fechas relativas (hoy, mañana, pasado mañana, días de la semana) contra el
+  día actual en la zona horaria de la clínica
+- Números en palabras ("diez y media", "cuarto para las cinco")
+- Sin "de la mañana"/"de la tarde", las horas de 1 a 7 se toman como de la
+  tarde: el consultorio atiende de 8:00 a 18:00
+
+Uso rápido para verificar el corpus y medir el rendimiento:
+    python spanish_datetime.py
+"""
+
+import re
+import time
+import unicodedata
+from datetime import date as date_cls, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from calendar_time import WORK_END_HOUR, WORK_START_HOUR, today_local
+
+_NUMBER_WORDS = {
+    "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "once": 11,
+    "doce": 12, "trece": 13, "catorce": 14, "quince": 15, "dieciseis": 16,
+    "diecisiete": 17, "dieciocho": 18, "diecinueve": 19, "veinte": 20,
+    "veintiuno": 21, "veintiun": 21, "veintiuna": 21, "veintidos": 22,
+    "veintitres": 23, "veinticuatro": 24, "veinticinco": 25, "veintiseis": 26,
+    "veintisiete": 27, "veintiocho": 28, "veintinueve": 29, "treinta": 30,
+    "cuarenta": 40, "cincuenta": 50,
+}
+
+_MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+
+_WEEKDAYS = {
+    "lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4,
+    "sabado": 5, "domingo": 6,
+}
+
+# Ventanas (hora inicio, hora fin) para "en la mañana" / "en la tarde"
+PART_OF_DAY_WINDOWS: Dict[str, Tuple[str, str]] = {
+    "manana": (f"{WORK_START_HOUR:02d}:00", "12:00"),
+    "tarde": ("12:00", f"{WORK_END_HOUR:02d}:00"),
+}
+
+_MONTH_NAMES = "|".join(_MONTHS)
+_WEEKDAY_NAMES = "|".join(_WEEKDAYS)
+
+_WORD = re.compile(r"[a-z]+")
+_COMPOUND_NUMBER = re.compile(r"\b([2-5]0) y ([1-9])\b")
+
+_PASADO_MANANA = re.compile(r"\bpasado manana\b")
+_MANANA = re.compile(r"(?<!la )\bmanana\b")
+_HOY = re.compile(r"\bhoy\b")
+_DAY_OF_MONTH = re.compile(rf"\b(\d{{1,2}}|primero) de ({_MONTH_NAMES})(?: (?:de|del) (\d{{4}}))?\b")
+_NUMERIC_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2}|\d{4}))?\b")
+_WEEKDAY = re.compile(rf"\b({_WEEKDAY_NAMES})\b")
+_NEXT_WEEK = re.compile(r"\b(?:proxima|siguiente|otra) semana\b|\bsemana que (?:entra|viene)\b")
+_BARE_DAY = re.compile(r"\b(?:el|dia) (\d{1,2})\b(?! de la| y| para|:)")
+
+_CLOCK = re.compile(r"\b(\d{1,2}):(\d{2})\b")
+_QUARTER_TO = re.compile(r"\b(?:1 )?cuarto para (?:las? )?(\d{1,2})\b")
+_MINUTES_TO = re.compile(r"\b(\d{1,2}) para (?:las? )(\d{1,2})\b")
+_HOUR = re.compile(r"\b(?:a |como a |tipo |a eso de )?las? (\d{1,2})(?: y (media|cuarto|\d{1,2}))?\b")
+_HOUR_WITH_MARKER = re.compile(r"\b(\d{1,2})(?: y (media|cuarto|\d{1,2}))? ?(am|pm|a\.m\.|p\.m\.|de la (?:manana|tarde|noche)|del mediodia)(?!\w)")
+_BARE_HOUR = re.compile(r"^(\d{1,2})(?: y (media|cuarto|\d{1,2}))?(?: horas| hrs| en punto)?$")
+_NOON = re.compile(r"\bmediodia\b")
+
+# (?!\w) en lugar de \b al final: "p.m." termina en punto; "amiga" o "amablemente" no son marcadores
+_PM_MARKER = re.compile(r"\b(?:pm|p\.m\.|(?:de|en|por) la (?:tarde|noche))(?!\w)")
+_AM_MARKER = re.compile(r"\b(?:am|a\.m\.|(?:de|en|por) la manana|temprano)(?!\w)")
+
+
+class ParsedDateTime(NamedTuple):
+    """Resultado de la interpretación: cualquier parte puede faltar"""
+    date: Optional[str] = None
+    time: Optional[str] = None
+    part_of_day: Optional[str] = None
+
+
+def _normalize(text: str) -> str:
+    """Minúsculas sin acentos, con los números en palabras como dígitos"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    plain = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    plain = plain.replace("¿", " ").replace("?", " ").replace(",", " ").replace("!", " ")
+    plain = _WORD.sub(lambda match: str(_NUMBER_WORDS.get(match.group(0), match.group(0))), plain)
+    plain = " ".join(plain.split())
+    # "treinta y uno" -> 31
+    return _COMPOUND_NUMBER.sub(lambda match: str(int(match.group(1)) + int(match.group(2))), plain)
+
+
+def _minutes(fraction: Optional[str]) -> Optional[int]:
+    if not fraction:
+        return 0
+    if fraction == "media":
+        return 30
+    if fraction == "cuarto":
+        return 15
+    minutes = int(fraction)
+    return minutes if minutes < 60 else None
+
+
+def _to_24h(hour: int, minute: int, meridiem: Optional[str]) -> Optional[str]:
+    """Aplicar AM/PM; sin indicación, las horas antes de abrir son de la tarde"""
+    if hour > 23 or minute is None:
+        return None
+    if hour <= 12:
+        if meridiem == "pm" and hour < 12:
+            hour += 12
+        elif meridiem is None and hour < WORK_START_HOUR:
+            hour += 12
+    return f"{hour:02d}:{minute:02d}"
+
+
+def _meridiem(text: str) -> Optional[str]:
+    if _PM_MARKER.search(text):
+        return "pm"
+    if _AM_MARKER.search(text):
+        return "am"
+    return None
+
+
+def _marker_meridiem(marker: str) -> Optional[str]:
+    if marker.startswith(("p", "de la tarde", "de la noche")):
+        return "pm"
+    if marker.startswith(("a", "de la manana")):
+        return "am"
+    return None
+
+
+def _parse_time(text: str) -> Optional[str]:
+    match = _CLOCK.search(text)
+    if match:
+        hour, minute = int(match.group(1)), int(match.group(2))
+        return _to_24h(hour, minute if minute < 60 else None, None if hour > 12 else _meridiem(text))
+
+    match = _QUARTER_TO.search(text)
+    if match:
+        return _to_24h(int(match.group(1)) - 1, 45, _meridiem(text))
+
+    match = _MINUTES_TO.search(text)
+    if match and int(match.group(1)) < 60:
+        return _to_24h(int(match.group(2)) - 1, 60 - int(match.group(1)), _meridiem(text))
+
+    match = _HOUR_WITH_MARKER.search(text)
+    if match:
+        return _to_24h(int(match.group(1)), _minutes(match.group(2)), _marker_meridiem(match.group(3)))
+
+    match = _HOUR.search(text)
+    if match:
+        return _to_24h(int(match.group(1)), _minutes(match.group(2)), _meridiem(text))
+
+    if _NOON.search(text):
+        return "12:00"
+    return None
+
+
+def _part_of_day(text: str) -> Optional[str]:
+    meridiem = _meridiem(text)
+    if meridiem == "am":
+        return "manana"
+    if meridiem == "pm":
+        return "tarde"
+    return None
+
+
+def _future_date(year: int, month: int, day: int, today: date_cls, explicit_year: bool) -> Optional[date_cls]:
+    """Fecha del calendario; si ya pasó y no se dijo el año, la del año siguiente"""
+    try:
+        candidate = date_cls(year, month, day)
+        if candidate < today and not explicit_year:
+            candidate = date_cls(year + 1, month, day)
+    except ValueError:
+        return None
+    return candidate
+
+
+def _parse_date(text: str, today: date_cls) -> Optional[date_cls]:
+    if _PASADO_MANANA.search(text):
+        return today + timedelta(days=2)
+    if _MANANA.search(text):
+        return today + timedelta(days=1)
+    if _HOY.search(text):
+        return today
+
+    match = _DAY_OF_MONTH.search(text)
+    if match:
+        day = 1 if match.group(1) == "primero" else int(match.group(1))
+        year = int(match.group(3)) if match.group(3) else today.year
+        return _future_date(year, _MONTHS[match.group(2)], day, today, bool(match.group(3)))
+
+    match = _NUMERIC_DATE.search(text)
+    if match:
+        year = match.group(3)
+        if year and len(year) == 2:
+            year = "20" + year
+        return _future_date(int(year or today.year), int(match.group(2)), int(match.group(1)), today, bool(year))
+
+    match = _WEEKDAY.search(text)
+    if match:
+        weekday = _WEEKDAYS[match.group(1)]
+        if _NEXT_WEEK.search(text):
+            next_monday = today + timedelta(days=7 - today.weekday())
+            return next_monday + timedelta(days=weekday)
+        # "el martes" dicho un martes se refiere al de la semana siguiente
+        return today + timedelta(days=(weekday - today.weekday() - 1) % 7 + 1)
+
+    match = _BARE_DAY.search(text)
+    if match:
+        day = int(match.group(1))
+        month, year = today.month, today.year
+        try:
+            candidate = date_cls(year, month, day)
+        except ValueError:
+            return None
+        if candidate < today:
+            month, year = (1, year + 1) if month == 12 else (month + 1, year)
+            try:
+                candidate = date_cls(year, month, day)
+            except ValueError:
+                return None
+        return candidate
+
+    return None
+
+
+def parse_date_time(text: str, today: Optional[str] = None) -> ParsedDateTime:
+    """Interpretar fecha, hora y parte del día de una frase del paciente
+
+    `today` (YYYY-MM-DD) es el día de referencia; por defecto, hoy en la
+    zona horaria de la clínica.
+    """
+    if not text:
+        return ParsedDateTime()
+
+    reference = date_cls.fromisoformat(today or today_local())
+    normalized = _normalize(text)
+
+    parsed_date = _parse_date(normalized, reference)
+    parsed_time = _parse_time(normalized)
+    if parsed_time is None:
+        match = _BARE_HOUR.match(normalized)
+        if match:
+            parsed_time = _to_24h(int(match.group(1)), _minutes(match.group(2)), None)
+
+    return ParsedDateTime(
+        date=parsed_date.isoformat() if parsed_date else None,
+        time=parsed_time,
+        part_of_day=None if parsed_time else _part_of_day(normalized),
+    )
+
+
+def slots_for_part_of_day(slots: List[str], part_of_day: Optional[str]) -> List[str]:
+    """Filtrar horarios (HH:MM) a la ventana de "mañana" o "tarde" """
+    if part_of_day not in PART_OF_DAY_WINDOWS:
+        return slots
+    start, end = PART_OF_DAY_WINDOWS[part_of_day]
+    return [slot for slot in slots if start <= slot < end]
+
+
+# Corpus de referencia: (frase, fecha, hora, parte del día) con hoy = lunes 2025-03-10
+CORPUS_REFERENCE_DATE = "2025-03-10"
+CORPUS = [
+    ("el martes a las 4", "2025-03-11", "16:00", None),
+    ("mañana en la tarde", "2025-03-11", None, "tarde"),
+    ("mañana en la mañana", "2025-03-11", None, "manana"),
+    ("15 de marzo a las diez", "2025-03-15", "10:00", None),
+    ("hoy a las 5 y media", "2025-03-10", "17:30", None),
+    ("pasado mañana a las once", "2025-03-12", "11:00", None),
+    ("el lunes", "2025-03-17", None, None),
+    ("el viernes a las 9 de la mañana", "2025-03-14", "09:00", None),
+    ("el jueves a las 3 de la tarde", "2025-03-13", "15:00", None),
+    ("el miércoles de la próxima semana a las diez y cuarto", "2025-03-19", "10:15", None),
+    ("el martes que viene a mediodía", "2025-03-11", "12:00", None),
+    ("primero de abril a la una", "2025-04-01", "13:00", None),
+    ("treinta y uno de marzo 4:30", "2025-03-31", "16:30", None),
+    ("el 2 de enero", "2026-01-02", None, None),
+    ("el 20 de mayo de 2025 a las 8", "2025-05-20", "08:00", None),
+    ("20/03 a las 12", "2025-03-20", "12:00", None),
+    ("el 25 a las 10", "2025-03-25", "10:00", None),
+    ("el día 5", "2025-04-05", None, None),
+    ("cuarto para las cinco", None, "16:45", None),
+    ("a las 16:00", None, "16:00", None),
+    ("a las 4 pm", None, "16:00", None),
+    ("a las 5 p.m.", None, "17:00", None),
+    ("el martes a las 4 con mi amiga", "2025-03-11", "16:00", None),
+    ("el viernes a las 5 amablemente", "2025-03-14", "17:00", None),
+    ("10 am", None, "10:00", None),
+    ("a las diez", None, "10:00", None),
+    ("diez y media", None, "10:30", None),
+    ("¿tienen algo el sábado temprano?", "2025-03-15", None, "manana"),
+    ("la semana que entra el jueves en la tarde", "2025-03-20", None, "tarde"),
+    ("quiero una cita", None, None, None),
+    ("no sé todavía", None, None, None),
+]
+
+
+def check_corpus() -> List[str]:
+    """Comparar el corpus con el parser; devuelve las discrepancias"""
+    failures = []
+    for utterance, expected_date, expected_time, expected_part in CORPUS:
+        result = parse_date_time(utterance, CORPUS_REFERENCE_DATE)
+        expected = ParsedDateTime(expected_date, expected_time, expected_part)
+        if result != expected:
+            failures.append(f"{utterance!r}: esperado {tuple(expected)}, obtenido {tuple(result)}")
+    return failures
+
+
+def benchmark(rounds: int = 2000) -> float:
+    """Frases interpretadas por segundo sobre el corpus"""
+    utterances = [row[0] for row in CORPUS]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for utterance in utterances:
+            parse_date_time(utterance, CORPUS_REFERENCE_DATE)
+    elapsed = time.perf_counter() - start
+    return rounds * len(utterances) / elapsed
+
+
+if __name__ == "__main__":
+    failures = check_corpus()
+    for failure in failures:
+        print(f"❌ {failure}")
+    print(f"✅ Corpus: {len(CORPUS) - len(failures)}/{len(CORPUS)} frases correctas")
+    print(f"⚡ Rendimiento: {benchmark():,.0f} frases/segundo")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,188 @@
+"""
+Cliente asíncrono de la API de Vapi
+
+Una sola sesión aiohttp por event loop con pool de conexiones
+(VAPI_POOL_SIZE), timeouts de conexión y totales, y reintentos acotados
+con backoff exponencial y jitter completo. Cada intento pasa por
+upstream("vapi") para que un incidente de Vapi abra el circuito en lugar
+de acumular llamadas lentas.
+
+Solo se reintenta lo que no puede duplicar una llamada telefónica:
+- GET: errores de red, timeouts, 429 y 5xx
+- POST /call: fallos al conectar (la petición no salió) y 429
+
+Uso:
+    call = await async_vapi_client.create_call("+5215512345678", {"type": "recordatorio"})
+    call = await async_vapi_client.get_call(call.id)
+"""
+
+import asyncio
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import aiohttp
+import logging
+
+from resilience import UpstreamUnavailable, upstream
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VAPI_BASE_URL = os.getenv("VAPI_BASE_URL", "https://api.vapi.ai")
+
+# Segundos máximos por intento y para abrir la conexión
+VAPI_TIMEOUT = float(os.getenv("VAPI_TIMEOUT", "10"))
+VAPI_CONNECT_TIMEOUT = float(os.getenv("VAPI_CONNECT_TIMEOUT", "3"))
+
+# Conexiones simultáneas del pool compartido
+VAPI_POOL_SIZE = int(os.getenv("VAPI_POOL_SIZE", "20"))
+
+# Reintentos después del primer intento y espera base del backoff (segundos)
+VAPI_MAX_RETRIES = int(os.getenv("VAPI_MAX_RETRIES", "2"))
+VAPI_RETRY_BASE_DELAY = float(os.getenv("VAPI_RETRY_BASE_DELAY", "0.5"))
+
+# Tope de espera entre intentos, incluido el Retry-After de un 429
+VAPI_RETRY_MAX_DELAY = float(os.getenv("VAPI_RETRY_MAX_DELAY", "5"))
+
+
+class VapiError(Exception):
+    """Error de la API de Vapi (status_code None si no hubo respuesta)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, body: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+@dataclass
+class VapiCall:
+    id: str
+    status: Optional[str] = None
+    customer_number: Optional[str] = None
+    created_at: Optional[str] = None
+    ended_reason: Optional[str] = None
+    raw: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "VapiCall":
+        return cls(
+            id=data.get("id", ""),
+            status=data.get("status"),
+            customer_number=(data.get("customer") or {}).get("number"),
+            created_at=data.get("createdAt"),
+            ended_reason=data.get("endedReason"),
+            raw=data,
+        )
+
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Espera antes del reintento `attempt` (0, 1, ...): Retry-After o backoff con jitter completo"""
+    if retry_after:
+        try:
+            return min(VAPI_RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(VAPI_RETRY_MAX_DELAY, VAPI_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class AsyncVapiClient:
+    def __init__(self, api_key: Optional[str] = None, phone_number_id: Optional[str] = None,
+                 assistant_id: Optional[str] = None, base_url: str = VAPI_BASE_URL):
+        self.api_key = api_key or os.getenv("VAPI_API_KEY")
+        self.phone_number_id = phone_number_id or os.getenv("VAPI_PHONE_NUMBER_ID")
+        self.assistant_id = assistant_id or os.getenv("VAPI_ASSISTANT_ID")
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=VAPI_TIMEOUT, connect=VAPI_CONNECT_TIMEOUT)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # La sesión queda ligada al event loop que la creó
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit=VAPI_POOL_SIZE, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+            self._loop = loop
+        return self._session
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    async def close(self):
+        """Cerrar el pool (llamar desde el evento shutdown)"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method: str, path: str, json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if not self.api_key:
+            raise VapiError("VAPI_API_KEY no configurada")
+
+        idempotent = method == "GET"
+        url = f"{self.base_url}{path}"
+        for attempt in range(VAPI_MAX_RETRIES + 1):
+            retry_after = None
+            self._stats["requests"] += 1
+            try:
+                with upstream("vapi").guard():
+                    async with self._get_session().request(method, url, json=json) as response:
+                        if response.status < 400:
+                            return await response.json(content_type=None)
+                        body = await response.text()
+                        retry_after = response.headers.get("Retry-After")
+                        raise VapiError(f"Vapi {method} {path}: {response.status}", response.status, body)
+            except VapiError as e:
+                retryable = e.status_code == 429 or (idempotent and e.status_code >= 500)
+                error = e
+            except aiohttp.ClientConnectorError as e:
+                # No se llegó a conectar: la petición no salió y se puede repetir
+                retryable = True
+                error = VapiError(f"Vapi {method} {path}: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable = idempotent
+                error = VapiError(f"Vapi {method} {path}: {type(e).__name__} {e}")
+            except UpstreamUnavailable as e:
+                self._stats["errors"] += 1
+                raise VapiError(str(e)) from e
+
+            if not retryable or attempt == VAPI_MAX_RETRIES:
+                self._stats["errors"] += 1
+                raise error
+            delay = retry_delay(attempt, retry_after)
+            self._stats["retries"] += 1
+            logger.warning(f"🔁 {error}; reintento {attempt + 1}/{VAPI_MAX_RETRIES} en {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def create_call(self, phone_number: str, metadata: Optional[Dict[str, Any]] = None,
+                          assistant_id: Optional[str] = None,
+                          assistant_overrides: Optional[Dict[str, Any]] = None) -> VapiCall:
+        """Crear una llamada saliente (assistant_overrides: firstMessage, variableValues, ...)"""
+        payload: Dict[str, Any] = {
+            "phoneNumberId": self.phone_number_id,
+            "assistantId": assistant_id or self.assistant_id,
+            "customer": {"number": phone_number},
+        }
+        if metadata:
+            payload["metadata"] = metadata
+        if assistant_overrides:
+            payload["assistantOverrides"] = assistant_overrides
+        return VapiCall.from_json(await self._request("POST", "/call", json=payload))
+
+    async def get_call(self, call_id: str) -> VapiCall:
+        """Estado de una llamada"""
+        return VapiCall.from_json(await self._request("GET", f"/call/{call_id}"))
+
+# Instancia global del cliente de Vapi (pool compartido)
+async_vapi_client = AsyncVapiClient()
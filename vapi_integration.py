@@ -3,112 +3,52 @@ Módulo de integración con Vapi para consultorio médico
 Añade este archivo a tu API existente en Render
 """
 
-import os
 import json
-import requests
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 import logging
 
+from knowledge_base import knowledge_store
+from vapi_client import AsyncVapiClient, VapiError, async_vapi_client
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class VapiIntegration:
-    def __init__(self):
-        self.api_key = os.getenv("VAPI_API_KEY")
-        self.phone_number_id = os.getenv("VAPI_PHONE_NUMBER_ID")
-        self.assistant_id = os.getenv("VAPI_ASSISTANT_ID")
-        self.base_url = "https://api.vapi.ai"
+    """Llamadas de Vapi sobre el cliente asíncrono compartido (pool, timeouts y reintentos)"""
+    
+    def __init__(self, client: AsyncVapiClient = async_vapi_client):
+        self.client = client
         
-        if not self.api_key:
+        if not self.client.configured:
             logger.warning("VAPI_API_KEY no configurada")
     
-    def create_call(self, phone_number: str, metadata: Optional[Dict] = None) -> Dict[str, Any]:
+    async def create_call(self, phone_number: str, metadata: Optional[Dict] = None) -> Dict[str, Any]:
         """Crear una llamada usando Vapi"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "phoneNumberId": self.phone_number_id,
-                "assistantId": self.assistant_id,
-                "customer": {
-                    "number": phone_number
-                }
-            }
-            
-            if metadata:
-                payload["metadata"] = metadata
-            
-            response = requests.post(
-                f"{self.base_url}/call",
-                headers=headers,
-                json=payload
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"Error creando llamada: {response.status_code} - {response.text}")
-                return {"error": "Failed to create call"}
-                
-        except Exception as e:
-            logger.error(f"Excepción creando llamada: {str(e)}")
-            return {"error": str(e)}
+            call = await self.client.create_call(phone_number, metadata)
+            return call.raw
+        except VapiError as e:
+            logger.error(f"Error creando llamada: {e} {e.body}")
+            return {"error": "Failed to create call"}
     
-    def get_call_status(self, call_id: str) -> Dict[str, Any]:
+    async def get_call_status(self, call_id: str) -> Dict[str, Any]:
         """Obtener estado de una llamada"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            response = requests.get(
-                f"{self.base_url}/call/{call_id}",
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"error": f"Status code: {response.status_code}"}
-                
-        except Exception as e:
+            call = await self.client.get_call(call_id)
+            return call.raw
+        except VapiError as e:
+            if e.status_code:
+                return {"error": f"Status code: {e.status_code}"}
             return {"error": str(e)}
+    
+    async def close(self):
+        await self.client.close()
 
 class MedicalConsultationHandler:
     """Manejador de consultas médicas para Vapi"""
     
-    def __init__(self):
-        # Base de conocimiento del consultorio
-        self.knowledge_base = {
-            "horarios": {
-                "lunes_viernes": "8:00 a 18:00",
-                "sabados": "9:00 a 14:00",
-                "domingos": "Cerrado"
-            },
-            "ubicacion": "Estamos ubicados en [DIRECCIÓN COMPLETA]. Contamos con estacionamiento disponible.",
-            "doctor": "Dr. Xavier Xijemez Xifra - Médico Especialista en Medicina Interna",
-            "especialidades": [
-                "Diabetes Mellitus tipo 1 y 2",
-                "Hipertensión arterial",
-                "Enfermedades cardiovasculares",
-                "Problemas respiratorios",
-                "Trastornos endocrinos",
-                "Medicina preventiva"
-            ],
-            "preparacion_consulta": [
-                "Documento de identidad",
-                "Carnet de obra social",
-                "Estudios médicos previos",
-                "Lista de medicamentos actuales",
-                "Resumen de historia clínica"
-            ]
-        }
-    
     def handle_function_call(self, function_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
         """Manejar llamadas a funciones desde Vapi"""
         
@@ -132,12 +72,7 @@ class MedicalConsultationHandler:
     
     def get_appointment_info(self) -> Dict[str, Any]:
         """Obtener información general de citas"""
-        return {
-            "horarios": self.knowledge_base["horarios"],
-            "ubicacion": self.knowledge_base["ubicacion"],
-            "doctor": self.knowledge_base["doctor"],
-            "preparacion": self.knowledge_base["preparacion_consulta"]
-        }
+        return knowledge_store.function_result("get_appointment_info")
     
     def schedule_appointment(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Programar una cita"""
@@ -175,28 +110,11 @@ class MedicalConsultationHandler:
     
     def get_doctor_info(self) -> Dict[str, Any]:
         """Obtener información del doctor"""
-        return {
-            "name": "Dr. Xavier Xijemez Xifra",
-            "specialty": "Medicina Interna",
-            "experience": "Más de 5,000 consultas realizadas",
-            "certifications": [
-                "Consejo Mexicano de Medicina Interna",
-                "Colegio de Medicina Interna de México A.C.",
-                "Asociación Mexicana de Diabetes"
-            ],
-            "education": [
-                "UNAM - Facultad de Medicina",
-                "Hospital General de México - Residencia",
-                "Diplomado en Diabetes y Endocrinología"
-            ]
-        }
+        return knowledge_store.function_result("get_doctor_info")
     
     def get_specialties(self) -> Dict[str, Any]:
         """Obtener especialidades del consultorio"""
-        return {
-            "specialties": self.knowledge_base["especialidades"],
-            "description": "Especialista en medicina interna con enfoque en atención integral del paciente adulto"
-        }
+        return knowledge_store.function_result("get_specialties")
     
     def check_availability(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Verificar disponibilidad de horarios"""
@@ -250,11 +168,11 @@ def process_vapi_webhook(webhook_data: Dict[str, Any]) -> Dict[str, Any]:
         logger.error(f"Error procesando webhook: {str(e)}")
         return {"error": str(e)}
 
-def create_medical_call(phone_number: str, patient_info: Optional[Dict] = None) -> Dict[str, Any]:
+async def create_medical_call(phone_number: str, patient_info: Optional[Dict] = None) -> Dict[str, Any]:
     """Crear una llamada médica"""
     metadata = {
         "type": "medical_consultation",
         "patient_info": patient_info or {}
     }
     
-    return vapi_client.create_call(phone_number, metadata) 
\ No newline at end of file
+    return await vapi_client.create_call(phone_number, metadata) 
\ No newline at end of file